@@ -0,0 +1,281 @@
+import click
+import contextlib
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from tests.helpers import WealthSimpleLoginMock
+from ws_rebalancer.api_recording import RecordingApi, ReplayApi
+from ws_rebalancer.rebalancer import ENGINES, Rebalancer
+from ws_rebalancer.request_scheduler import RequestScheduler
+from ws_rebalancer.target_allocations_csv_reader import (
+    TargetAllocationsCsvReader
+)
+from ws_rebalancer.wealthsimple_portfolio_reader import (
+    BACKENDS, WealthSimplePortfolioReader
+)
+
+# The baselines depend on the machine they were recorded on, so they are
+# kept out of the repository and every machine saves its own
+BASELINES_FILE = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+POSITION_COUNTS = [10, 100, 1000, 10000, 100000]
+
+BUYING_POWERS = [100.0, 10000.0, 1000000.0, 10000000.0]
+
+# Portion of the tickers in the CSV-file that are not in the portfolio yet
+NEW_TICKER_FRACTION = 0.1
+
+ACCOUNT_ID = 'benchmark'
+
+
+class BenchmarkLoginMock(WealthSimpleLoginMock):
+    """The WealthSimple login mock used by the tests, already logged in and
+    with the securities indexed by ID so that looking up thousands of new
+    tickers doesn't scan every security each time.
+    """
+
+    def __init__(self):
+        WealthSimpleLoginMock.__init__(self, None, None)
+        self._securities_by_id = {security['id']: security
+                                  for security in self._securities}
+
+    def login(self, email, password, two_factor_callback=None):
+        pass
+
+    def get_security(self, security_id):
+        return self._securities_by_id[security_id]
+
+
+def _target_allocations(rng, num_positions):
+    """Random target allocations that add up to exactly 100%. Every target
+    allocation is a whole number of units, where the number of units is a
+    power of two, so that the sum of the target allocations is exact.
+    """
+    num_units = 1024
+    while num_units < num_positions:
+        num_units *= 2
+    units = [1] * num_positions
+    for _ in range(num_units - num_positions):
+        units[rng.randrange(num_positions)] += 1
+    return [unit * 100 / num_units for unit in units]
+
+
+def _synthetic_account(num_positions, buying_power, seed=0):
+    """Build a synthetic account and target allocations. Returns the login
+    mock, the rows of the target-allocations CSV-file and the security IDs
+    of the tickers that are not in the account yet.
+    """
+    rng = random.Random(seed)
+    num_new = int(num_positions * NEW_TICKER_FRACTION)
+    tickers = ['T{:06d}'.format(i) for i in range(num_positions)]
+    targets = _target_allocations(rng, num_positions)
+    positions = {}
+    securities = {}
+    security_ids = {}
+    for i, ticker in enumerate(tickers):
+        price = round(rng.uniform(5, 500), 2)
+        if i < num_positions - num_new:
+            positions[ticker] = {'price': price, 'qty': rng.randint(0, 100)}
+        else:
+            security_ids[ticker] = 'sec-{}'.format(ticker)
+            securities[ticker] = {'id': security_ids[ticker], 'name': ticker,
+                                  'price': price, 'exchange': 'TSX'}
+    BenchmarkLoginMock.test_positions = {
+        ACCOUNT_ID: {'buying_power': buying_power, 'positions': positions}}
+    BenchmarkLoginMock.test_securities = securities
+    rows = [[ticker, repr(target)] for ticker, target in zip(tickers, targets)]
+    return BenchmarkLoginMock(), rows, security_ids
+
+
+def _measure(setup, run, repeats):
+    """Time the best of a number of runs, and then measure the peak memory
+    allocated by one more run. The setup is called before each run and is not
+    measured. Returns the number of seconds and the peak number of bytes.
+    """
+    best = float('inf')
+    devnull = io.StringIO()
+    with contextlib.redirect_stdout(devnull), \
+            contextlib.redirect_stderr(devnull):
+        for _ in range(repeats):
+            args = setup()
+            start = time.perf_counter()
+            run(*args)
+            best = min(best, time.perf_counter() - start)
+            devnull.seek(0)
+            devnull.truncate()
+        args = setup()
+        tracemalloc.start()
+        try:
+            run(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def _replay_api(ws, target_allocations_csv, security_ids, fixture_file,
+                latency, jitter, failure_rate, max_request_rate):
+    """Record the responses the benchmarks get from the login mock, and
+    serve them again with the given latency, jitter and failures, through a
+    request scheduler that retries the failed calls.
+    """
+    recording = RecordingApi(ws)
+    with contextlib.redirect_stderr(io.StringIO()):
+        portfolio = WealthSimplePortfolioReader(recording).get_portfolio(
+            ACCOUNT_ID)
+        TargetAllocationsCsvReader(
+            target_allocations_csv, recording, security_ids=security_ids,
+            interactive=False).update_portfolio(portfolio)
+    recording.save(fixture_file)
+    ws = ReplayApi(fixture_file, latency=latency, jitter=jitter,
+                   failure_rate=failure_rate)
+    RequestScheduler(rate=max_request_rate).schedule_api(ws)
+    return ws
+
+
+def _benchmark_account(num_positions, csv_dir, backend, engine, repeats,
+                       latency=0.0, jitter=0.0, failure_rate=0.0,
+                       max_request_rate=None):
+    """Run every benchmark for an account with the given number of
+    positions. Yields the name, number of seconds and peak number of bytes
+    of each benchmark.
+    """
+    ws, rows, security_ids = _synthetic_account(num_positions,
+                                                BUYING_POWERS[0])
+    target_allocations_csv = os.path.join(
+        csv_dir, 'targets-{}.csv'.format(num_positions))
+    with open(target_allocations_csv, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+    update_name = ('update_portfolio', backend, num_positions)
+    if latency or jitter or failure_rate or max_request_rate:
+        ws = _replay_api(ws, target_allocations_csv, security_ids,
+                         os.path.join(csv_dir, 'responses.json'), latency,
+                         jitter, failure_rate, max_request_rate)
+        update_name += ('latency={:g}s+{:g}s'.format(latency, jitter),
+                        'failures={:g}'.format(failure_rate),
+                        'rate={}'.format(max_request_rate or 'unlimited'))
+    portfolio_reader = WealthSimplePortfolioReader(ws, backend=backend)
+
+    def read_portfolio():
+        return (portfolio_reader.get_portfolio(ACCOUNT_ID),)
+
+    def update_portfolio(portfolio):
+        TargetAllocationsCsvReader(
+            target_allocations_csv, ws, security_ids=security_ids,
+            interactive=False).update_portfolio(portfolio)
+        return portfolio
+
+    yield (update_name,) + _measure(
+        read_portfolio, update_portfolio, repeats)
+
+    with contextlib.redirect_stderr(io.StringIO()):
+        portfolio = update_portfolio(*read_portfolio())
+    yield (('drift_percentages', backend, num_positions),) + _measure(
+        lambda: (), portfolio.drift_percentages, repeats)
+
+    for buying_power in BUYING_POWERS:
+        portfolio.buying_power = buying_power
+        yield (('rebalance[{}]'.format(engine), backend, num_positions,
+                '${:.0f}'.format(buying_power)),) + _measure(
+            lambda: (portfolio,), lambda portfolio: (
+                Rebalancer.print_buys_for_rebalancing(portfolio,
+                                                      engine=engine)),
+            repeats)
+
+
+def _load_baselines():
+    if not os.path.exists(BASELINES_FILE):
+        return {}
+    with open(BASELINES_FILE) as f:
+        return json.load(f)
+
+
+@click.command(help=(
+    "Time the rebalancing engine, Portfolio.drift_percentages and "
+    "TargetAllocationsCsvReader.update_portfolio on synthetic portfolios, "
+    "and compare the results against the baselines saved on this "
+    "machine, if any."))
+@click.option('--max-positions', type=int, default=POSITION_COUNTS[-1],
+              show_default=True,
+              help="Largest number of positions to benchmark")
+@click.option('--engine', type=click.Choice(list(ENGINES)), default='lot',
+              show_default=True,
+              help="Engine used to compute the buys. The greedy engine buys "
+                   "one share at a time, so keep --max-positions low with it")
+@click.option('--portfolio-backend', 'backend',
+              type=click.Choice(list(BACKENDS)), default='objects',
+              show_default=True,
+              help="How the positions of the portfolio are stored")
+@click.option('--repeats', type=int, default=3, show_default=True,
+              help="Number of runs to take the best time of")
+@click.option('--time-tolerance', type=float, default=0.5,
+              show_default=True,
+              help="Fraction by which a benchmark may be slower than its "
+                   "baseline before it counts as a regression")
+@click.option('--memory-tolerance', type=float, default=0.1,
+              show_default=True,
+              help="Fraction by which a benchmark may use more memory than "
+                   "its baseline before it counts as a regression")
+@click.option('--latency', type=float, default=0.0, show_default=True,
+              help="Number of seconds each call to the WealthSimple API takes "
+                   "in the update_portfolio benchmark, served from recorded "
+                   "responses")
+@click.option('--jitter', type=float, default=0.0, show_default=True,
+              help="Largest number of seconds randomly added to the latency "
+                   "of each call")
+@click.option('--failure-rate', type=float, default=0.0, show_default=True,
+              help="Fraction of the calls that fail with a server error and "
+                   "get retried")
+@click.option('--max-request-rate', type=float,
+              help="Largest number of calls per second made on average. "
+                   "Unlimited by default")
+@click.option('--save-baselines', is_flag=True,
+              help="Save the results as the new baselines of this machine")
+def benchmark(max_positions, engine, backend, repeats, time_tolerance,
+              memory_tolerance, latency, jitter, failure_rate,
+              max_request_rate, save_baselines):
+    baselines = _load_baselines()
+    regressions = []
+    click.echo("{:<50} {:>10} {:>12} {:>10}".format(
+        "Benchmark", "Seconds", "Peak KiB", "Change"))
+    for num_positions in POSITION_COUNTS:
+        if num_positions > max_positions:
+            break
+        with tempfile.TemporaryDirectory() as csv_dir:
+            results = list(_benchmark_account(num_positions, csv_dir, backend,
+                                              engine, repeats, latency,
+                                              jitter, failure_rate,
+                                              max_request_rate))
+        for name, seconds, peak in results:
+            key = '/'.join(str(part) for part in name)
+            change = ''
+            baseline = baselines.get(key)
+            if baseline is not None:
+                change = '{:+.0%}'.format(seconds / baseline['seconds'] - 1)
+                if (seconds > baseline['seconds'] * (1 + time_tolerance) or
+                        peak > baseline['peak_bytes'] *
+                        (1 + memory_tolerance)):
+                    regressions.append(key)
+                    change += ' !'
+            click.echo("{:<50} {:>10.4f} {:>12.1f} {:>10}".format(
+                key, seconds, peak / 1024, change))
+            if save_baselines:
+                baselines[key] = {'seconds': seconds, 'peak_bytes': peak}
+    if save_baselines:
+        with open(BASELINES_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if regressions:
+        raise click.ClickException(
+            "{} benchmark(s) regressed: {}".format(len(regressions),
+                                                   ", ".join(regressions)))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,6 +1,10 @@
 import os
 import csv
 import stat
+from requests.structures import CaseInsensitiveDict
+
+from ws_rebalancer.portfolio import Portfolio
+from ws_rebalancer.position import Position
 
 
 def create_csv_file(directory, filename, data=None, is_readable=True):
@@ -25,3 +29,132 @@ def create_csv_file(directory, filename, data=None, is_readable=True):
                  stat.S_IXOTH)
 
     return path
+
+
+def random_portfolio(rng, max_positions=6, max_buying_power=800.00,
+                     ties=True):
+    """Build a small portfolio with random quantities, prices and target
+    allocations, along with random buying power. With ties, prices are often
+    shared between positions and target allocations can be half percents, so
+    that drifts end up tied.
+    """
+    num_positions = rng.randint(2, max_positions)
+    cuts = sorted(rng.sample(range(1, 100), num_positions - 1))
+    targets = [b - a for a, b in zip([0] + cuts, cuts + [100])]
+    if (ties and rng.random() < 0.3 and
+            targets[-1] > 0.5 * (num_positions - 1)):
+        targets = ([target + 0.5 for target in targets[:-1]] +
+                   [targets[-1] - 0.5 * (num_positions - 1)])
+    portfolio = Portfolio(round(rng.uniform(0.00, max_buying_power), 2))
+    for i, target in enumerate(targets):
+        price = round(rng.uniform(0.50, 60.00), 2)
+        if ties and rng.random() < 0.5:
+            price = rng.choice([0.10, 0.30, 1.10, 2.50, 3.00, 10.00, 25.00])
+        portfolio.add_position(Position('T{}'.format(i), rng.randint(0, 30),
+                                        price, target_allocation=target))
+    return portfolio
+
+
+class ResponseMock:
+    """Mocks the response of a request made to the WealthSimple Trade API."""
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+
+
+class TradeAPIMock:
+    """Mocks the login endpoints of the WealthSimple Trade API. Logging in
+    always requires a 2FA code, and every session can be refreshed unless the
+    test sets test_expired_sessions on the login mock.
+    """
+    def __init__(self, login_mock):
+        self._login_mock = login_mock
+        self.calls = []
+
+    def _new_session(self):
+        return ResponseMock(200, {
+            'X-Access-Token': 'access-token',
+            'X-Refresh-Token': 'refresh-token-{}'.format(len(self.calls))})
+
+    def makeRequest(self, method, endpoint, params=None):
+        self.calls.append(endpoint)
+        params = dict(params)
+        if endpoint == 'auth/refresh':
+            if getattr(self._login_mock, 'test_expired_sessions', False):
+                return ResponseMock(401, {})
+            return self._new_session()
+        if 'otp' not in params:
+            return ResponseMock(401, {'x-wealthsimple-otp': 'required'})
+        return self._new_session()
+
+
+class SessionMock:
+    """Mocks the requests session used to make calls to the WealthSimple Trade
+    API.
+    """
+    def __init__(self):
+        self.headers = {}
+
+
+class WealthSimpleLoginMock:
+    """Mocks the WealthSimpleLogin class which provides the WSTrade API. This
+    allows us to mock out the API calls we make in the app so that we don't
+    actually make calls to the WealthSimple Trade API backend as that would
+    get us rate-limited pretty quickly, or even blocke if they think we're
+    DDOSing them.
+    """
+    def __init__(self, email, password, two_factor_callback=None):
+        self._accounts = {}
+        self._positions = {}
+        self._securities = []
+        # build the dict containing info on the positions held by the client
+        # in the tests
+        if hasattr(self, 'test_positions'):
+            for account_id, account in self.test_positions.items():
+                self._positions[account_id] = []
+                buying_power = account['buying_power']
+                self._accounts[account_id] = {
+                    'buying_power': {'amount': buying_power}}
+                for ticker, position in account['positions'].items():
+                    position_dict = {'stock': {}, 'quote': {}}
+                    position_dict['stock']['symbol'] = ticker
+                    position_dict['quantity'] = position['qty']
+                    position_dict['quote']['amount'] = position['price']
+                    self._positions[account_id].append(position_dict)
+        # build the dict containing info on the securities used in the tests
+        if hasattr(self, 'test_securities'):
+            for ticker, security_info in self.test_securities.items():
+                security_dict = {'id': None, 'stock': {}, 'quote': {}}
+                security_dict['id'] = security_info['id']
+                security_dict['stock']['symbol'] = ticker
+                security_dict['stock']['name'] = security_info['name']
+                security_dict['stock']['primary_exchange'] = (
+                    security_info['exchange'])
+                security_dict['quote']['amount'] = security_info['price']
+                self._securities.append(security_dict)
+        # simulate logging in, which calls the sample two_factor_auth
+        # function
+        self.session = SessionMock()
+        self.TradeAPI = TradeAPIMock(self)
+        self.login(email, password, two_factor_callback=two_factor_callback)
+
+    def get_account_ids(self):
+        return list(self._accounts.keys())
+
+    def get_account(self, account_id):
+        return self._accounts[account_id]
+
+    def get_positions(self, account_id):
+        return self._positions[account_id]
+
+    def get_securities_from_ticker(self, ticker):
+        securities = []
+        for security in self._securities:
+            if ticker in security['stock']['symbol']:
+                securities.append(security)
+        return securities
+
+    def get_security(self, security_id):
+        for security in self._securities:
+            if security['id'] == security_id:
+                return security
@@ -0,0 +1,20 @@
+from click.testing import CliRunner
+
+from benchmarks.benchmark import benchmark
+
+
+def test_benchmark_smoke():
+    """Test that the benchmark suite runs on the smallest portfolio, without
+    failing on timing noise or touching the stored baselines.
+    """
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(benchmark,
+                           ['--max-positions', '10', '--repeats', '1',
+                            '--time-tolerance', '1000',
+                            '--memory-tolerance', '1000'],
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert "update_portfolio/objects/10 " in result.output
+    assert "drift_percentages/objects/10 " in result.output
+    assert "rebalance[lot]/objects/10/$10000000 " in result.output
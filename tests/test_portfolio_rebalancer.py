@@ -1,7 +1,39 @@
+import json
+import math
+import os
+import pytest
+import random
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from click.testing import CliRunner
 
+from ws_rebalancer.api_recording import ReplayApi
+from ws_rebalancer.array_portfolio import (
+    ArrayPortfolio, ArrayPortfolioOverlay
+)
+from ws_rebalancer.allocation_tree import AllocationTree
+from ws_rebalancer.cash_sweep import CashSweep
 from ws_rebalancer.cli import ws_rebalancer as wr
-from tests.helpers import create_csv_file
+from ws_rebalancer.household_portfolio import HouseholdPortfolio
+from ws_rebalancer.household_rebalancer import HouseholdRebalancer
+from ws_rebalancer.portfolio import Portfolio
+from ws_rebalancer.portfolio_overlay import PortfolioOverlay
+from ws_rebalancer.position import Position
+from ws_rebalancer.profiler import Profiler
+from ws_rebalancer.rebalancer import Rebalancer
+from ws_rebalancer.request_scheduler import ApiFailure, RequestScheduler
+from ws_rebalancer.security import Security
+from ws_rebalancer.security_cache import SecurityCache
+from ws_rebalancer.session_store import SessionStore
+from ws_rebalancer.target_allocations_csv_reader import (
+    TargetAllocationsCsvReader
+)
+from ws_rebalancer.tree_portfolio import TreePortfolio
+from ws_rebalancer.wealthsimple_login import WealthSimpleLogin
+from tests.helpers import ResponseMock, create_csv_file, random_portfolio
 
 
 def test_multiple_buys(testfiles_dir, wslogin_mock):
@@ -222,6 +254,57 @@ Error: Total combined allocation percentage (110.0) of all rows is not 100%
 """
 
 
+@pytest.mark.parametrize('test_portfolio, error', [
+    ([['GOOG', '40'], ['APPL', '30'], ['GOOG', '30']],
+     "Duplicate entry of ticker 'GOOG' on row 2"),
+    ([['GOOG', '40'], ['MSFT', '30']],
+     "Total combined allocation percentage (70.0) of all rows is not 100%"),
+    ([['GOOG', '40'], ['APPL', '0'], ['MSFT', '60']],
+     "Ticker APPL does not have a target allocation"),
+])
+def test_invalid_csv_fails_before_lookups(testfiles_dir, wslogin_mock,
+                                          mocker, test_portfolio, error):
+    """Test that the whole CSV-file is validated before any of the tickers
+    that are not in the portfolio are looked up on WealthSimple.
+    """
+    wslogin_mock.test_securities = {
+        'GOOG': {
+            'id': '123456',
+            'name': 'Google',
+            'price': 20.00,
+            'exchange': 'NASDAQ',
+        },
+    }
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 30.00,
+            'positions': {
+                'MSFT': {
+                    'price': 55.00,
+                    'qty': 1,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    searches = mocker.spy(wslogin_mock, 'get_securities_from_ticker')
+    lookups = mocker.spy(wslogin_mock, 'get_security')
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa'],
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 1
+    assert result.stderr == "Error: {}\n".format(error)
+    assert searches.call_count == 0
+    assert lookups.call_count == 0
+
+
 def test_no_assets(testfiles_dir, wslogin_mock):
     """Test that the app correctly prints a message informing the user that
     row is badly formatted.
@@ -479,3 +562,1860 @@ def test_mistyped_ticker_not_in_portfolio(testfiles_dir, wslogin_mock):
     assert result.stderr == """\
 Error: Row 0 - rename ticker 'MSF' to 'MSFT'
 """
+
+
+@pytest.mark.parametrize('backend', ['objects', 'arrays'])
+@pytest.mark.parametrize('engine', ['greedy', 'heap', 'lot', 'fixed'])
+def test_engines_buy_like_greedy(testfiles_dir, wslogin_mock, engine,
+                                 backend):
+    """Test that every engine produces the same buys as the
+    one-share-at-a-time greedy loop when float rounding doesn't decide any
+    of them, including the lowest-price tie-break and skipping positions
+    that can no longer be afforded.
+    """
+    test_portfolio = [
+        ['MSFT', '40'],
+        ['APPL', '25'],
+        ['GOOG', '20'],
+        ['AMZN', '15'],
+    ]
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 1010.00,
+            'positions': {
+                'MSFT': {
+                    'price': 55.00,
+                    'qty': 4,
+                },
+                'APPL': {
+                    'price': 30.00,
+                    'qty': 1,
+                },
+                'GOOG': {
+                    'price': 15.00,
+                    'qty': 2,
+                },
+                'AMZN': {
+                    'price': 400.00,
+                    'qty': 0,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--engine', engine,
+                            '--portfolio-backend', backend],
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Buy 1X AMZN @ 400.00 - New allocation 31.25%
+Buy 8X APPL @ 30.00 - New allocation 21.09%
+Buy 13X GOOG @ 15.00 - New allocation 17.58%
+Buy 3X MSFT @ 55.00 - New allocation 30.08%
+Remaining cash $10.00
+""" in result.output
+
+
+@pytest.mark.parametrize('engine', ['greedy', 'heap', 'lot', 'fixed'])
+def test_engines_unaffordable_positions(testfiles_dir, wslogin_mock, engine):
+    """Test that every engine skips positions that can't be afforded with the
+    remaining cash, even when they are the furthest below their target
+    allocation.
+    """
+    test_portfolio = [
+        ['MSFT', '70'],
+        ['APPL', '20'],
+        ['GOOG', '10'],
+    ]
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 130.00,
+            'positions': {
+                'MSFT': {
+                    'price': 500.00,
+                    'qty': 1,
+                },
+                'APPL': {
+                    'price': 20.00,
+                    'qty': 1,
+                },
+                'GOOG': {
+                    'price': 15.00,
+                    'qty': 1,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--engine', engine],
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Buy 4X APPL @ 20.00 - New allocation 15.15%
+Buy 3X GOOG @ 15.00 - New allocation 9.09%
+Remaining cash $5.00
+""" in result.output
+
+
+def planned_buys(portfolio, engine):
+    """The shares each engine buys in the portfolio, in ticker order, and the
+    cash left over.
+    """
+    plan = Rebalancer.plan_for_rebalancing(portfolio, engine=engine)
+    return (sorted((buy['ticker'], buy['quantity']) for buy in plan['buys']),
+            plan['remaining_cash'])
+
+
+def test_heap_engine_rounding_ties():
+    """Test that the heap engine keeps buying when positions are only tied
+    in drift up to float rounding, and that it makes the same buys as the
+    greedy loop in random portfolios.
+    """
+    portfolio = Portfolio(1835.31)
+    portfolio.add_position(Position('T0', 20, 3.00, target_allocation=42))
+    portfolio.add_position(Position('T1', 6, 10.00, target_allocation=51))
+    portfolio.add_position(Position('T2', 3, 2.50, target_allocation=7))
+    buys, remaining_cash = planned_buys(portfolio, 'heap')
+    assert buys == [('T0', 255), ('T1', 94), ('T2', 52)]
+    assert remaining_cash == pytest.approx(0.31)
+
+    rng = random.Random(0)
+    for _ in range(100):
+        portfolio = random_portfolio(rng)
+        assert planned_buys(portfolio, 'heap') == planned_buys(portfolio,
+                                                               'greedy')
+
+
+def test_lot_engine_rounding_ties():
+    """Test that the lot engine makes the same buys as the greedy loop when
+    float rounding decides them, as when the greedy loop lands exactly on the
+    target allocations or positions are tied in drift, and in random
+    portfolios.
+    """
+    portfolio = Portfolio(558.68)
+    portfolio.add_position(Position('T0', 3, 0.10, target_allocation=28.5))
+    portfolio.add_position(Position('T1', 16, 0.10, target_allocation=71.5))
+    assert planned_buys(portfolio, 'lot') == planned_buys(portfolio,
+                                                          'greedy')
+    buys, _ = planned_buys(portfolio, 'lot')
+    assert buys == [('T0', 225), ('T1', 556)]
+
+    portfolio = Portfolio(790.00)
+    portfolio.add_position(Position('T0', 8, 25.00, target_allocation=9))
+    portfolio.add_position(Position('T1', 30, 0.30, target_allocation=41))
+    portfolio.add_position(Position('T2', 12, 0.10, target_allocation=10))
+    portfolio.add_position(Position('T3', 6, 21.59, target_allocation=15))
+    portfolio.add_position(Position('T4', 12, 0.10, target_allocation=25))
+    buys, _ = planned_buys(portfolio, 'lot')
+    assert buys == [('T1', 1372), ('T2', 1014), ('T3', 1), ('T4', 2554)]
+
+    rng = random.Random(0)
+    for i in range(200):
+        portfolio = random_portfolio(rng, ties=i % 2 == 0)
+        greedy_buys, greedy_cash = planned_buys(portfolio, 'greedy')
+        lot_buys, lot_cash = planned_buys(portfolio, 'lot')
+        assert lot_buys == greedy_buys
+        assert lot_cash == pytest.approx(greedy_cash)
+
+
+def test_arrays_backend_new_tickers(testfiles_dir, wslogin_mock):
+    """Test that the arrays portfolio backend handles tickers that are only
+    in the target allocations CSV-file, and positions without a target
+    allocation.
+    """
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '50'],
+    ]
+    wslogin_mock.test_securities = {
+        'GOOG': {
+            'id': '123456',
+            'name': 'Google',
+            'price': 20.00,
+            'exchange': 'NASDAQ',
+        },
+    }
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 100.00,
+            'positions': {
+                'MSFT': {
+                    'price': 10.00,
+                    'qty': 4,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--portfolio-backend',
+                            'arrays'],
+                           input='password\npassword\n12345\n0\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Buy 3X GOOG @ 20.00 - New allocation 46.15%
+Buy 3X MSFT @ 10.00 - New allocation 53.85%
+Remaining cash $10.00
+""" in result.output
+
+    test_portfolio = [
+        ['GOOG', '100'],
+    ]
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--portfolio-backend',
+                            'arrays'],
+                           input='password\npassword\n12345\n0\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 1
+    assert result.stderr == """\
+Error: Ticker MSFT does not have a target allocation
+"""
+
+
+def test_array_portfolio():
+    """Test that the arrays portfolio backend returns whole quantities as
+    ints, and that its total and drift percentages are kept until a position
+    changes.
+    """
+    portfolio = ArrayPortfolio(0.00)
+    portfolio.add_position(Position('MSFT', 4, 10.00, target_allocation=50))
+    portfolio.add_position(Position('GOOG', 2.5, 20.00, target_allocation=50))
+    assert portfolio['MSFT'].qty == 4
+    assert isinstance(portfolio['MSFT'].qty, int)
+    assert portfolio['GOOG'].qty == 2.5
+
+    assert portfolio.drift_percentage('MSFT') == pytest.approx(-100 / 9)
+    drift_percentages = portfolio._drift_percentages()
+    assert portfolio._drift_percentages() is drift_percentages
+    portfolio['MSFT'].qty += 1
+    assert portfolio.drift_percentage('MSFT') == 0.0
+    portfolio['GOOG'].target_allocation = 25
+    assert portfolio.drift_percentage('GOOG') == 100.0
+
+    # The total is also kept until a position changes
+    assert portfolio.get_current_allocation('MSFT') == 50.0
+    assert portfolio._total() == 100.00
+    portfolio['GOOG'].qty = 0
+    assert portfolio._total() == 50.00
+    assert portfolio.get_current_allocation('MSFT') == 100.0
+
+
+def test_array_portfolio_overlay():
+    """Test that buys for the arrays portfolio backend are planned in an
+    overlay that computes drift with vectorized operations, and gets the
+    same drifts as computing it position by position.
+    """
+    rng = random.Random(14)
+    for _ in range(50):
+        portfolio = ArrayPortfolio(0.00)
+        for position in random_portfolio(rng).positions.values():
+            portfolio.add_position(position)
+        overlay = PortfolioOverlay(portfolio)
+        array_overlay = PortfolioOverlay.of(portfolio)
+        assert isinstance(array_overlay, ArrayPortfolioOverlay)
+        for ticker in rng.choices(list(portfolio.positions), k=10):
+            overlay[ticker].qty += 1
+            array_overlay[ticker].qty += 1
+            assert array_overlay.drift_percentages() == \
+                overlay.drift_percentages()
+
+
+@pytest.mark.parametrize('objective', ['absolute', 'squared'])
+def test_exact_engine(testfiles_dir, wslogin_mock, objective):
+    """Test that the exact engine finds buys that land closer to the target
+    allocations than the greedy loop, and that it falls back to the greedy
+    buys when it runs out of time.
+    """
+    # The greedy loop buys 1X APPL and 1X MSFT, which overshoots the MSFT
+    # target allocation by more than leaving the cash unspent
+    test_portfolio = [
+        ['MSFT', '40'],
+        ['APPL', '60'],
+    ]
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 210.00,
+            'positions': {
+                'MSFT': {
+                    'price': 65.00,
+                    'qty': 2,
+                },
+                'APPL': {
+                    'price': 105.00,
+                    'qty': 1,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--engine', 'exact',
+                            '--objective', objective],
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Buy 1X APPL @ 105.00 - New allocation 61.76%
+Remaining cash $105.00
+""" in result.output
+
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--engine', 'exact',
+                            '--objective', objective, '--time-budget', '0'],
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Buy 1X APPL @ 105.00 - New allocation 51.85%
+Buy 1X MSFT @ 65.00 - New allocation 48.15%
+Remaining cash $40.00
+""" in result.output
+
+
+def test_all_accounts(testfiles_dir, wslogin_mock):
+    """Test that every account is rebalanced without prompting for one, using
+    the target allocations given for that account if there are any.
+    """
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '50'],
+    ]
+    tfsa_portfolio = [
+        ['MSFT', '100'],
+    ]
+    wslogin_mock.test_positions = {
+        'rrsp': {
+            'buying_power': 100.00,
+            'positions': {
+                'MSFT': {
+                    'price': 50.00,
+                    'qty': 1,
+                },
+                'GOOG': {
+                    'price': 25.00,
+                    'qty': 0,
+                },
+            }
+        },
+        'tfsa': {
+            'buying_power': 120.00,
+            'positions': {
+                'MSFT': {
+                    'price': 50.00,
+                    'qty': 1,
+                },
+            }
+        },
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    tfsa_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "tfsa_portfolio.csv",
+                                         data=tfsa_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--all-accounts',
+                            '--account-targets', 'tfsa', tfsa_portfolio_csv],
+                           input='password\npassword\n12345\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert result.output.endswith("""\
+Enter 2FA code: 12345
+Account rrsp:
+Buy 3X GOOG @ 25.00 - New allocation 60.00%
+Remaining cash $25.00
+Account tfsa:
+Buy 2X MSFT @ 50.00 - New allocation 100.00%
+Remaining cash $20.00
+""")
+
+
+def test_new_tickers_searched_before_prompting(testfiles_dir, wslogin_mock,
+                                               mocker):
+    """Test that every new ticker is searched for before prompting for any of
+    the securities, and that the prompts are still in row order.
+    """
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '50'],
+    ]
+    wslogin_mock.test_securities = {
+        'MSFT': {
+            'id': '123456',
+            'name': 'Microsoft',
+            'price': 50.00,
+            'exchange': 'NYSE',
+        },
+        'GOOG': {
+            'id': '123457',
+            'name': 'Google',
+            'price': 25.00,
+            'exchange': 'NASDAQ',
+        },
+    }
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 100.00,
+            'positions': {}
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    events = []
+    search = wslogin_mock.get_securities_from_ticker
+    mocker.patch.object(
+        wslogin_mock, 'get_securities_from_ticker',
+        lambda self, ticker: events.append(ticker) or search(self, ticker))
+    choose = TargetAllocationsCsvReader._choose_security
+    mocker.patch.object(
+        TargetAllocationsCsvReader, '_choose_security',
+        lambda self, ticker, row_num, securities: events.append(
+            'prompt') or choose(self, ticker, row_num, securities))
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa'],
+                           input='password\npassword\n12345\n0\n0\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert sorted(events[:2]) == ['GOOG', 'MSFT']
+    assert events[2:] == ['prompt', 'prompt']
+    assert """\
+Buy 2X GOOG @ 25.00 - New allocation 50.00%
+Buy 1X MSFT @ 50.00 - New allocation 50.00%
+Remaining cash $0.00
+""" in result.output
+
+
+def test_security_cache(testfiles_dir, wslogin_mock, cache_dir, mocker):
+    """Test that the security picked for a new ticker is remembered between
+    runs, and that --refresh-securities searches for the ticker again.
+    """
+    test_portfolio = [
+        ['MSFT', '100'],
+    ]
+    wslogin_mock.test_securities = {
+        'MSFT': {
+            'id': '123456',
+            'name': 'Microsoft',
+            'price': 100.00,
+            'exchange': 'NYSE',
+        },
+    }
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 100.00,
+            'positions': {}
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    search = mocker.spy(wslogin_mock, 'get_securities_from_ticker')
+    cache_dir.mkdir()
+    (cache_dir / 'securities.json').write_text('corrupt')
+
+    runner = CliRunner(mix_stderr=False)
+    args = ['rebalance', '-t', test_portfolio_csv, '--email', 'test@mail.com',
+            '--2fa', '--save-session']
+    result = runner.invoke(wr, args, input='password\npassword\n12345\n0\n0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "Please input the security you want" in result.output
+    assert search.call_count == 1
+
+    result = runner.invoke(wr, args, input='0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "Please input the security you want" not in result.output
+    assert search.call_count == 1
+    assert """\
+Buy 1X MSFT @ 100.00 - New allocation 100.00%
+Remaining cash $0.00
+""" in result.output
+
+    result = runner.invoke(wr, args + ['--refresh-securities'],
+                           input='0\n0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "Please input the security you want" in result.output
+    assert search.call_count == 2
+
+    # Cached securities are looked up again once they expire
+    mocker.patch.object(SecurityCache, 'MAX_AGE', -1)
+    result = runner.invoke(wr, args, input='0\n0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert search.call_count == 3
+
+
+def test_quote_cache(testfiles_dir, wslogin_mock, mocker):
+    """Test that recent enough prices are reused between runs when
+    --max-quote-age is given, and that the time each price was quoted at is
+    shown next to it.
+    """
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '50'],
+    ]
+    wslogin_mock.test_securities = {
+        'GOOG': {
+            'id': '123456',
+            'name': 'Google',
+            'price': 25.00,
+            'exchange': 'NASDAQ',
+        },
+    }
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 100.00,
+            'positions': {
+                'MSFT': {
+                    'price': 50.00,
+                    'qty': 1,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    get_security = mocker.spy(wslogin_mock, 'get_security')
+    mocker.patch('ws_rebalancer.plan_writer.time.localtime',
+                 return_value=(2020, 1, 2, 3, 4, 5, 3, 2, 0))
+
+    runner = CliRunner(mix_stderr=False)
+    args = ['rebalance', '-t', test_portfolio_csv, '--email', 'test@mail.com',
+            '--2fa', '--save-session', '--max-quote-age', '600']
+    result = runner.invoke(wr, args, input='password\npassword\n12345\n0\n0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert get_security.call_count == 1
+
+    result = runner.invoke(wr, args, input='0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert get_security.call_count == 1
+    assert """\
+Buy 3X GOOG @ 25.00 (quoted 2020-01-02 03:04:05) - New allocation 60.00%
+Remaining cash $25.00
+""" in result.output
+
+    # Quotes that are too old are fetched again
+    result = runner.invoke(wr, args[:-1] + ['0.000001'],
+                           input='0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert get_security.call_count == 2
+
+
+def test_saved_session(testfiles_dir, wslogin_mock, cache_dir):
+    """Test that the WealthSimple session is saved after logging in so that
+    later runs skip the password and 2FA prompts, and that we fall back to
+    logging in when the saved session can't be refreshed.
+    """
+    test_portfolio = [
+        ['MSFT', '100'],
+    ]
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 100.00,
+            'positions': {
+                'MSFT': {
+                    'price': 50.00,
+                    'qty': 1,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    args = ['rebalance', '-t', test_portfolio_csv, '--email', 'test@mail.com',
+            '--2fa']
+    # Sessions are only saved when asked for
+    result = runner.invoke(wr, args, input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert not (cache_dir / 'sessions.json').exists()
+
+    args.append('--save-session')
+    result = runner.invoke(wr, args + ['--password', 'password'],
+                           input='12345\n0\n', catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "Enter 2FA code" in result.output
+    assert (cache_dir / 'sessions.json').stat().st_mode & 0o777 == 0o600
+
+    result = runner.invoke(wr, args, input='0\n', catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "Password" not in result.output
+    assert "Enter 2FA code" not in result.output
+    assert """\
+Buy 2X MSFT @ 50.00 - New allocation 100.00%
+Remaining cash $0.00
+""" in result.output
+
+    wslogin_mock.test_expired_sessions = True
+    result = runner.invoke(wr, args, input='password\n12345\n0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "Password: \nEnter 2FA code: 12345\n" in result.output
+
+
+def test_session_file_created_private(tmp_path, monkeypatch):
+    """Test that the saved sessions are written to a file that is created
+    readable only by the user, rather than made private after it is created.
+    """
+    modes = []
+    os_open = os.open
+
+    def recording_open(path, flags, mode=0o777):
+        modes.append(mode)
+        return os_open(path, flags, mode)
+
+    monkeypatch.setattr(os, 'open', recording_open)
+    session_store = SessionStore(str(tmp_path))
+    session_store.set('test@mail.com', 'refresh-token')
+    session_store.save()
+    assert modes == [0o600]
+    assert (tmp_path / 'sessions.json').stat().st_mode & 0o777 == 0o600
+    assert SessionStore(str(tmp_path)).get('test@mail.com') == 'refresh-token'
+
+
+def test_headless(testfiles_dir, wslogin_mock, tmp_path, mocker):
+    """Test that a run driven by a config file never prompts, and that the
+    buys can be written as JSON or CSV.
+    """
+    mocker.patch('ws_rebalancer.plan_writer.time.localtime', time.gmtime)
+    mocker.patch('ws_rebalancer.target_allocations_csv_reader.time.time',
+                 return_value=0)
+    mocker.patch('ws_rebalancer.wealthsimple_portfolio_reader.time.time',
+                 return_value=0)
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '50'],
+    ]
+    wslogin_mock.test_securities = {
+        'GOOG': {
+            'id': '123456',
+            'name': 'Google',
+            'price': 20.00,
+            'exchange': 'NASDAQ',
+        },
+        'GOOGL': {
+            'id': '654321',
+            'name': 'Google Class A',
+            'price': 20.00,
+            'exchange': 'NASDAQ',
+        },
+        'MSFT': {
+            'id': '111111',
+            'name': 'Microsoft',
+            'price': 10.00,
+            'exchange': 'NASDAQ',
+        },
+    }
+    wslogin_mock.test_positions = {
+        'rrsp': {
+            'buying_power': 10.00,
+            'positions': {}
+        },
+        'tfsa': {
+            'buying_power': 100.00,
+            'positions': {
+                'MSFT': {
+                    'price': 10.00,
+                    'qty': 4,
+                },
+            }
+        },
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    config_file = tmp_path / 'config.json'
+    config_file.write_text(json.dumps({
+        'target_allocations_csv': test_portfolio_csv,
+        'email': 'test@mail.com',
+        'account_id': 'tfsa',
+        'save_session': True,
+        'securities': {'GOOG': '123456', 'MSFT': '111111'},
+    }))
+
+    # Log in once to save the session, since the account requires 2FA
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr, ['rebalance', '--config', str(config_file),
+                                '--password', 'password', '--2fa'],
+                           input='12345\n', catch_exceptions=False)
+    assert result.exit_code == 0
+
+    args = ['rebalance', '--config', str(config_file), '--headless']
+    result = runner.invoke(wr, args + ['--output', 'json'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert json.loads(result.output) == {
+        'accounts': [{
+            'account_id': 'tfsa',
+            'sells': [],
+            'buys': [
+                {'ticker': 'GOOG', 'quantity': 3, 'price': 20.0,
+                 'new_allocation': 46.15384615384615,
+                 'quote_time': '1970-01-01T00:00:00+0000'},
+                {'ticker': 'MSFT', 'quantity': 3, 'price': 10.0,
+                 'new_allocation': 53.84615384615385,
+                 'quote_time': '1970-01-01T00:00:00+0000'},
+            ],
+            'remaining_cash': 10.0,
+        }],
+    }
+    assert result.stderr == "Warning: 'GOOG' is not in your portfolio\n"
+
+    result = runner.invoke(wr, args + ['--output', 'text'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == """\
+Buy 3X GOOG @ 20.00 - New allocation 46.15%
+Buy 3X MSFT @ 10.00 - New allocation 53.85%
+Remaining cash $10.00
+"""
+
+    result = runner.invoke(wr, args + ['--all-accounts', '--output', 'csv'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        'account_id,action,ticker,quantity,price,new_allocation,quote_time',
+        'rrsp,buy,MSFT,1,10.0,100.0,1970-01-01T00:00:00+0000',
+        'rrsp,cash,,,0.0,,',
+        'tfsa,buy,GOOG,3,20.0,46.15384615384615,1970-01-01T00:00:00+0000',
+        'tfsa,buy,MSFT,3,10.0,53.84615384615385,1970-01-01T00:00:00+0000',
+        'tfsa,cash,,,10.0,,',
+    ]
+
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOGL', '50'],
+    ]
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    result = runner.invoke(wr, args + ['-t', test_portfolio_csv],
+                           catch_exceptions=False)
+    assert result.exit_code == 1
+    assert result.stderr == """\
+Error: Row 1 - no security is pinned for ticker 'GOOGL'
+"""
+
+
+def test_headless_errors(testfiles_dir, wslogin_mock, tmp_path):
+    """Test that headless runs fail instead of prompting."""
+    test_portfolio = [
+        ['MSFT', '100'],
+    ]
+    wslogin_mock.test_positions = {
+        'tfsa': {
+            'buying_power': 100.00,
+            'positions': {
+                'MSFT': {
+                    'price': 10.00,
+                    'qty': 4,
+                },
+            }
+        },
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    runner = CliRunner(mix_stderr=False)
+    args = ['rebalance', '-t', test_portfolio_csv, '--email', 'test@mail.com',
+            '--save-session', '--headless']
+
+    result = runner.invoke(wr, args + ['--password', 'password'])
+    assert result.exit_code == 2
+    assert ("--headless requires --account-id or --all-accounts" in
+            result.stderr)
+
+    result = runner.invoke(wr, args + ['--account-id', 'tfsa'])
+    assert result.exit_code == 2
+    assert ("--headless requires --password or a session saved with "
+            "--save-session" in result.stderr)
+
+    result = runner.invoke(wr, args + ['--account-id', 'tfsa', '--password',
+                                       'password', '--2fa'])
+    assert result.exit_code == 1
+    assert "A 2FA code is needed to log in" in result.stderr
+
+    result = runner.invoke(wr, args[:-1] + ['--account-id', 'tfsa',
+                                            '--password', 'password',
+                                            '--2fa'],
+                           input='12345\n', catch_exceptions=False)
+    assert result.exit_code == 0
+    result = runner.invoke(wr, args + ['--account-id', 'rrsp'])
+    assert result.exit_code == 1
+    assert result.stderr == "Error: Account 'rrsp' cannot be found\n"
+
+    config_file = tmp_path / 'config.json'
+    config_file.write_text('[]')
+    result = runner.invoke(wr, args + ['--config', str(config_file)])
+    assert result.exit_code == 2
+    assert "Expecting a JSON object" in result.stderr
+    config_file.write_text('{')
+    result = runner.invoke(wr, args + ['--config', str(config_file)])
+    assert result.exit_code == 2
+    assert "Invalid JSON" in result.stderr
+
+
+def test_profile(testfiles_dir, wslogin_mock, tmp_path):
+    """Test that --profile records the time of each phase, the calls made to
+    WealthSimple and the work done planning the buys.
+    """
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '50'],
+    ]
+    wslogin_mock.test_securities = {
+        'GOOG': {
+            'id': '123456',
+            'name': 'Google',
+            'price': 20.00,
+            'exchange': 'NASDAQ',
+        },
+    }
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 100.00,
+            'positions': {
+                'MSFT': {
+                    'price': 10.00,
+                    'qty': 4,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    profile_file = tmp_path / 'profile.json'
+
+    runner = CliRunner(mix_stderr=False)
+    args = ['rebalance', '-t', test_portfolio_csv, '--email', 'test@mail.com',
+            '--2fa', '--save-session']
+    result = runner.invoke(wr, args + ['--profile', 'json', '--profile-file',
+                                       str(profile_file)],
+                           input='password\npassword\n12345\n0\n0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert """\
+Buy 3X GOOG @ 20.00 - New allocation 46.15%
+Buy 3X MSFT @ 10.00 - New allocation 53.85%
+Remaining cash $10.00
+""" in result.output
+    profile = json.loads(profile_file.read_text())
+    assert list(profile['phases']) == ['login', 'account fetch', 'CSV parse',
+                                       'security lookups', 'rebalancing']
+    assert {method: calls['count']
+            for method, calls in profile['api_calls'].items()} == {
+        'get_account_ids': 1,
+        'get_account': 1,
+        'get_positions': 1,
+        'get_securities_from_ticker': 1,
+        'get_security': 1,
+    }
+    # The greedy loop buys 6 shares and then finds nothing left to buy
+    assert profile['counters'] == {'greedy iterations': 7,
+                                   'drift evaluations': 14}
+    assert profile['peak_memory_bytes'] > 0
+
+    for engine in ['heap', 'exact']:
+        result = runner.invoke(wr, args + ['--engine', engine,
+                                           '--profile', 'text'],
+                               input='0\n', catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "Profile:" in result.stderr
+        assert "rebalancing" in result.stderr
+        assert "get_security " in result.stderr
+        assert "drift evaluations" in result.stderr
+        assert "greedy iterations" not in result.stderr
+
+
+def test_planning_counters():
+    """Test that each engine counts its work only in the profiler it is
+    given, so that plans made at the same time without a profiler don't add
+    to the counters.
+    """
+    rng = random.Random(0)
+    portfolio = random_portfolio(rng, max_positions=4,
+                                 max_buying_power=200.00)
+    for engine in ['greedy', 'heap', 'lot', 'exact', 'fixed', 'two-sided',
+                   'fractional']:
+        profiler = Profiler(enabled=True)
+        Rebalancer.plan_for_rebalancing(portfolio, engine=engine,
+                                        profiler=profiler)
+        counters = profiler.summary()['counters']
+        assert counters['drift evaluations'] > 0
+        assert ('greedy iterations' in counters) == (engine == 'greedy')
+
+    # Plans that take long enough to run at the same time as each other
+    portfolio = random_portfolio(rng, max_buying_power=5000.00)
+    for engine in ['greedy', 'heap', 'lot', 'fixed']:
+        profiler = Profiler(enabled=True)
+        Rebalancer.plan_for_rebalancing(portfolio, engine=engine,
+                                        profiler=profiler)
+        counters = profiler.summary()['counters']
+
+        profiler = Profiler(enabled=True)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            others = [executor.submit(Rebalancer.plan_for_rebalancing,
+                                      portfolio, engine=engine)
+                      for _ in range(4)]
+            Rebalancer.plan_for_rebalancing(portfolio, engine=engine,
+                                            profiler=profiler)
+            for other in others:
+                other.result()
+        assert profiler.summary()['counters'] == counters
+
+
+def test_incremental_totals():
+    """Test that the total value, allocations and drifts of a portfolio are
+    exactly those of the same portfolio built from scratch, however many
+    times the quantities of its positions have changed.
+    """
+    rng = random.Random(0)
+    portfolio = random_portfolio(rng)
+    for i in range(1000):
+        position = rng.choice(list(portfolio.positions.values()))
+        position.qty = max(position.qty + rng.randint(-20, 20), 0)
+        if i % 10:
+            continue
+        fresh_portfolio = Portfolio(portfolio.buying_power)
+        for p in portfolio.positions.values():
+            fresh_portfolio.add_position(Position(
+                p.ticker, p.qty, p.price,
+                target_allocation=p.target_allocation))
+        assert portfolio._total() == fresh_portfolio._total()
+        assert (portfolio.drift_percentages() ==
+                fresh_portfolio.drift_percentages())
+        for ticker in portfolio.positions:
+            assert (portfolio.get_current_allocation(ticker) ==
+                    fresh_portfolio.get_current_allocation(ticker))
+
+    # Values of very different sizes would lose the small changes if they
+    # were added up with rounding
+    portfolio = Portfolio(0.00)
+    for i, price in enumerate([1e-3, 0.10, 3.33, 1e6, 7.77e12]):
+        portfolio.add_position(Position('T{}'.format(i), 1, price,
+                                        target_allocation=20))
+    for _ in range(1000):
+        position = rng.choice(list(portfolio.positions.values()))
+        position.qty = rng.randint(0, 10 ** rng.randint(0, 6))
+        assert portfolio._total() == math.fsum(
+            p.price * p.qty for p in portfolio.positions.values())
+        assert len(portfolio._partials) <= Portfolio._MAX_PARTIALS
+
+
+def test_portfolio_overlay():
+    """Test that planning in an overlay leaves the base portfolio unchanged,
+    so that several plans can share it.
+    """
+    portfolio = Portfolio(100.00)
+    portfolio.add_position(Position('MSFT', 4, 10.00, target_allocation=50))
+    portfolio.add_position(Position('GOOG', 0, 20.00, target_allocation=50))
+
+    plan = Rebalancer.plan_for_rebalancing(portfolio)
+    assert [(buy['ticker'], buy['quantity']) for buy in plan['buys']] == [
+        ('GOOG', 3), ('MSFT', 3)]
+    assert plan['remaining_cash'] == 10.00
+    assert Rebalancer.plan_for_rebalancing(portfolio) == plan
+    assert portfolio['MSFT'].qty == 4
+    assert portfolio['GOOG'].qty == 0
+    assert portfolio.buying_power == 100.00
+
+    overlay = PortfolioOverlay(portfolio)
+    overlay['GOOG'].qty += 2
+    overlay.buying_power -= 40.00
+    nested_overlay = PortfolioOverlay(overlay)
+    nested_overlay['MSFT'].qty += 1
+    nested_overlay.buying_power -= 10.00
+    assert overlay.added_shares == {'GOOG': 2}
+    assert overlay.cash_spent == 40.00
+    assert nested_overlay.added_shares == {'MSFT': 1}
+    assert nested_overlay.cash_spent == 10.00
+    assert nested_overlay.positions['GOOG'].qty == 2
+    assert 'MSFT' in nested_overlay.positions
+    assert len(nested_overlay.positions) == 2
+    assert nested_overlay.get_current_allocation('MSFT') == pytest.approx(
+        500 / 9)
+    assert nested_overlay.drift_percentages() == pytest.approx(
+        {'MSFT': 100 / 9, 'GOOG': -100 / 9})
+    assert overlay.drift_percentage('MSFT') == 0.0
+    assert portfolio.drift_percentage('GOOG') == -100.0
+
+
+def test_compact_records():
+    """Test that positions and securities don't carry an instance dict, that
+    changing the quantity of a position still revalues its portfolio, and
+    that the ticker and price the position is valued by can't be changed.
+    """
+    portfolio = Portfolio(0.00)
+    position = Position('MSFT', 1, 10.00, target_allocation=100)
+    portfolio.add_position(position)
+    assert not hasattr(position, '__dict__')
+    assert portfolio.get_current_allocation('MSFT') == 100.0
+    position.qty += 2
+    assert portfolio._total() == 30.00
+    with pytest.raises(AttributeError):
+        position.price = 20.00
+    with pytest.raises(AttributeError):
+        position.ticker = 'GOOG'
+    assert portfolio._total() == 30.00
+
+    security = Security('sec-s-msft', 'MSFT', 10.00)
+    assert not hasattr(security, '__dict__')
+    assert security.quote_time is None
+    assert (security.security_id, security.ticker, security.price) == (
+        'sec-s-msft', 'MSFT', 10.00)
+
+
+def test_fixed_point_engine(testfiles_dir, wslogin_mock):
+    """Test that target allocations adding up to 100% are accepted even when
+    their float sum is not exactly 100, and that the fixed-point engine
+    spends the buying power exactly where float rounding would leave a share
+    unbought.
+    """
+    test_portfolio = [['MSFT', '9.1']] + [
+        ['T{}'.format(i), '10.1'] for i in range(9)]
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 0.30,
+            'positions': {
+                'MSFT': {
+                    'price': 0.10,
+                    'qty': 0,
+                },
+            }
+        }
+    }
+    wslogin_mock.test_positions[0]['positions'].update({
+        'T{}'.format(i): {'price': 1000.00, 'qty': 1} for i in range(9)})
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--engine', 'greedy'],
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert "Buy 2X MSFT @ 0.10" in result.output
+
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--engine', 'fixed'],
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Buy 3X MSFT @ 0.10 - New allocation 0.00%
+Remaining cash $0.00
+""" in result.output
+
+
+def test_two_sided_engine(testfiles_dir, wslogin_mock):
+    """Test that the two-sided engine trims overweight positions to fund the
+    underweight ones, listing the sells before the buys, and that it honours
+    the minimum trade size and the cash reserve.
+    """
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '50'],
+    ]
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 10.00,
+            'positions': {
+                'MSFT': {
+                    'price': 10.00,
+                    'qty': 10,
+                },
+                'GOOG': {
+                    'price': 20.00,
+                    'qty': 0,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    args = ['rebalance', '-t', test_portfolio_csv, '--email',
+            'test@mail.com', '--2fa', '--save-session', '--engine',
+            'two-sided']
+    result = runner.invoke(wr, args,
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Sell 4X MSFT @ 10.00 - New allocation 60.00%
+Buy 2X GOOG @ 20.00 - New allocation 40.00%
+Remaining cash $10.00
+""" in result.output
+
+    result = runner.invoke(wr, args + ['--min-trade', '50'], input='0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Please input the account you want: 0
+Remaining cash $10.00
+""" in result.output
+
+    result = runner.invoke(wr, args + ['--cash-reserve', '30'], input='0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Sell 6X MSFT @ 10.00 - New allocation 50.00%
+Buy 2X GOOG @ 20.00 - New allocation 50.00%
+Remaining cash $30.00
+""" in result.output
+
+
+def test_two_sided_cash_reserve():
+    """Test that the two-sided engine sells enough to keep the cash reserve
+    when there isn't enough buying power for it, even if that takes a
+    position below its target allocation, and never spends the reserve.
+    """
+    portfolio = Portfolio(0.00)
+    portfolio.add_position(Position('MSFT', 10, 30.00, target_allocation=100))
+    plan = Rebalancer.plan_for_rebalancing(portfolio, engine='two-sided',
+                                           cash_reserve=100.00)
+    assert [(sell['ticker'], sell['quantity'])
+            for sell in plan['sells']] == [('MSFT', 4)]
+    assert plan['buys'] == []
+    assert plan['remaining_cash'] >= 100.00
+
+    # The sells for the cash reserve are made even if they are smaller than
+    # the minimum trade size
+    plan = Rebalancer.plan_for_rebalancing(portfolio, engine='two-sided',
+                                           min_trade=500.00,
+                                           cash_reserve=100.00)
+    assert [(sell['ticker'], sell['quantity'])
+            for sell in plan['sells']] == [('MSFT', 4)]
+
+    # A cash reserve larger than the whole portfolio sells everything
+    plan = Rebalancer.plan_for_rebalancing(portfolio, engine='two-sided',
+                                           cash_reserve=1000.00)
+    assert plan['sells'] == [{'ticker': 'MSFT', 'quantity': 10,
+                              'price': 30.00, 'new_allocation': 0.0,
+                              'quote_time': None}]
+    assert plan['remaining_cash'] == pytest.approx(300.00)
+
+    rng = random.Random(18)
+    for _ in range(300):
+        portfolio = random_portfolio(rng)
+        cash_reserve = round(rng.uniform(0.00, 600.00), 2)
+        plan = Rebalancer.plan_for_rebalancing(
+            portfolio, engine='two-sided', cash_reserve=cash_reserve,
+            min_trade=rng.choice([0.00, 20.00, 100.00]))
+        sells = {sell['ticker']: sell['quantity'] for sell in plan['sells']}
+        # Positions that are sold are never bought back
+        assert not sells.keys() & {buy['ticker'] for buy in plan['buys']}
+        sold_everything = all(sells.get(ticker) == position.qty
+                              for ticker, position in
+                              portfolio.positions.items() if position.qty)
+        assert (plan['remaining_cash'] >= cash_reserve - 1e-6 or
+                sold_everything)
+
+
+def test_fractional_engine(testfiles_dir, wslogin_mock):
+    """Test that the fractional engine spends all of the buying power on
+    fractional shares that bring every position to its target allocation,
+    and that buys below the minimum trade size are folded into the others.
+    """
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '40'],
+        ['AMZN', '10'],
+    ]
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 100.00,
+            'positions': {
+                'MSFT': {
+                    'price': 10.00,
+                    'qty': 4,
+                },
+                'GOOG': {
+                    'price': 30.00,
+                    'qty': 0,
+                },
+                'AMZN': {
+                    'price': 7.00,
+                    'qty': 1,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    args = ['rebalance', '-t', test_portfolio_csv, '--email',
+            'test@mail.com', '--2fa', '--save-session', '--engine',
+            'fractional']
+    result = runner.invoke(wr, args,
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Buy 1.96X GOOG @ 30.00 - New allocation 40.00%
+Buy 1.1X AMZN @ 7.00 - New allocation 10.00%
+Buy 3.35X MSFT @ 10.00 - New allocation 50.00%
+Remaining cash $0.00
+""" in result.output
+
+    result = runner.invoke(wr, args + ['--min-trade', '20'], input='0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Buy 2.074074X GOOG @ 30.00 - New allocation 42.33%
+Buy 3.777777X MSFT @ 10.00 - New allocation 52.91%
+Remaining cash $0.00
+""" in result.output
+
+
+def test_tree_engine(testfiles_dir, wslogin_mock):
+    """Test that nested target allocations are flattened for the other
+    engines, and that the tree engine buys the most underweight ticker in the
+    most underweight asset class rather than the most underweight ticker.
+    """
+    test_portfolio = [
+        ['equity', '60'],
+        ['equity/canada', '50'],
+        ['equity/canada/XIC', '50'],
+        ['equity/canada/VCN', '50'],
+        ['equity/us', '50'],
+        ['equity/us/VFV', '100'],
+        ['bonds', '40'],
+        ['bonds/ZAG', '100'],
+    ]
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 70.00,
+            'positions': {
+                'XIC': {
+                    'price': 10.00,
+                    'qty': 0,
+                },
+                'VCN': {
+                    'price': 10.00,
+                    'qty': 3,
+                },
+                'VFV': {
+                    'price': 20.00,
+                    'qty': 3,
+                },
+                'ZAG': {
+                    'price': 10.00,
+                    'qty': 2,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    args = ['rebalance', '-t', test_portfolio_csv, '--email',
+            'test@mail.com', '--2fa', '--save-session', '--nested-targets']
+    result = runner.invoke(wr, args + ['--engine', 'tree'],
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Buy 5X ZAG @ 10.00 - New allocation 38.89%
+Buy 2X XIC @ 10.00 - New allocation 11.11%
+Remaining cash $0.00
+""" in result.output
+
+    result = runner.invoke(wr, args + ['--engine', 'heap'], input='0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Buy 3X XIC @ 10.00 - New allocation 16.67%
+Buy 4X ZAG @ 10.00 - New allocation 33.33%
+Remaining cash $0.00
+""" in result.output
+
+    result = runner.invoke(wr, ['rebalance', '-t', test_portfolio_csv,
+                                '--email', 'test@mail.com', '--engine',
+                                'tree'],
+                           catch_exceptions=False)
+
+    assert result.exit_code == 2
+    assert "--engine tree requires --nested-targets" in result.stderr
+
+    test_portfolio[3] = ['equity/canada/VCN', '40']
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    result = runner.invoke(wr, args, input='0\n', catch_exceptions=False)
+
+    assert result.exit_code == 1
+    assert result.stderr == """\
+Error: Total combined allocation percentage (90.0) of 'equity/canada' is not \
+100%
+"""
+
+    del test_portfolio[1]
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    result = runner.invoke(wr, args, input='0\n', catch_exceptions=False)
+
+    assert result.exit_code == 1
+    assert result.stderr == """\
+Error: Asset class 'equity/canada' does not have a target allocation
+"""
+
+
+def test_tree_portfolio():
+    """Test that the values of the nodes along the path of a ticker are kept
+    up to date when shares of it are bought.
+    """
+    tree = AllocationTree()
+    tree.add('equity', 60, 0)
+    tree.add('equity/XIC', 50, 1)
+    tree.add('equity/VFV', 50, 2)
+    tree.add('bonds', 40, 3)
+    tree.add('bonds/ZAG', 100, 4)
+    portfolio = Portfolio(100.00)
+    for leaf in tree.leaves():
+        portfolio.add_position(Position(
+            leaf.name, 1, 10.00,
+            target_allocation=tree.portfolio_allocation(leaf)))
+
+    tree_portfolio = TreePortfolio(portfolio, tree)
+    equity = tree.root.children['equity']
+    bonds = tree.root.children['bonds']
+    assert tree_portfolio.node_value(equity) == 20.00
+    assert tree_portfolio.node_drift_percentage(bonds) == pytest.approx(
+        -100 / 6)
+    tree_portfolio['ZAG'].qty += 1
+    assert tree_portfolio.node_value(bonds) == 20.00
+    assert tree_portfolio.node_value(equity) == 20.00
+    assert tree_portfolio.node_drift_percentage(bonds) == pytest.approx(25)
+    assert tree_portfolio.node_drift_percentage(
+        equity.children['XIC']) == 0.0
+    assert portfolio['ZAG'].qty == 1
+
+
+def test_tree_engine_rounding_ties():
+    """Test that the tree engine skips a ticker that is over its target
+    allocation only by float rounding and keeps buying the other tickers,
+    instead of stopping with most of the cash left.
+    """
+    tree = AllocationTree()
+    tree.add('a', 42, 0)
+    tree.add('a/T0', 100, 1)
+    tree.add('b', 51, 2)
+    tree.add('b/T1', 100, 3)
+    tree.add('c', 7, 4)
+    tree.add('c/T2', 100, 5)
+    portfolio = Portfolio(1835.31)
+    for ticker, qty, price in [('T0', 20, 3.00), ('T1', 6, 10.00),
+                               ('T2', 3, 2.50)]:
+        portfolio.add_position(Position(
+            ticker, qty, price,
+            target_allocation=tree.portfolio_allocation(tree.leaf(ticker))))
+
+    plan = Rebalancer.plan_for_rebalancing(portfolio, engine='tree',
+                                           tree=tree)
+    assert sorted((buy['ticker'], buy['quantity'])
+                  for buy in plan['buys']) == [('T0', 255), ('T1', 94),
+                                               ('T2', 52)]
+    assert plan['remaining_cash'] == pytest.approx(0.31)
+
+
+def test_sweep(testfiles_dir, wslogin_mock):
+    """Test that the sweep command shows the same buys for each amount as
+    rebalancing with that much more buying power, including amounts where
+    a share the largest amount buys can't be afforded.
+    """
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '50'],
+    ]
+    wslogin_mock.test_positions = {
+        0: {
+            'buying_power': 10.00,
+            'positions': {
+                'MSFT': {
+                    'price': 10.00,
+                    'qty': 4,
+                },
+                'GOOG': {
+                    'price': 25.00,
+                    'qty': 0,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr,
+                           ['sweep', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--amount', '10',
+                            '--amount', '90', '--amount', '30'],
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert """\
+Deposit $10.00:
+Remaining cash $20.00
+Deposit $90.00:
+Buy 3X GOOG @ 25.00 - New allocation 55.56%
+Buy 2X MSFT @ 10.00 - New allocation 44.44%
+Remaining cash $5.00
+Deposit $30.00:
+Buy 1X GOOG @ 25.00 - New allocation 38.46%
+Remaining cash $15.00
+""" in result.output
+
+
+def test_sweep_differential():
+    """Test that the plan of the sweep for every deposit is the same as the
+    plan of the fixed-point engine for that deposit on its own, for random
+    portfolios and deposits.
+    """
+    rng = random.Random(21)
+    for _ in range(300):
+        portfolio = random_portfolio(rng)
+        deposits = [round(rng.uniform(0.00, 400.00), 2)
+                    for _ in range(rng.randint(1, 5))]
+        plans = CashSweep.plans_for_deposits(portfolio, deposits)
+        for deposit in deposits:
+            single = Portfolio(portfolio.buying_power + deposit)
+            for position in portfolio.positions.values():
+                single.add_position(Position(
+                    position.ticker, position.qty, position.price,
+                    target_allocation=position.target_allocation))
+            expected = Rebalancer.plan_for_rebalancing(single, 'fixed')
+            plan = plans[deposit]
+            assert sorted((buy['ticker'], buy['quantity'])
+                          for buy in plan['buys']) == \
+                sorted((buy['ticker'], buy['quantity'])
+                       for buy in expected['buys'])
+            assert plan['remaining_cash'] == expected['remaining_cash']
+
+
+def test_household(testfiles_dir, wslogin_mock):
+    """Test that every account is rebalanced together as a single portfolio,
+    buying each share in an account that holds the ticker if it has the cash
+    for it, or otherwise in the account with the most cash.
+    """
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '50'],
+    ]
+    wslogin_mock.test_positions = {
+        'rrsp': {
+            'buying_power': 100.00,
+            'positions': {
+                'MSFT': {
+                    'price': 30.00,
+                    'qty': 1,
+                },
+            }
+        },
+        'tfsa': {
+            'buying_power': 20.00,
+            'positions': {
+                'GOOG': {
+                    'price': 25.00,
+                    'qty': 2,
+                },
+            }
+        },
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--household'],
+                           input='password\npassword\n12345\n',
+                           catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert result.output.endswith("""\
+Enter 2FA code: 12345
+Account rrsp:
+Buy 2X MSFT @ 30.00 - New allocation 54.55%
+Buy 1X GOOG @ 25.00 - New allocation 45.45%
+Remaining cash $15.00
+Account tfsa:
+Remaining cash $20.00
+""")
+
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--household', '--engine',
+                            'heap', '--password', 'password'])
+    assert result.exit_code == 2
+    assert ("--household can't be used with --engine, --nested-targets or "
+            "--account-targets") in result.stderr
+
+
+def test_household_quotes():
+    """Test that a ticker held in several accounts is valued at its most
+    recent quote in the household, and that shares are bought at that price
+    in whichever account has the cash for them.
+    """
+    rrsp = Portfolio(100.00)
+    rrsp.add_position(Position('MSFT', 1, 30.00, quote_time=200.0))
+    tfsa = Portfolio(0.00)
+    tfsa.add_position(Position('MSFT', 2, 29.00, quote_time=100.0))
+    tfsa.add_position(Position('GOOG', 2, 25.00))
+    household = HouseholdPortfolio({'rrsp': rrsp, 'tfsa': tfsa})
+    assert household['MSFT'].qty == 3
+    assert household['MSFT'].price == 30.00
+    assert household['MSFT'].quote_time == 200.0
+    assert household.holders('MSFT') == ['rrsp', 'tfsa']
+
+    household['MSFT'].target_allocation = 50
+    household['GOOG'].target_allocation = 50
+    plans = HouseholdRebalancer.plans_for_rebalancing(household)
+    assert [(buy['ticker'], buy['quantity'], buy['price'])
+            for buy in plans['rrsp']['buys']] == [('GOOG', 2, 25.00),
+                                                  ('MSFT', 1, 30.00)]
+    assert plans['rrsp']['remaining_cash'] == 20.00
+    assert plans['tfsa']['buys'] == []
+
+
+def test_offline_snapshot(testfiles_dir, wslogin_mock):
+    """Test that runs only save a snapshot of the account when told to, and
+    that the latest or a given snapshot can be rebalanced without logging
+    in, looking up new tickers in the quotes kept in the snapshot.
+    """
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '50'],
+    ]
+    wslogin_mock.test_securities = {
+        'GOOG': {
+            'id': '123457',
+            'name': 'Google',
+            'price': 25.00,
+            'exchange': 'NASDAQ',
+        },
+    }
+    wslogin_mock.test_positions = {
+        'tfsa': {
+            'buying_power': 100.00,
+            'positions': {
+                'MSFT': {
+                    'price': 10.00,
+                    'qty': 4,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(wr,
+                           ['rebalance', '-t', test_portfolio_csv, '--email',
+                            'test@mail.com', '--2fa', '--save-session',
+                            '--save-snapshot'],
+                           input='password\npassword\n12345\n0\n0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output.endswith("""\
+Buy 3X GOOG @ 25.00 - New allocation 55.56%
+Buy 2X MSFT @ 10.00 - New allocation 44.44%
+Remaining cash $5.00
+""")
+
+    # The account has changed, but the snapshot is still of the first run
+    wslogin_mock.test_positions['tfsa']['buying_power'] = 0.00
+    result = runner.invoke(wr, ['rebalance', '-t', test_portfolio_csv,
+                                '--email', 'test@mail.com', '--account-id',
+                                'tfsa', '--password', 'password',
+                                '--save-session', '--save-snapshot'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == "Remaining cash $0.00\n"
+
+    result = runner.invoke(wr, ['snapshots'], catch_exceptions=False)
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith("1. Account tfsa at ")
+    assert lines[0].endswith(" - 1 positions, buying power $100.00")
+    assert lines[1].endswith(" - 1 positions, buying power $0.00")
+
+    # Runs don't save a snapshot unless told to
+    result = runner.invoke(wr, ['rebalance', '-t', test_portfolio_csv,
+                                '--email', 'test@mail.com', '--account-id',
+                                'tfsa', '--password', 'password',
+                                '--save-session'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    result = runner.invoke(wr, ['snapshots'], catch_exceptions=False)
+    assert len(result.output.splitlines()) == 2
+
+    for args in (['--offline', '--account-id', 'tfsa'], ['--snapshot', '1']):
+        result = runner.invoke(wr, ['rebalance', '-t', test_portfolio_csv] +
+                               args, catch_exceptions=False)
+        assert result.exit_code == 0
+    assert result.stderr == "Warning: 'GOOG' is not in your portfolio\n"
+    buys = result.output.splitlines()
+    assert buys[0].startswith("Buy 3X GOOG @ 25.00 (quoted ")
+    assert buys[1].startswith("Buy 2X MSFT @ 10.00 (quoted ")
+    assert buys[2] == "Remaining cash $5.00"
+
+    result = runner.invoke(wr, ['rebalance', '-t', test_portfolio_csv,
+                                '--offline', '--account-id', 'rrsp'])
+    assert result.exit_code == 1
+    assert result.stderr == \
+        "Error: No snapshot of account 'rrsp' has been saved\n"
+
+
+def test_record_and_replay(testfiles_dir, wslogin_mock, tmp_path):
+    """Test that the calls made to WealthSimple in a run can be recorded and
+    replayed without logging in, and that replayed calls can be made to
+    fail.
+    """
+    test_portfolio = [
+        ['MSFT', '50'],
+        ['GOOG', '50'],
+    ]
+    wslogin_mock.test_securities = {
+        'GOOG': {
+            'id': '123457',
+            'name': 'Google',
+            'price': 25.00,
+            'exchange': 'NASDAQ',
+        },
+    }
+    wslogin_mock.test_positions = {
+        'tfsa': {
+            'buying_power': 100.00,
+            'positions': {
+                'MSFT': {
+                    'price': 10.00,
+                    'qty': 4,
+                },
+            }
+        }
+    }
+    test_portfolio_csv = create_csv_file(testfiles_dir,
+                                         "test_portfolio.csv",
+                                         data=test_portfolio)
+    fixture_file = str(tmp_path / 'fixtures' / 'responses.json')
+
+    runner = CliRunner(mix_stderr=False)
+    args = ['rebalance', '-t', test_portfolio_csv, '--account-id', 'tfsa',
+            '--no-save-session', '--refresh-securities']
+    result = runner.invoke(wr, args + ['--email', 'test@mail.com', '--2fa',
+                                       '--record', fixture_file],
+                           input='password\npassword\n12345\n0\n',
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    recorded_output = result.output.split("Enter 2FA code: 12345\n")[1]
+
+    wslogin_mock.test_positions = {}
+    result = runner.invoke(wr, args + ['--replay', fixture_file,
+                                       '--replay-latency', '0.001'],
+                           input='0\n', catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == recorded_output
+    assert result.output.endswith("""\
+Buy 3X GOOG @ 25.00 - New allocation 55.56%
+Buy 2X MSFT @ 10.00 - New allocation 44.44%
+Remaining cash $5.00
+""")
+
+    with pytest.raises(ApiFailure) as e:
+        ReplayApi(fixture_file, failure_rate=1.0).get_account_ids()
+    assert e.value.status_code == ReplayApi.FAILURE_STATUS_CODE
+
+
+def test_request_scheduler(monkeypatch):
+    """Test that throttled requests and server errors are retried until they
+    succeed or run out of retries, and that duplicate lookups in flight are
+    only made once.
+    """
+    monkeypatch.setattr(RequestScheduler, 'BASE_DELAY', 0.0)
+    profiler = Profiler(enabled=True)
+    scheduler = RequestScheduler(rate=None, profiler=profiler)
+    responses = [ResponseMock(429, {'Retry-After': '0'}),
+                 ResponseMock(503, {}), ResponseMock(200, {})]
+    assert scheduler.call('GET account/list', responses.pop,
+                          0).status_code == 200
+    assert profiler.summary()['counters'] == {'API retries': 2}
+
+    with pytest.raises(ApiFailure) as e:
+        scheduler.call('GET account/list', lambda: ResponseMock(500, {}))
+    assert e.value.status_code == 500
+    assert profiler.summary()['counters'] == {
+        'API retries': 2 + RequestScheduler.MAX_RETRIES}
+
+    # Requests that aren't safe to make twice fail the first time instead
+    responses = [ResponseMock(429, {'Retry-After': '0'}),
+                 ResponseMock(200, {})]
+    with pytest.raises(ApiFailure) as e:
+        scheduler.call('POST auth/login', responses.pop, 0, retry=False)
+    assert e.value.status_code == 429
+    assert len(responses) == 1
+    assert profiler.summary()['counters'] == {
+        'API retries': 2 + RequestScheduler.MAX_RETRIES}
+
+    # Every lookup waits for the first one, which isn't answered until all
+    # of them have been made
+    lookups = []
+    answered = threading.Event()
+
+    def lookup(security_id):
+        lookups.append(security_id)
+        answered.wait()
+        return {'id': security_id}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = [executor.submit(scheduler.call, 'get_security', lookup,
+                                   'sec-1', coalesce=True)
+                   for _ in range(4)]
+        while profiler.summary()['counters'].get(
+                'coalesced API calls', 0) < 3:
+            time.sleep(0.001)
+        answered.set()
+        assert [result.result() for result in results] == [
+            {'id': 'sec-1'}] * 4
+    assert lookups == ['sec-1']
+
+
+def test_scheduled_login(wslogin_mock, tmp_path):
+    """Test that the requests made to log in go through the request
+    scheduler like every other request, but aren't retried.
+    """
+    class RecordingScheduler(RequestScheduler):
+        def __init__(self):
+            RequestScheduler.__init__(self, rate=None)
+            self.calls = []
+
+        def call(self, name, func, *args, retry=True, **kwargs):
+            self.calls.append((name, retry))
+            return RequestScheduler.call(self, name, func, *args,
+                                         retry=retry, **kwargs)
+
+    session_store = SessionStore(str(tmp_path))
+    session_store.set('test@mail.com', 'refresh-token')
+    scheduler = RecordingScheduler()
+    WealthSimpleLogin('test@mail.com', None, session_store=session_store,
+                      interactive=False, request_scheduler=scheduler)
+    assert scheduler.calls == [('POST auth/refresh', False)]
+
+
+def test_pool_connections():
+    """Test that the connection pool keeps a connection for every request
+    in flight, however many that is.
+    """
+    url = 'https://trade-service.wealthsimple.com/'
+    for max_concurrency in [4, 32]:
+        session = requests.Session()
+        RequestScheduler(max_concurrency=max_concurrency).pool_connections(
+            session, url)
+        pool = session.get_adapter(url).poolmanager.connection_from_url(url)
+        assert pool.pool.maxsize == max_concurrency
+
+
+def test_scheduled_requests_pass_arguments():
+    """Test that requests made through the scheduler are passed every
+    argument of the requestor, including the ones given by keyword.
+    """
+    class Requestor:
+        def __init__(self):
+            self.calls = []
+
+        def makeRequest(self, method, endpoint, params=None,
+                        returnValue=None):
+            self.calls.append((method, endpoint, params, returnValue))
+            return ResponseMock(200, {})
+
+    requestor = Requestor()
+    RequestScheduler(rate=None).schedule_requests(requestor)
+    requestor.makeRequest('GET', 'account/list')
+    requestor.makeRequest('GET', 'securities', {'query': 'GOOG'},
+                          returnValue='results')
+    requestor.makeRequest('POST', 'auth/login', params={'otp': '12345'})
+    assert requestor.calls == [
+        ('GET', 'account/list', None, None),
+        ('GET', 'securities', {'query': 'GOOG'}, 'results'),
+        ('POST', 'auth/login', {'otp': '12345'}, None),
+    ]
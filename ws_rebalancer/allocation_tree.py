@@ -0,0 +1,87 @@
+class AllocationNode:
+    """A node in a tree of target allocations. The target allocation of a
+    node is its percentage of its parent, or of the whole portfolio for the
+    top-level nodes. Nodes without children are tickers.
+    """
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.target_allocation = None
+        self.row_num = None
+        self.children = {}
+
+    @property
+    def path(self):
+        """The names of the nodes from the top level down to this node,
+        joined by slashes.
+        """
+        if self.parent is None or self.parent.parent is None:
+            return self.name
+        return "{}/{}".format(self.parent.path, self.name)
+
+    @property
+    def is_leaf(self):
+        return not self.children
+
+
+class AllocationTree:
+    """A tree of target allocations, e.g. asset classes split into regions
+    that are split into tickers. Each node is given by its path, with the
+    names of the nodes separated by slashes, and its target allocation as a
+    percentage of its parent.
+    """
+
+    SEPARATOR = '/'
+
+    def __init__(self):
+        self.root = AllocationNode(None)
+        self._leaves = {}
+
+    def add(self, path, target_allocation, row_num):
+        """Add the node with the given path, along with any of its parents
+        that haven't been added yet. Returns the node.
+        """
+        node = self.root
+        for name in path.split(self.SEPARATOR):
+            name = name.strip()
+            if name not in node.children:
+                node.children[name] = AllocationNode(name, parent=node)
+            node = node.children[name]
+        node.target_allocation = target_allocation
+        node.row_num = row_num
+        return node
+
+    def nodes(self):
+        """All the nodes except the root, with parents before children."""
+        stack = list(reversed(list(self.root.children.values())))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(list(node.children.values())))
+
+    def leaves(self):
+        """The leaves of the tree, in the order of their rows."""
+        return sorted((node for node in self.nodes() if node.is_leaf),
+                      key=lambda node: node.row_num)
+
+    def leaf(self, ticker):
+        """Get the leaf for the ticker."""
+        if not self._leaves:
+            self._leaves = {node.name: node for node in self.leaves()}
+        return self._leaves[ticker]
+
+    def ancestors(self, node):
+        """The node and its parents, up to but not including the root."""
+        while node is not self.root:
+            yield node
+            node = node.parent
+
+    def portfolio_allocation(self, node):
+        """The target allocation of the node as a percentage of the whole
+        portfolio.
+        """
+        allocation = 100.0
+        for ancestor in self.ancestors(node):
+            allocation *= ancestor.target_allocation / 100
+        return allocation
@@ -0,0 +1,100 @@
+import click
+import json
+import os
+import random
+import threading
+import time
+
+from ws_rebalancer.profiler import Profiler
+from ws_rebalancer.request_scheduler import ApiFailure
+
+
+class RecordingApi:
+    """Passes the calls made to the WealthSimple API through to a logged in
+    API, and records the responses so that they can be saved to a fixture
+    file and replayed later by ReplayApi.
+    """
+
+    def __init__(self, ws):
+        self._ws = ws
+        self._responses = {}
+        # API calls are made from several threads at once
+        self._lock = threading.Lock()
+        for method in Profiler.API_METHODS:
+            setattr(self, method, self._recorded(method))
+
+    def _recorded(self, method):
+        def call(*args):
+            response = getattr(self._ws, method)(*args)
+            with self._lock:
+                self._responses[(method, json.dumps(args))] = response
+            return response
+        return call
+
+    def save(self, fixture_file):
+        """Write the responses recorded so far to the fixture file."""
+        directory = os.path.dirname(fixture_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            responses = [
+                {'method': method, 'args': json.loads(args),
+                 'response': response}
+                for (method, args), response in sorted(
+                    self._responses.items())]
+        with open(fixture_file, 'w') as f:
+            json.dump(responses, f, indent=2)
+            f.write('\n')
+
+
+class ReplayApi:
+    """Serves the responses recorded in a fixture file in place of the
+    WealthSimple API, taking the given number of seconds to answer each call
+    plus up to the given jitter, and failing the given fraction of the calls
+    with a server error.
+
+    The delay and failure of each call only depend on the seed, the call and
+    the number of times it has been made before, so a replay is the same
+    whichever order concurrent calls are made in.
+    """
+
+    # Status code of the calls that are made to fail
+    FAILURE_STATUS_CODE = 503
+
+    def __init__(self, fixture_file, latency=0.0, jitter=0.0,
+                 failure_rate=0.0, seed=0):
+        try:
+            with open(fixture_file) as f:
+                responses = json.load(f)
+        except (OSError, ValueError) as e:
+            raise click.ClickException(
+                "Can't read the API fixture file - {}".format(e))
+        self._responses = {
+            (entry['method'], json.dumps(entry['args'])): entry['response']
+            for entry in responses}
+        self._latency = latency
+        self._jitter = jitter
+        self._failure_rate = failure_rate
+        self._seed = seed
+        self._call_counts = {}
+        self._lock = threading.Lock()
+        for method in Profiler.API_METHODS:
+            setattr(self, method, self._replayed(method))
+
+    def _replayed(self, method):
+        def call(*args):
+            key = (method, json.dumps(args))
+            with self._lock:
+                call_num = self._call_counts.get(key, 0)
+                self._call_counts[key] = call_num + 1
+            rng = random.Random('{}:{}:{}:{}'.format(self._seed, method,
+                                                     key[1], call_num))
+            time.sleep(self._latency + rng.uniform(0.0, self._jitter))
+            if rng.random() < self._failure_rate:
+                raise ApiFailure(method, self.FAILURE_STATUS_CODE)
+            if key not in self._responses:
+                raise click.ClickException(
+                    "No response to {}({}) has been recorded".format(
+                        method, ", ".join(repr(arg) for arg in args)))
+            return self._responses[key]
+        return call
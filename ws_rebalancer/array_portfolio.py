@@ -0,0 +1,276 @@
+from collections.abc import Mapping
+
+import click
+
+from ws_rebalancer.portfolio_overlay import PortfolioOverlay
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+class ArrayPosition:
+    """A view of a single row of an ArrayPortfolio that has the same
+    attributes as a Position.
+    """
+
+    def __init__(self, portfolio, row):
+        self._portfolio = portfolio
+        self._row = row
+
+    @property
+    def ticker(self):
+        return self._portfolio._tickers[self._row]
+
+    @property
+    def qty(self):
+        qty = self._portfolio._qty[self._row].item()
+        # The quantities are stored as floats so that fractional shares fit,
+        # but whole numbers of shares are returned as ints like in Position
+        return int(qty) if qty.is_integer() else qty
+
+    @property
+    def price(self):
+        return self._portfolio._price[self._row].item()
+
+    @property
+    def target_allocation(self):
+        target_allocation = self._portfolio._target[self._row].item()
+        if target_allocation != target_allocation:
+            # Positions without a target allocation are stored as NaN
+            return None
+        return target_allocation
+
+    @property
+    def quote_time(self):
+        return self._portfolio._quote_times[self._row]
+
+    @qty.setter
+    def qty(self, qty):
+        self._portfolio._qty[self._row] = qty
+        self._portfolio._invalidate()
+
+    @target_allocation.setter
+    def target_allocation(self, target_allocation):
+        if target_allocation is None:
+            target_allocation = np.nan
+        self._portfolio._target[self._row] = target_allocation
+        self._portfolio._invalidate()
+
+
+class ArrayPositions(Mapping):
+    """A read-only mapping of tickers to the positions of an ArrayPortfolio.
+    """
+
+    def __init__(self, portfolio):
+        self._portfolio = portfolio
+
+    def __getitem__(self, ticker):
+        return ArrayPosition(self._portfolio, self._portfolio._rows[ticker])
+
+    def __iter__(self):
+        return iter(self._portfolio._tickers)
+
+    def __len__(self):
+        return len(self._portfolio._tickers)
+
+    def __contains__(self, ticker):
+        return ticker in self._portfolio._rows
+
+
+class ArrayPortfolioOverlay(PortfolioOverlay):
+    """A PortfolioOverlay on an ArrayPortfolio that also keeps the value
+    added to each position in an array, so that the drift of every position
+    is computed with vectorized operations. The values and total are added
+    up the same way as in PortfolioOverlay, so the drifts are the same.
+    """
+
+    def __init__(self, base):
+        PortfolioOverlay.__init__(self, base)
+        self._added_values_column = np.zeros(len(base._tickers),
+                                             dtype=np.float64)
+
+    def _add_shares(self, ticker, shares):
+        PortfolioOverlay._add_shares(self, ticker, shares)
+        self._added_values_column[self._base._rows[ticker]] = (
+            self._added_values[ticker])
+
+    def drift_percentages(self):
+        """Get the drift percentages for all the positions in this portfolio.
+        See Portfolio.drift_percentages for the definition of drift
+        percentage.
+        """
+        base = self._base
+        values = base._values() + self._added_values_column
+        total = self._total()
+        current_allocation_pct = np.zeros_like(values)
+        if total > 0.0:
+            current_allocation_pct = values / total
+            current_allocation_pct *= 100
+        drift = current_allocation_pct - base._target
+        return dict(zip(base._tickers, ((drift * 100) /
+                                        base._target).tolist()))
+
+
+class ArrayPortfolio:
+    """Represents a collection of positions in a portfolio, with the
+    quantities, prices and target allocations stored as NumPy arrays so that
+    the drift, allocation and total value of the portfolio are computed with
+    vectorized operations. This has the same interface as Portfolio.
+    """
+
+    # Buys are planned in overlays that also compute drift with vectorized
+    # operations
+    OVERLAY_CLASS = ArrayPortfolioOverlay
+
+    def __init__(self, buying_power):
+        if np is None:  # pragma: no cover
+            raise click.ClickException(
+                "The 'arrays' portfolio backend requires NumPy - install it "
+                "with 'pip install ws-rebalancer[numpy]'")
+        self._buying_power = buying_power
+        self._tickers = []
+        self._quote_times = []
+        self._rows = {}
+        # The columns are allocated with spare capacity so that adding
+        # positions doesn't copy them every time. Only the first
+        # len(self._tickers) rows are in use.
+        self._qty_column = np.zeros(0, dtype=np.float64)
+        self._price_column = np.zeros(0, dtype=np.float64)
+        self._target_column = np.zeros(0, dtype=np.float64)
+        # The total value, the values and the drift percentages are kept
+        # until a position changes, since they are computed over every
+        # position at once
+        self._total_cache = None
+        self._value_list_cache = None
+        self._drift_percentages_cache = None
+
+    def __getitem__(self, ticker):
+        return self.positions[ticker]
+
+    @property
+    def _qty(self):
+        return self._qty_column[:len(self._tickers)]
+
+    @property
+    def _price(self):
+        return self._price_column[:len(self._tickers)]
+
+    @property
+    def _target(self):
+        return self._target_column[:len(self._tickers)]
+
+    def _grow(self):
+        """Double the capacity of the columns."""
+        capacity = max(2 * len(self._qty_column), 16)
+        for name in ('_qty_column', '_price_column', '_target_column'):
+            column = np.zeros(capacity, dtype=np.float64)
+            column[:len(self._tickers)] = getattr(self, name)[
+                :len(self._tickers)]
+            setattr(self, name, column)
+
+    def _invalidate(self):
+        """Forget the total value, values and drift percentages computed
+        since a position changed.
+        """
+        self._total_cache = None
+        self._value_list_cache = None
+        self._drift_percentages_cache = None
+
+    def _values(self):
+        """The value of every position in the portfolio."""
+        return self._qty * self._price
+
+    def _total(self):
+        """The total value of the portfolio."""
+        if self._total_cache is None:
+            self._total_cache = self._values().sum().item()
+        return self._total_cache
+
+    def _value(self, ticker):
+        """The value of the position with the given ticker."""
+        if self._value_list_cache is None:
+            # Reading single elements of the arrays is slow, so the values
+            # are all read at once
+            self._value_list_cache = self._values().tolist()
+        return self._value_list_cache[self._rows[ticker]]
+
+    @property
+    def positions(self):
+        """Get the positions that are a part of this portfolio."""
+        return ArrayPositions(self)
+
+    @property
+    def buying_power(self):
+        """Get the amount of cash that is available to be used for trading."""
+        return self._buying_power
+
+    @buying_power.setter
+    def buying_power(self, buying_power):
+        """Set the new amount of cash that is available to be used for
+        trading.
+        """
+        self._buying_power = buying_power
+
+    def add_position(self, position):
+        """Add a position to the portfolio."""
+        target_allocation = position.target_allocation
+        if target_allocation is None:
+            target_allocation = np.nan
+        self._invalidate()
+        if position.ticker in self._rows:
+            row = self._rows[position.ticker]
+            self._qty[row] = position.qty
+            self._price[row] = position.price
+            self._target[row] = target_allocation
+            self._quote_times[row] = position.quote_time
+            return
+        row = len(self._tickers)
+        if row == len(self._qty_column):
+            self._grow()
+        self._qty_column[row] = position.qty
+        self._price_column[row] = position.price
+        self._target_column[row] = target_allocation
+        self._rows[position.ticker] = row
+        self._tickers.append(position.ticker)
+        self._quote_times.append(position.quote_time)
+
+    def _drift_percentages(self):
+        """Get the drift percentage of every position as an array."""
+        if self._drift_percentages_cache is None:
+            self._drift_percentages_cache = self._compute_drift_percentages()
+        return self._drift_percentages_cache
+
+    def _compute_drift_percentages(self):
+        values = self._values()
+        total = self._total()
+        current_allocation_pct = np.zeros_like(values)
+        if total > 0.0:
+            current_allocation_pct = values / total
+            current_allocation_pct *= 100
+        drift = current_allocation_pct - self._target
+        return (drift * 100) / self._target
+
+    def drift_percentage(self, ticker):
+        """Get the drift percentage of a single position in this portfolio.
+        See drift_percentages for the definition of drift percentage.
+        """
+        return self._drift_percentages()[self._rows[ticker]].item()
+
+    def drift_percentages(self):
+        """Get the drift percentages for all the positions in this portfolio.
+        Drift percentage is defined by how far away a position is from its
+        target allocation.
+        A negative drift percentage means that the current position allocation
+        is under the target allocation.
+        A positive drift percentage means that the current position allocation
+        is over the target allocation.
+        """
+        return dict(zip(self._tickers, self._drift_percentages().tolist()))
+
+    def get_current_allocation(self, ticker):
+        """Returns the portion of the current portfolio that is comprised of
+        the queried ticker.
+        """
+        return (self._value(ticker) * 100) / self._total()
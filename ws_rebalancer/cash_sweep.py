@@ -0,0 +1,83 @@
+from ws_rebalancer.fixed_point import FixedPoint
+from ws_rebalancer.fixed_point_rebalancer import FixedPointRebalancer
+from ws_rebalancer.portfolio_overlay import PortfolioOverlay
+from ws_rebalancer.profiler import Profiler
+from ws_rebalancer.rebalancer import Rebalancer
+
+
+class CashSweep:
+    """Computes the plans of the fixed-point engine for several deposits at
+    once, reusing the buys computed for the largest deposit.
+
+    The greedy loop only depends on the positions and the remaining cash, so
+    with a smaller deposit it buys the same shares in the same order as with
+    the largest one, up to the first share it can't afford. From there the
+    greedy loop is continued with the remaining cash of the smaller deposit.
+    Cash and prices are in whole cents throughout, like in the fixed-point
+    engine, so where the buys stop matching is decided exactly, and every
+    plan is the same as the plan for that deposit on its own.
+    """
+
+    @staticmethod
+    def _runs(portfolio, buying_power):
+        """The shares bought by the greedy loop with the given buying power,
+        grouped into runs of consecutive shares of the same ticker. Each run
+        is given as the ticker, the price in cents, the number of shares and
+        the cents spent before the run.
+        """
+        runs = []
+        spent = 0
+        for ticker, price in FixedPointRebalancer.buy_sequence(
+                portfolio, FixedPoint.to_cents(buying_power)):
+            if runs and runs[-1][0] == ticker:
+                runs[-1][2] += 1
+            else:
+                runs.append([ticker, price, 1, spent])
+            spent += price
+        return runs
+
+    @staticmethod
+    def _plan(old_portfolio, runs, buying_power):
+        """The plan of the greedy loop with the given buying power, following
+        the runs for as long as they can be afforded.
+        """
+        new_portfolio = PortfolioOverlay.of(old_portfolio)
+        cash = FixedPoint.to_cents(buying_power)
+        buys = {}
+        for ticker, price, shares, spent in runs:
+            # The share after the affordable ones would be a different
+            # buy from here on, so the runs stop matching
+            affordable = max((cash - spent) // price, 0)
+            shares_bought = min(shares, affordable)
+            if shares_bought:
+                buys[ticker] = buys.get(ticker, 0) + shares_bought
+                new_portfolio[ticker].qty += shares_bought
+            if shares_bought < shares:
+                new_portfolio.buying_power = FixedPoint.from_cents(
+                    cash - spent - shares_bought * price)
+                # Continue the greedy loop from where the runs stop matching
+                rest = FixedPointRebalancer.buys_for_rebalancing(
+                    new_portfolio)
+                for rest_ticker, rest_shares in rest.items():
+                    buys[rest_ticker] = buys.get(rest_ticker, 0) + rest_shares
+                break
+        else:
+            # The greedy loop stopped for the largest deposit without running
+            # out of cash, so it stops at the same point for this one
+            new_portfolio.buying_power = FixedPoint.from_cents(
+                cash - sum(price * shares for _, price, shares, _ in runs))
+        return Rebalancer.plan(new_portfolio, buys)
+
+    @staticmethod
+    def plans_for_deposits(old_portfolio, deposits, profiler=None):
+        """Computes the plan for each amount deposited on top of the buying
+        power of the portfolio. Returns a dict of deposits to plans, in the
+        order the deposits are given. The portfolio itself is left unchanged.
+        """
+        profiler = profiler or Profiler()
+        with profiler.phase('rebalancing'):
+            runs = CashSweep._runs(old_portfolio,
+                                   old_portfolio.buying_power + max(deposits))
+            return {deposit: CashSweep._plan(
+                old_portfolio, runs, old_portfolio.buying_power + deposit)
+                for deposit in deposits}
@@ -1,12 +1,29 @@
 import click
+import json
+import time
 
+from ws_rebalancer.api_recording import RecordingApi, ReplayApi
+from ws_rebalancer.cash_sweep import CashSweep
+from ws_rebalancer.exact_rebalancer import ExactRebalancer
+from ws_rebalancer.household_portfolio import HouseholdPortfolio
+from ws_rebalancer.household_rebalancer import HouseholdRebalancer
+from ws_rebalancer.plan_writer import PlanWriter
+from ws_rebalancer.profiler import Profiler
+from ws_rebalancer.quote_cache import QuoteCache
+from ws_rebalancer.request_scheduler import ApiFailure, RequestScheduler
+from ws_rebalancer.security_cache import SecurityCache
+from ws_rebalancer.session_store import SessionStore
+from ws_rebalancer.snapshot_store import SnapshotQuotes, SnapshotStore
+from ws_rebalancer.target_allocation_tree_csv_reader import (
+    TargetAllocationTreeCsvReader
+)
 from ws_rebalancer.target_allocations_csv_reader import (
     TargetAllocationsCsvReader
 )
-from ws_rebalancer.rebalancer import Rebalancer
+from ws_rebalancer.rebalancer import ENGINES, Rebalancer
 from ws_rebalancer.wealthsimple_login import WealthSimpleLogin
 from ws_rebalancer.wealthsimple_portfolio_reader import (
-    WealthSimplePortfolioReader
+    BACKENDS, WealthSimplePortfolioReader
 )
 
 
@@ -15,24 +32,449 @@ def ws_rebalancer():
     pass
 
 
+def load_config(ctx, param, config_file):
+    """Read the JSON config file given to a command. Every key except
+    'securities' is used as the default value of the option with that name,
+    so options given on the command line still take precedence. Returns the
+    securities pinned to each ticker.
+    """
+    if config_file is None:
+        return {}
+    try:
+        with open(config_file) as f:
+            config = json.load(f)
+    except ValueError as e:
+        raise click.BadParameter("Invalid JSON - {}".format(e))
+    if not isinstance(config, dict):
+        raise click.BadParameter("Expecting a JSON object")
+    securities = config.pop('securities', {})
+    ctx.default_map = dict(ctx.default_map or {}, **config)
+    return securities
+
+
+def login(email, password, two_factor_auth, cache_dir, save_session,
+          headless, profiler, request_scheduler=None):
+    """Log in to WealthSimple, prompting for the password if it is needed
+    and not given. Returns the logged in WealthSimple API.
+    """
+    session_store = None
+    if save_session:
+        session_store = SessionStore(cache_dir)
+    if password is None and (session_store is None or
+                             session_store.get(email) is None):
+        if headless:
+            raise click.UsageError(
+                "--headless requires --password or a session saved with "
+                "--save-session")
+        password = click.prompt("Password", hide_input=True,
+                                confirmation_prompt=True)
+    try:
+        with profiler.phase('login'):
+            ws = WealthSimpleLogin(email, password,
+                                   two_factor_auth=two_factor_auth,
+                                   session_store=session_store,
+                                   interactive=not headless,
+                                   request_scheduler=request_scheduler)
+    except Exception as e:
+        raise click.ClickException("{}".format(str(e)))
+    profiler.record_api_calls(ws)
+    return ws
+
+
+def load_snapshots(cache_dir, snapshot_id, all_accounts, account_id):
+    """Load the snapshot with the given ID, or else the latest snapshot of
+    every account or of the given account. Returns a dict of account IDs to
+    snapshots.
+    """
+    snapshot_store = SnapshotStore(cache_dir)
+    if snapshot_id is not None:
+        snapshot = snapshot_store.get(snapshot_id)
+        return {snapshot.account_id: snapshot}
+    if all_accounts:
+        snapshots = snapshot_store.latest()
+        if not snapshots:
+            raise click.ClickException("No snapshots have been saved")
+        return snapshots
+    if account_id is None:
+        raise click.UsageError(
+            "--offline requires --account-id, --all-accounts or --snapshot")
+    return snapshot_store.latest([account_id])
+
+
+def engine_options(engine, nested_targets, household, account_targets,
+                   objective, time_budget, min_trade, cash_reserve):
+    """Check that the engine can be used with the other options given.
+    Returns the options passed on to the engine.
+    """
+    if engine == 'tree' and not nested_targets:
+        raise click.UsageError("--engine tree requires --nested-targets")
+    if household and (engine != 'greedy' or nested_targets or
+                      account_targets):
+        raise click.UsageError(
+            "--household can't be used with --engine, --nested-targets or "
+            "--account-targets")
+    if engine == 'exact':
+        return {'objective': objective, 'time_budget': time_budget}
+    if engine == 'two-sided':
+        return {'min_trade': min_trade, 'cash_reserve': cash_reserve}
+    if engine == 'fractional':
+        return {'min_trade': min_trade}
+    return {}
+
+
+def connect(email, password, two_factor_auth, cache_dir, save_session,
+            headless, profiler, max_request_rate, record_file, replay_file,
+            replay_latency, replay_jitter, replay_failure_rate):
+    """Log in to WealthSimple, or serve its calls from the --replay fixture
+    file instead, and record them if --record is given. Returns the
+    WealthSimple API.
+    """
+    request_scheduler = RequestScheduler(rate=max_request_rate,
+                                         profiler=profiler)
+    if replay_file is not None:
+        ws = ReplayApi(replay_file, latency=replay_latency,
+                       jitter=replay_jitter,
+                       failure_rate=replay_failure_rate)
+        request_scheduler.schedule_api(ws)
+        profiler.record_api_calls(ws)
+    else:
+        ws = login(email, password, two_factor_auth, cache_dir,
+                   save_session, headless, profiler, request_scheduler)
+    if record_file is not None:
+        ws = RecordingApi(ws)
+    return ws
+
+
+def read_portfolios(ws, snapshots, backend, quote_cache, profiler,
+                    all_accounts, account_id):
+    """Read the portfolio of every account, or of the chosen account, with
+    the given backend. The portfolios are built from the snapshots instead
+    when rebalancing offline. Returns a dict of account IDs to portfolios.
+    """
+    if snapshots is not None:
+        return {snapshot.account_id: snapshot.portfolio(backend)
+                for snapshot in snapshots.values()}
+    portfolio_reader = WealthSimplePortfolioReader(ws, backend=backend,
+                                                   quote_cache=quote_cache,
+                                                   profiler=profiler)
+    if all_accounts:
+        return portfolio_reader.get_portfolios()
+    account_id = portfolio_reader.choose_account(account_id)
+    return {account_id: portfolio_reader.read_account(account_id)}
+
+
+def update_portfolios(portfolios, ws, target_allocations_csv,
+                      account_targets, nested_targets, engine, options,
+                      security_cache, quote_cache, security_ids, headless,
+                      profiler):
+    """Set the target allocations of every portfolio from its CSV-file,
+    adding the new tickers in it. Returns a dict of account IDs to the
+    options passed on to the engine for that account.
+    """
+    account_targets = dict(account_targets)
+    csv_reader_class = TargetAllocationsCsvReader
+    if nested_targets:
+        csv_reader_class = TargetAllocationTreeCsvReader
+    account_engine_options = {}
+    for account_id, portfolio in portfolios.items():
+        csv_reader = csv_reader_class(
+            account_targets.get(account_id, target_allocations_csv), ws,
+            security_cache=security_cache, quote_cache=quote_cache,
+            security_ids=security_ids, interactive=not headless,
+            profiler=profiler)
+        csv_reader.update_portfolio(portfolio)
+        account_engine_options[account_id] = options
+        if engine == 'tree':
+            # Every account can have its own tree of target allocations
+            account_engine_options[account_id] = {'tree': csv_reader.tree}
+    return account_engine_options
+
+
+def save_snapshots(cache_dir, portfolios, quotes=()):
+    """Save a snapshot of the portfolio of every account, along with the
+    quotes of any other tickers that were looked up.
+    """
+    snapshot_store = SnapshotStore(cache_dir)
+    for account_id, portfolio in portfolios.items():
+        snapshot_store.save(account_id, portfolio, quotes=quotes)
+
+
+@ws_rebalancer.command(help=(
+    "Generate the recommended buys, and sells with the two-sided engine, to "
+    "get your portfolio as close as possible to your target allocation."))
+@click.option('--config', 'security_ids', is_eager=True, expose_value=True,
+              callback=load_config,
+              type=click.Path(exists=True, dir_okay=False),
+              help="JSON file with default values for any of these options, "
+                   "using the option names with underscores as keys, and the "
+                   "IDs of the securities to use for new tickers under the "
+                   "'securities' key")
+@click.option('-t', '--target-allocations-csv', 'target_allocations_csv',
+              required=True,
+              help="CSV-file containing the target allocations for each "
+                   "ticker")
+@click.option('--nested-targets', is_flag=True,
+              help="The target allocations CSV-files are trees of asset "
+                   "classes, where each row has the path of an asset class "
+                   "or ticker and its percentage of the asset class it is "
+                   "in. Required by the tree engine")
+@click.option('--email',
+              help="Email for WealthSimple login. Required unless --offline "
+                   "or --snapshot is given")
+@click.option('--password', envvar='WS_REBALANCER_PASSWORD',
+              help="Password for WealthSimple login. You are prompted for it "
+                   "if it is needed and not given")
+@click.option('--2fa', 'two_factor_auth', is_flag=True,
+              help="Enable this flag if your WealthSimple login requires 2FA")
+@click.option('--offline', is_flag=True,
+              help="Rebalance the latest snapshot of the accounts saved by "
+                   "an earlier run instead of logging in to WealthSimple")
+@click.option('--snapshot', 'snapshot_id', type=int,
+              help="ID of a saved snapshot to rebalance offline instead of "
+                   "the latest one. See the snapshots command")
+@click.option('--save-snapshot/--no-snapshot', default=False,
+              show_default=True,
+              help="Save a snapshot of the accounts read from WealthSimple, "
+                   "so that they can be rebalanced again offline")
+@click.option('--record', 'record_file', type=click.Path(dir_okay=False),
+              help="Save the responses of every call made to WealthSimple in "
+                   "this fixture file, so that the run can be replayed")
+@click.option('--replay', 'replay_file',
+              type=click.Path(exists=True, dir_okay=False),
+              help="Serve the calls made to WealthSimple from a fixture file "
+                   "saved with --record instead of logging in")
+@click.option('--replay-latency', type=float, default=0.0, show_default=True,
+              help="Number of seconds each replayed call takes")
+@click.option('--replay-jitter', type=float, default=0.0, show_default=True,
+              help="Largest number of seconds randomly added to the latency "
+                   "of each replayed call")
+@click.option('--replay-failure-rate', type=float, default=0.0,
+              show_default=True,
+              help="Fraction of the replayed calls that fail with a server "
+                   "error, and get retried")
+@click.option('--max-request-rate', type=float,
+              default=RequestScheduler.RATE, show_default=True,
+              help="Largest number of requests per second made to "
+                   "WealthSimple on average")
+@click.option('--engine', type=click.Choice(list(ENGINES)), default='greedy',
+              show_default=True,
+              help="Engine used to compute the buys for rebalancing")
+@click.option('--portfolio-backend', 'backend',
+              type=click.Choice(list(BACKENDS)), default='objects',
+              show_default=True,
+              help="How the positions of the portfolio are stored. 'arrays' "
+                   "requires NumPy")
+@click.option('--objective',
+              type=click.Choice(list(ExactRebalancer.OBJECTIVES)),
+              default='absolute', show_default=True,
+              help="How the drift of each position is penalized by the exact "
+                   "engine")
+@click.option('--time-budget', type=float,
+              default=ExactRebalancer.DEFAULT_TIME_BUDGET, show_default=True,
+              help="Number of seconds the exact engine may search for before "
+                   "returning the best buys found so far")
+@click.option('--min-trade', type=float, default=0.0, show_default=True,
+              help="Smallest value of a single trade made by the two-sided "
+                   "and fractional engines")
+@click.option('--cash-reserve', type=float, default=0.0, show_default=True,
+              help="Amount of cash the two-sided engine leaves unspent, "
+                   "selling shares to raise it if needed")
+@click.option('--all-accounts', is_flag=True,
+              help="Rebalance every account instead of prompting for one")
+@click.option('--household', is_flag=True,
+              help="Rebalance every account together as a single portfolio "
+                   "with the --target-allocations-csv file, buying each "
+                   "share in an account that has the cash for it")
+@click.option('--account-id',
+              help="ID of the account to rebalance instead of prompting for "
+                   "one")
+@click.option('--account-targets', 'account_targets', type=(str, str),
+              multiple=True, metavar='ACCOUNT_ID CSV',
+              help="CSV-file containing the target allocations for a single "
+                   "account when using --all-accounts. Accounts without one "
+                   "use the --target-allocations-csv file")
+@click.option('--cache-dir', envvar='WS_REBALANCER_CACHE_DIR',
+              default=click.get_app_dir('ws-rebalancer'), show_default=True,
+              type=click.Path(file_okay=False),
+              help="Directory where data is cached between runs")
+@click.option('--refresh-securities', is_flag=True,
+              help="Search for every new ticker again instead of using the "
+                   "securities picked in earlier runs")
+@click.option('--max-quote-age', type=float, default=0, show_default=True,
+              help="Number of seconds a cached price can be used for instead "
+                   "of fetching it again. When set, the time each price was "
+                   "quoted at is shown next to it")
+@click.option('--save-session/--no-save-session', default=False,
+              show_default=True,
+              help="Save the WealthSimple session, or use the one saved by an "
+                   "earlier run, to skip logging in with a password and 2FA")
+@click.option('--headless', is_flag=True,
+              help="Never prompt for anything. The password or a saved "
+                   "session, the account and the securities for new tickers "
+                   "must all be given up front")
+@click.option('--output', 'output_format',
+              type=click.Choice(PlanWriter.FORMATS), default='text',
+              show_default=True,
+              help="Format of the buys written to stdout")
+@click.option('--profile', 'profile_format',
+              type=click.Choice(Profiler.FORMATS),
+              help="Record the time spent in each phase of the run, the calls "
+                   "made to WealthSimple, the work done planning the buys and "
+                   "the peak memory, and write a summary in this format")
+@click.option('--profile-file', type=click.Path(dir_okay=False),
+              help="File to write the --profile summary to instead of "
+                   "stderr")
+def rebalance(security_ids, target_allocations_csv, nested_targets, email,
+              password, two_factor_auth, offline, snapshot_id, save_snapshot,
+              record_file, replay_file, replay_latency, replay_jitter,
+              replay_failure_rate, max_request_rate, engine,
+              backend, objective, time_budget, min_trade, cash_reserve,
+              all_accounts, household, account_id, account_targets,
+              cache_dir, refresh_securities, max_quote_age, save_session,
+              headless, output_format, profile_format, profile_file):
+    profiler = Profiler(enabled=profile_format is not None)
+    options = engine_options(engine, nested_targets, household,
+                             account_targets, objective, time_budget,
+                             min_trade, cash_reserve)
+    # The household is made up of every account
+    all_accounts = all_accounts or household
+    offline = offline or snapshot_id is not None
+    if offline and (record_file is not None or replay_file is not None):
+        raise click.UsageError(
+            "--offline and --snapshot can't be used with --record or "
+            "--replay")
+    if not offline and replay_file is None and email is None:
+        raise click.UsageError("Missing option '--email'")
+    if (headless and not offline and not all_accounts and
+            account_id is None):
+        raise click.UsageError(
+            "--headless requires --account-id or --all-accounts")
+    snapshots = None
+    security_cache = None
+    quote_cache = None
+    if offline:
+        snapshots = load_snapshots(cache_dir, snapshot_id, all_accounts,
+                                   account_id)
+        # New tickers are looked up in the quotes kept in the snapshots
+        ws = SnapshotQuotes(snapshots.values())
+        security_ids = ws.security_ids
+    else:
+        ws = connect(email, password, two_factor_auth, cache_dir,
+                     save_session, headless, profiler, max_request_rate,
+                     record_file, replay_file, replay_latency, replay_jitter,
+                     replay_failure_rate)
+        security_cache = SecurityCache(cache_dir)
+        if refresh_securities:
+            security_cache.clear()
+        if max_quote_age > 0:
+            quote_cache = QuoteCache(cache_dir, max_quote_age)
+    try:
+        portfolios = read_portfolios(ws, snapshots, backend, quote_cache,
+                                     profiler, all_accounts, account_id)
+        account_portfolios = portfolios
+        if household:
+            portfolios = {None: HouseholdPortfolio(portfolios)}
+        account_engine_options = update_portfolios(
+            portfolios, ws, target_allocations_csv, account_targets,
+            nested_targets, engine, options, security_cache, quote_cache,
+            security_ids, headless, profiler)
+    except ApiFailure as e:
+        # The request kept failing even after being retried
+        raise click.ClickException(str(e))
+    finally:
+        # Keep whatever was looked up, even if the target allocations turn
+        # out to be invalid
+        if security_cache is not None:
+            security_cache.save()
+        if quote_cache is not None:
+            quote_cache.save()
+        if record_file is not None:
+            ws.save(record_file)
+    if not offline and save_snapshot:
+        # The new tickers in a household are only added to the household
+        # portfolio, so their quotes are saved with every account
+        quotes = portfolios[None].positions.values() if household else ()
+        save_snapshots(cache_dir, account_portfolios, quotes=quotes)
+    if household:
+        plans = HouseholdRebalancer.plans_for_rebalancing(portfolios[None],
+                                                          profiler=profiler)
+    else:
+        plans = {
+            account_id: Rebalancer.plan_for_rebalancing(
+                portfolio, engine=engine, profiler=profiler,
+                **account_engine_options[account_id])
+            for account_id, portfolio in portfolios.items()
+        }
+    if not all_accounts and output_format == 'text':
+        # There is only one account, so don't print a header for it
+        plans = {None: next(iter(plans.values()))}
+    # Prices from a snapshot can be old, so always show when they were quoted
+    PlanWriter.write(plans, output_format=output_format,
+                     show_quote_times=quote_cache is not None or offline)
+    if profiler.enabled:
+        profiler.write(profile_format, profile_file)
+
+
 @ws_rebalancer.command(help=(
-    "Generate the recommended buys to get your portfolio as close as possible "
-    "to your target allocation."))
+    "List the snapshots of your accounts saved by earlier runs of rebalance, "
+    "oldest first."))
+@click.option('--cache-dir', envvar='WS_REBALANCER_CACHE_DIR',
+              default=click.get_app_dir('ws-rebalancer'), show_default=True,
+              type=click.Path(file_okay=False),
+              help="Directory where data is cached between runs")
+def snapshots(cache_dir):
+    for snapshot_id, account_id, taken_at, buying_power, num_positions in (
+            SnapshotStore(cache_dir).history()):
+        click.echo("{}. Account {} at {} - {} positions, buying power "
+                   "${:.2f}".format(
+                       snapshot_id, account_id,
+                       time.strftime("%Y-%m-%d %H:%M:%S",
+                                     time.localtime(taken_at)),
+                       num_positions, buying_power))
+
+
+@ws_rebalancer.command(help=(
+    "Show the recommended buys for several amounts of cash deposited on top "
+    "of your buying power, computed in a single pass."))
 @click.option('-t', '--target-allocations-csv', 'target_allocations_csv',
               required=True,
               help="CSV-file containing the target allocations for each "
                    "ticker")
 @click.option('--email', required=True, help="Email for WealthSimple login")
-@click.password_option(help="Password for WealthSimple login", required=True)
+@click.option('--password', envvar='WS_REBALANCER_PASSWORD',
+              help="Password for WealthSimple login. You are prompted for it "
+                   "if it is needed and not given")
 @click.option('--2fa', 'two_factor_auth', is_flag=True,
               help="Enable this flag if your WealthSimple login requires 2FA")
-def rebalance(target_allocations_csv, email, password, two_factor_auth):
+@click.option('--account-id',
+              help="ID of the account to rebalance instead of prompting for "
+                   "one")
+@click.option('--amount', 'amounts', type=float, multiple=True,
+              required=True,
+              help="Amount of cash to show the buys for. Can be given several "
+                   "times")
+@click.option('--cache-dir', envvar='WS_REBALANCER_CACHE_DIR',
+              default=click.get_app_dir('ws-rebalancer'), show_default=True,
+              type=click.Path(file_okay=False),
+              help="Directory where data is cached between runs")
+@click.option('--save-session/--no-save-session', default=False,
+              show_default=True,
+              help="Save the WealthSimple session, or use the one saved by an "
+                   "earlier run, to skip logging in with a password and 2FA")
+def sweep(target_allocations_csv, email, password, two_factor_auth,
+          account_id, amounts, cache_dir, save_session):
+    profiler = Profiler()
+    ws = login(email, password, two_factor_auth, cache_dir, save_session,
+               headless=False, profiler=profiler)
+    security_cache = SecurityCache(cache_dir)
+    portfolio = WealthSimplePortfolioReader(ws).get_portfolio(account_id)
     try:
-        ws = WealthSimpleLogin(email, password,
-                               two_factor_auth=two_factor_auth)
-    except Exception as e:
-        raise click.ClickException("{}".format(str(e)))
-    portfolio = WealthSimplePortfolioReader(ws).get_portfolio()
-    TargetAllocationsCsvReader(target_allocations_csv, ws).update_portfolio(
-        portfolio)
-    Rebalancer.print_buys_for_rebalancing(portfolio)
+        TargetAllocationsCsvReader(
+            target_allocations_csv, ws,
+            security_cache=security_cache).update_portfolio(portfolio)
+    finally:
+        security_cache.save()
+    plans = CashSweep.plans_for_deposits(portfolio, amounts)
+    for amount, plan in plans.items():
+        click.echo("Deposit ${:.2f}:".format(amount))
+        PlanWriter.write({None: plan})
@@ -0,0 +1,173 @@
+import math
+import time
+
+from ws_rebalancer.heap_rebalancer import HeapRebalancer
+from ws_rebalancer.portfolio_overlay import PortfolioOverlay
+from ws_rebalancer.profiler import Profiler
+
+
+class ExactRebalancer:
+    """Computes the buys that minimize the total drift of the portfolio, using
+    a depth-first branch-and-bound search over the number of shares bought of
+    each position. Unlike the greedy engines this may buy overweight
+    positions, or skip the most underweight one, when that lands the
+    portfolio closer to its target allocations overall.
+
+    The plan of the greedy loop, as computed by HeapRebalancer, is used as
+    the starting incumbent.
+    The search stops once the time budget runs out, in which case the best
+    plan found so far is returned.
+    """
+
+    # Default number of seconds the search is allowed to run for
+    DEFAULT_TIME_BUDGET = 10.0
+
+    # Functions used to penalize the drift percentage of each position
+    OBJECTIVES = {
+        'absolute': abs,
+        'squared': lambda drift_pct: drift_pct * drift_pct,
+    }
+
+    @staticmethod
+    def _drift_pct(value, total, target_allocation):
+        """The drift percentage of a position, as defined by
+        Portfolio.drift_percentages.
+        """
+        current_allocation_pct = 0.0
+        if total > 0.0:
+            current_allocation_pct = value / total
+            current_allocation_pct *= 100
+        drift = current_allocation_pct - target_allocation
+        return (drift * 100) / target_allocation
+
+    @staticmethod
+    def _lowest_drift_pct(low_value, high_value, low_total, high_total,
+                          target_allocation):
+        """The lowest absolute drift percentage a position can have when its
+        value and the portfolio total lie within the given ranges.
+        """
+        if high_value <= 0.0 or high_total <= 0.0:
+            return 100.0
+        low_allocation_pct = low_value * 100 / high_total
+        high_allocation_pct = 100.0
+        if low_total > 0.0:
+            high_allocation_pct = min(high_value * 100 / low_total, 100.0)
+        if low_allocation_pct > target_allocation:
+            drift = low_allocation_pct - target_allocation
+        elif high_allocation_pct < target_allocation:
+            drift = target_allocation - high_allocation_pct
+        else:
+            return 0.0
+        return (drift * 100) / target_allocation
+
+    @staticmethod
+    def _candidates(max_shares, incumbent_shares):
+        """The number of shares to try for a position, starting from the
+        number in the incumbent plan and moving outwards from there.
+        """
+        start = min(incumbent_shares, max_shares)
+        yield start
+        for distance in range(1, max_shares + 1):
+            if start + distance <= max_shares:
+                yield start + distance
+            if start - distance >= 0:
+                yield start - distance
+            if start + distance > max_shares and start - distance < 0:
+                return
+
+    @staticmethod
+    def buys_for_rebalancing(portfolio, objective='absolute',
+                             time_budget=DEFAULT_TIME_BUDGET, profiler=None):
+        """Buys the shares that minimize the total drift of the portfolio,
+        within the buying power. Returns the number of shares bought for each
+        ticker. If a profiler is given, the drifts evaluated are counted in
+        it.
+        """
+        profiler = profiler or Profiler()
+        deadline = time.monotonic() + time_budget
+        penalty = ExactRebalancer.OBJECTIVES[objective]
+        # Expensive positions have the fewest choices, so branch on them first
+        positions = sorted(portfolio.positions.values(),
+                           key=lambda p: p.price, reverse=True)
+        values = [p.price * p.qty for p in positions]
+        targets = [p.target_allocation for p in positions]
+        prices = [p.price for p in positions]
+        total = sum(values)
+        buying_power = portfolio.buying_power
+
+        def cost(shares):
+            new_values = [value + qty * price
+                          for value, qty, price in zip(values, shares, prices)]
+            new_total = sum(new_values)
+            return sum(penalty(ExactRebalancer._drift_pct(value, new_total,
+                                                          target))
+                       for value, target in zip(new_values, targets))
+
+        def lower_bound(shares, spent):
+            # Positions past the ones that have been assigned can still use
+            # all the remaining cash
+            remaining = buying_power - spent
+            low_total = total + spent
+            high_total = total + spent + remaining
+            bound = 0.0
+            for i, target in enumerate(targets):
+                low_value = values[i]
+                high_value = values[i] + remaining
+                if i < len(shares):
+                    low_value = values[i] + shares[i] * prices[i]
+                    high_value = low_value
+                bound += penalty(ExactRebalancer._lowest_drift_pct(
+                    low_value, high_value, low_total, high_total, target))
+            return bound
+
+        incumbent = HeapRebalancer.buys_for_rebalancing(
+            PortfolioOverlay.of(portfolio), profiler)
+        best_shares = [incumbent.get(p.ticker, 0) for p in positions]
+        best_cost = cost(best_shares)
+        # Every plan costed evaluates the drift of every position
+        evaluations = len(positions)
+
+        shares = []
+        spent = [0.0]
+        stack = [ExactRebalancer._candidates(
+            math.floor(buying_power / prices[0]), best_shares[0])
+            if positions else iter(())]
+        while stack and time.monotonic() < deadline:
+            depth = len(stack) - 1
+            del shares[depth:]
+            del spent[depth + 1:]
+            qty = next(stack[-1], None)
+            if qty is None:
+                stack.pop()
+                continue
+            shares.append(qty)
+            spent.append(spent[depth] + qty * prices[depth])
+            if spent[-1] > buying_power:
+                continue
+            if lower_bound(shares, spent[-1]) >= best_cost:
+                continue
+            if len(shares) == len(positions):
+                shares_cost = cost(shares)
+                evaluations += len(positions)
+                if shares_cost < best_cost:
+                    best_shares = list(shares)
+                    best_cost = shares_cost
+                continue
+            next_price = prices[len(shares)]
+            stack.append(ExactRebalancer._candidates(
+                math.floor((buying_power - spent[-1]) / next_price),
+                best_shares[len(shares)]))
+
+        profiler.count('drift evaluations', evaluations)
+        order = {p.ticker: order for order, p in enumerate(positions)}
+        buys = {}
+        # List the buys in the same order as the greedy loop where possible
+        tickers = list(incumbent) + [ticker for ticker in portfolio.positions
+                                     if ticker not in incumbent]
+        for ticker in tickers:
+            qty = best_shares[order[ticker]]
+            if qty:
+                buys[ticker] = qty
+                portfolio[ticker].qty += qty
+                portfolio.buying_power -= qty * portfolio[ticker].price
+        return buys
@@ -0,0 +1,42 @@
+class FixedPoint:
+    """Converts amounts of cash and target allocations to integers, so that
+    they can be added and compared exactly.
+
+    Cash is stored as a whole number of cents. Allocations are stored as a
+    whole number of units, where a unit is a millionth of a percent. That is
+    finer than a basis point so that the target allocations of portfolios
+    with many thousands of small positions stay distinct.
+    """
+
+    # Number of cents in a dollar
+    CENTS = 100
+
+    # Number of allocation units in a percent
+    ALLOCATION_UNITS = 10 ** 6
+
+    # Number of allocation units in the whole portfolio
+    TOTAL_ALLOCATION_UNITS = 100 * ALLOCATION_UNITS
+
+    @staticmethod
+    def to_cents(amount):
+        """Convert an amount of cash in dollars to the nearest cent."""
+        return round(amount * FixedPoint.CENTS)
+
+    @staticmethod
+    def from_cents(cents):
+        """Convert a number of cents to an amount of cash in dollars."""
+        return cents / FixedPoint.CENTS
+
+    @staticmethod
+    def to_allocation_units(allocation_pct):
+        """Convert an allocation percentage to the nearest allocation unit."""
+        return round(allocation_pct * FixedPoint.ALLOCATION_UNITS)
+
+    @staticmethod
+    def is_total_allocation(allocation_pct):
+        """Whether the allocation percentage makes up the whole portfolio, up
+        to the nearest allocation unit. Any rounding from adding up the
+        target allocations as floats is far smaller than that.
+        """
+        return (FixedPoint.to_allocation_units(allocation_pct) ==
+                FixedPoint.TOTAL_ALLOCATION_UNITS)
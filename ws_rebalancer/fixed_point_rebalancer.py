@@ -0,0 +1,116 @@
+import heapq
+
+from ws_rebalancer.fixed_point import FixedPoint
+from ws_rebalancer.profiler import Profiler
+
+
+class FixedPointRebalancer:
+    """Computes the buys of the one-share-at-a-time greedy loop in Rebalancer
+    with integer arithmetic only. Cash and prices are kept in cents and
+    target allocations in allocation units, as defined by FixedPoint, so the
+    buys are exact and don't depend on float rounding. Prices are rounded to
+    the nearest cent, but never below one cent.
+
+    Like HeapRebalancer, the candidate positions are kept in a priority queue
+    ordered by value per target allocation, and only the entry of the
+    position being bought is updated after each share.
+    """
+
+    @staticmethod
+    def _priority_scale(target_allocations):
+        """The scale of the priority of each position. Two positions with
+        different values per target allocation differ by at least one over
+        the product of their target allocations, so with the square of the
+        largest target allocation as the scale their priorities are
+        different whole numbers, while equal ones have the same priority.
+        Using the largest target allocation of the portfolio rather than the
+        whole portfolio keeps the priorities small enough to compare quickly
+        when there are many positions.
+        """
+        return max(target_allocations, default=1) ** 2
+
+    @staticmethod
+    def _heap_entry(order, ticker, value, price, target_allocation, scale):
+        """Build the priority queue entry for a position, with the value and
+        price in cents and the target allocation in allocation units. Ties
+        in drift are broken by the lowest price, and then by the order in
+        which the position appears in the portfolio.
+        """
+        priority = value * scale // target_allocation
+        return (priority, price, order, ticker)
+
+    @staticmethod
+    def _is_underweight(value, total, target_allocation):
+        """Whether the position is at or below its target allocation, with
+        the value and total in cents and the target allocation in allocation
+        units.
+        """
+        return (value * FixedPoint.TOTAL_ALLOCATION_UNITS <=
+                target_allocation * total)
+
+    @staticmethod
+    def buy_sequence(portfolio, buying_power, profiler=None):
+        """Yields the ticker and price in cents of every share bought, in the
+        order they are bought, when starting with the given buying power in
+        cents. The portfolio itself is not changed. If a profiler is given,
+        the drifts evaluated are counted in it.
+        """
+        profiler = profiler or Profiler()
+        values = {}
+        prices = {}
+        targets = {}
+        for position in portfolio.positions.values():
+            ticker = position.ticker
+            prices[ticker] = max(FixedPoint.to_cents(position.price), 1)
+            values[ticker] = prices[ticker] * position.qty
+            # Target allocations too small to be represented still count
+            targets[ticker] = max(FixedPoint.to_allocation_units(
+                position.target_allocation), 1)
+        scale = FixedPointRebalancer._priority_scale(targets.values())
+        heap = [FixedPointRebalancer._heap_entry(
+            order, ticker, values[ticker], prices[ticker], targets[ticker],
+            scale) for order, ticker in enumerate(targets)]
+        heapq.heapify(heap)
+        evaluations = len(heap)
+        total = sum(values.values())
+        try:
+            while buying_power > 0 and heap:
+                _, price, order, ticker = heap[0]
+                if price > buying_power:
+                    # The remaining cash only goes down, so this position can
+                    # never be bought again
+                    heapq.heappop(heap)
+                    continue
+                if not FixedPointRebalancer._is_underweight(
+                        values[ticker], total, targets[ticker]):
+                    # The drifts are compared exactly, so the position with
+                    # the lowest drift being over its target allocation means
+                    # that every other position is as well
+                    break
+                values[ticker] += price
+                total += price
+                buying_power -= price
+                yield ticker, price
+                heapq.heapreplace(heap, FixedPointRebalancer._heap_entry(
+                    order, ticker, values[ticker], price, targets[ticker],
+                    scale))
+                evaluations += 1
+        finally:
+            profiler.count('drift evaluations', evaluations)
+
+    @staticmethod
+    def buys_for_rebalancing(portfolio, profiler=None):
+        """Buys shares in the portfolio until the buying power runs out or no
+        positions remain that are below their target allocation and can be
+        afforded. Returns the number of shares bought for each ticker.
+        """
+        buying_power = FixedPoint.to_cents(portfolio.buying_power)
+        buys = {}
+        for ticker, price in FixedPointRebalancer.buy_sequence(
+                portfolio, buying_power, profiler):
+            buys[ticker] = buys.get(ticker, 0) + 1
+            buying_power -= price
+        for ticker, buy_amount in buys.items():
+            portfolio[ticker].qty += buy_amount
+        portfolio.buying_power = FixedPoint.from_cents(buying_power)
+        return buys
@@ -0,0 +1,95 @@
+import math
+
+from ws_rebalancer.heap_rebalancer import HeapRebalancer
+from ws_rebalancer.profiler import Profiler
+from ws_rebalancer.two_sided_rebalancer import TwoSidedRebalancer
+
+
+class FractionalRebalancer(HeapRebalancer):
+    """Computes buys of fractional shares that spend all of the buying power
+    while bringing the portfolio as close as possible to its target
+    allocations.
+
+    The buys are computed directly by water-filling: the positions are
+    sorted by drift, and the most underweight ones are raised together to a
+    common drift level, the highest one the buying power can pay for. This
+    takes O(n log n) work however much buying power there is.
+
+    Buys worth less than the minimum trade size are folded back into the
+    rest of the plan, by leaving those positions out and spreading the
+    buying power over the others again.
+    """
+
+    # Number of decimal places of the fractional shares that are bought
+    FRACTION_DIGITS = 6
+
+    # Number of shares below the precision that is bought that are ignored
+    # when rounding down, so that float rounding in the amount of a buy
+    # doesn't lose a whole fraction
+    _ROUNDING_TOLERANCE = 1e-9
+
+    @staticmethod
+    def _round_down(shares):
+        """Round a number of shares down to the precision that is bought, so
+        that the buys don't cost more than the buying power.
+        """
+        scale = 10 ** FractionalRebalancer.FRACTION_DIGITS
+        shares += FractionalRebalancer._ROUNDING_TOLERANCE
+        return math.floor(shares * scale) / scale
+
+    @staticmethod
+    def _water_fill(positions, values, cash):
+        """The value to buy of each position to raise the positions below the
+        common drift level up to it, given the positions sorted from the
+        most to the least underweight.
+        """
+        level = TwoSidedRebalancer._common_level(positions, values, cash,
+                                                 math.inf)
+        amounts = {}
+        for _, position in positions:
+            amount = level * position.target_allocation - values[
+                position.ticker]
+            if amount <= 0.0:
+                # Every position after this one is above the level as well
+                break
+            amounts[position.ticker] = amount
+        return amounts
+
+    @staticmethod
+    def buys_for_rebalancing(portfolio, min_trade=0.0, profiler=None):
+        """Buys fractional shares in the portfolio with all of the buying
+        power. Returns the number of shares bought for each ticker, starting
+        with the most underweight position. If a profiler is given, the
+        drifts evaluated are counted in it.
+        """
+        profiler = profiler or Profiler()
+        positions = list(enumerate(portfolio.positions.values()))
+        values = {p.ticker: p.price * p.qty for _, p in positions}
+        positions.sort(key=lambda entry: FractionalRebalancer._heap_entry(
+            entry[0], entry[1].ticker, values[entry[1].ticker],
+            entry[1].price, entry[1].target_allocation))
+        profiler.count('drift evaluations', len(positions))
+        amounts = {}
+        while positions and portfolio.buying_power > 0.0:
+            amounts = FractionalRebalancer._water_fill(
+                positions, values, portfolio.buying_power)
+            too_small = {ticker for ticker, amount in amounts.items()
+                         if amount < min_trade}
+            if not too_small:
+                break
+            # Leaving positions out only raises the level of the others, so
+            # their buys can only grow
+            positions = [(order, position) for order, position in positions
+                         if position.ticker not in too_small]
+            amounts = {}
+        buys = {}
+        for ticker, amount in amounts.items():
+            price = portfolio[ticker].price
+            shares = FractionalRebalancer._round_down(amount / price)
+            if shares > 0.0:
+                buys[ticker] = shares
+                portfolio[ticker].qty += shares
+                portfolio.buying_power -= shares * price
+        # The rounding tolerance can overspend by a tiny fraction of a cent
+        portfolio.buying_power = max(portfolio.buying_power, 0.0)
+        return buys
@@ -0,0 +1,187 @@
+import heapq
+
+from ws_rebalancer.profiler import Profiler
+
+
+class HeapRebalancer:
+    """Computes the same buys as the one-share-at-a-time greedy loop in
+    Rebalancer, but keeps the candidate positions in a priority queue so that
+    picking the next share to buy does not rescan the whole portfolio.
+
+    A position's drift percentage is ordered the same way as its value divided
+    by its target allocation, since every drift is computed against the same
+    portfolio total. Buying a share only changes the value of the position
+    being bought, so only that entry has to be updated in the queue.
+    """
+
+    @staticmethod
+    def _heap_entry(order, ticker, value, price, target_allocation):
+        """Build the priority queue entry for a position. Ties in drift are
+        broken by the lowest price, and then by the order in which the
+        position appears in the portfolio.
+
+        Positions with no value are at a drift of -100% whatever the total,
+        give or take rounding, so their drift is used to order them ahead of
+        every other position the same way the greedy loop does.
+        """
+        if value == 0.0:
+            return (HeapRebalancer._drift_pct(value, 0.0, target_allocation),
+                    price, order, ticker)
+        return (value / target_allocation, price, order, ticker)
+
+    @staticmethod
+    def _drift_pct(value, total, target_allocation):
+        """The drift percentage of a position, rounded the same way as by
+        Portfolio.drift_percentage.
+        """
+        current_allocation_pct = 0.0
+        if total > 0.0:
+            current_allocation_pct = value / total
+            current_allocation_pct *= 100
+        drift = current_allocation_pct - target_allocation
+        return (drift * 100) / target_allocation
+
+    @staticmethod
+    def _is_underweight(value, total, target_allocation):
+        """Whether the position is at or below its target allocation."""
+        return HeapRebalancer._drift_pct(value, total,
+                                         target_allocation) <= 0.0
+
+    @staticmethod
+    def buy_sequence(portfolio, buying_power, profiler=None):
+        """Yields the ticker and price of every share bought, in the order
+        the greedy loop buys them, when starting with the given buying power.
+        The portfolio itself is not changed. If a profiler is given, the
+        drifts evaluated are counted in it.
+        """
+        profiler = profiler or Profiler()
+        queue = DriftQueue(portfolio)
+        try:
+            while buying_power > 0.0:
+                share = queue.buy_next(buying_power)
+                if share is None:
+                    break
+                ticker, price = share
+                buying_power -= price
+                yield ticker, price
+        finally:
+            profiler.count('drift evaluations', queue.evaluations)
+
+    @staticmethod
+    def buys_for_rebalancing(portfolio, profiler=None):
+        """Buys shares in the portfolio until the buying power runs out or no
+        positions remain that are below their target allocation and can be
+        afforded. Returns the number of shares bought for each ticker.
+        """
+        buys = {}
+        for ticker, price in HeapRebalancer.buy_sequence(
+                portfolio, portfolio.buying_power, profiler):
+            buys[ticker] = buys.get(ticker, 0) + 1
+            portfolio.buying_power -= price
+        for ticker, buy_amount in buys.items():
+            portfolio[ticker].qty += buy_amount
+        return buys
+
+
+class DriftQueue:
+    """The positions of a portfolio in the order the greedy loop in
+    Rebalancer buys shares of them, for the engines that buy one share at a
+    time. Shares bought are only recorded in the queue, the portfolio itself
+    is not changed.
+
+    The values are added up the same way as in PortfolioOverlay, so that the
+    drift percentages are rounded exactly like in the greedy loop. Positions
+    whose entries are within TIE_TOLERANCE of each other, relative to the
+    portfolio total, may have their drift percentages rounded the other way
+    around, so they are compared by those drift percentages instead.
+
+    The number of entries built, each for the drift of a position, is kept in
+    evaluations.
+    """
+
+    TIE_TOLERANCE = 1e-12
+
+    def __init__(self, portfolio):
+        self._base_values = {}
+        self._added_values = {}
+        self._prices = {}
+        self._target_allocations = {}
+        self._base_total = portfolio._total()
+        self._added_value = 0.0
+        self._heap = []
+        self.evaluations = 0
+        for order, position in enumerate(portfolio.positions.values()):
+            ticker = position.ticker
+            self._base_values[ticker] = portfolio._value(ticker)
+            self._prices[ticker] = position.price
+            self._target_allocations[ticker] = position.target_allocation
+            self._heap.append(self._entry(order, ticker))
+        heapq.heapify(self._heap)
+
+    def _entry(self, order, ticker):
+        self.evaluations += 1
+        return HeapRebalancer._heap_entry(order, ticker, self.value(ticker),
+                                          self._prices[ticker],
+                                          self._target_allocations[ticker])
+
+    def value(self, ticker):
+        """The value of the position with the given ticker."""
+        return (self._base_values[ticker] +
+                self._added_values.get(ticker, 0.0))
+
+    @property
+    def total(self):
+        """The total value of the portfolio."""
+        return self._base_total + self._added_value
+
+    def buy_next(self, buying_power):
+        """Buy a share of the position the greedy loop buys next with the
+        given buying power. Returns the ticker and price of the share, or
+        None if no position below its target allocation can be afforded.
+        """
+        heap = self._heap
+        while heap and heap[0][1] > buying_power:
+            # The remaining cash only goes down, so this position can never
+            # be bought again
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        total = self._base_total + self._added_value
+        added_values = self._added_values
+
+        def drift_pct(entry):
+            ticker = entry[3]
+            return HeapRebalancer._drift_pct(
+                self._base_values[ticker] + added_values.get(ticker, 0.0),
+                total, self._target_allocations[ticker])
+
+        best = heap[0]
+        limit = best[0] + total * self.TIE_TOLERANCE
+        tied = []
+        # Positions with no value are already ordered by their drift
+        if best[0] > 0.0 and (len(heap) > 1 and heap[1][0] <= limit or
+                              len(heap) > 2 and heap[2][0] <= limit):
+            while heap and heap[0][0] <= limit:
+                entry = heapq.heappop(heap)
+                if entry[1] <= buying_power:
+                    tied.append(entry)
+            best = min(tied, key=lambda entry: (drift_pct(entry), entry[1],
+                                                entry[2]))
+            for entry in tied:
+                if entry is not best:
+                    heapq.heappush(heap, entry)
+        if drift_pct(best) > 0.0:
+            # The position with the lowest drift is over its target
+            # allocation, so every other position is as well
+            if tied:
+                heapq.heappush(heap, best)
+            return None
+        _, price, order, ticker = best
+        self._added_values[ticker] = (self._added_values.get(ticker, 0.0) +
+                                      price)
+        self._added_value += price
+        if tied:
+            heapq.heappush(heap, self._entry(order, ticker))
+        else:
+            heapq.heapreplace(heap, self._entry(order, ticker))
+        return ticker, price
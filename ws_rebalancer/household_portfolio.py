@@ -0,0 +1,55 @@
+from ws_rebalancer.portfolio import Portfolio
+from ws_rebalancer.position import Position
+
+
+class HouseholdPortfolio(Portfolio):
+    """Combines the portfolios of several accounts into a single portfolio,
+    so that target allocations can be set for the whole household. The
+    positions in the same ticker are merged into one, while the buying power
+    of each account is kept as a separate pool of cash, since cash can't be
+    moved between accounts when buying.
+
+    The accounts may have been read at different times, so a ticker held in
+    several of them can be quoted at different prices. The merged position
+    uses the most recent quote, or that of the first account holding the
+    ticker if none is more recent than the others.
+    """
+
+    def __init__(self, portfolios):
+        Portfolio.__init__(self, sum(portfolio.buying_power
+                                     for portfolio in portfolios.values()))
+        self._cash_pools = {account_id: portfolio.buying_power
+                            for account_id, portfolio in portfolios.items()}
+        self._holders = {}
+        for account_id, portfolio in portfolios.items():
+            for position in portfolio.positions.values():
+                ticker = position.ticker
+                self._holders.setdefault(ticker, []).append(account_id)
+                qty = position.qty
+                quote = position
+                if ticker in self.positions:
+                    qty += self[ticker].qty
+                    if not HouseholdPortfolio._is_newer(position,
+                                                        self[ticker]):
+                        quote = self[ticker]
+                self.add_position(Position(ticker, qty, quote.price,
+                                           quote_time=quote.quote_time))
+
+    @staticmethod
+    def _is_newer(position, other):
+        """Whether the price of the position was quoted after that of the
+        other position. Prices without a quote time count as the oldest.
+        """
+        if position.quote_time is None:
+            return False
+        return (other.quote_time is None or
+                position.quote_time > other.quote_time)
+
+    @property
+    def cash_pools(self):
+        """Get the buying power of each account."""
+        return dict(self._cash_pools)
+
+    def holders(self, ticker):
+        """Get the IDs of the accounts that hold the ticker."""
+        return list(self._holders.get(ticker, []))
@@ -0,0 +1,82 @@
+from ws_rebalancer.heap_rebalancer import DriftQueue, HeapRebalancer
+from ws_rebalancer.portfolio_overlay import PortfolioOverlay
+from ws_rebalancer.profiler import Profiler
+from ws_rebalancer.rebalancer import Rebalancer
+
+
+class HouseholdRebalancer(HeapRebalancer):
+    """Computes the buys of the greedy loop for a household portfolio, where
+    the target allocations are for all the accounts together but every share
+    has to be paid for with the cash of a single account.
+
+    The shares are picked in a single pass over the combined positions, the
+    same way as by the heap engine, except that a share can only be bought
+    if one of the accounts has enough cash for it. Each share is then bought
+    in an account that already holds the ticker if it can pay for it, so
+    positions aren't split across more accounts than needed, or otherwise in
+    the account with the most cash left.
+    """
+
+    @staticmethod
+    def _pick_account(holders, cash, price):
+        """The account to buy a share in, given the accounts that hold the
+        ticker and the cash left in every account.
+        """
+        for account_id in holders:
+            if cash[account_id] >= price:
+                return account_id
+        return max(cash, key=cash.get)
+
+    @staticmethod
+    def buys_for_rebalancing(household, profiler=None):
+        """Computes the shares to buy in each account of the household.
+        Returns a dict of account IDs to the number of shares bought for each
+        ticker, and the cash left in each account. The household itself is
+        not changed. If a profiler is given, the drifts evaluated are counted
+        in it.
+        """
+        profiler = profiler or Profiler()
+        cash = household.cash_pools
+        account_buys = {account_id: {} for account_id in cash}
+        holders = {}
+        queue = DriftQueue(household)
+        largest_cash = max(cash.values(), default=0.0)
+        while largest_cash > 0.0:
+            # No account ever gets more cash, so a share that the account
+            # with the most cash can't afford can never be bought
+            share = queue.buy_next(largest_cash)
+            if share is None:
+                break
+            ticker, price = share
+            if ticker not in holders:
+                holders[ticker] = household.holders(ticker)
+            account_id = HouseholdRebalancer._pick_account(holders[ticker],
+                                                           cash, price)
+            buys = account_buys[account_id]
+            buys[ticker] = buys.get(ticker, 0) + 1
+            cash[account_id] -= price
+            largest_cash = max(cash.values())
+        profiler.count('drift evaluations', queue.evaluations)
+        return account_buys, cash
+
+    @staticmethod
+    def plans_for_rebalancing(household, profiler=None):
+        """Computes the plan of each account in the household. The new
+        allocations in the plans are those of the whole household. Returns a
+        dict of account IDs to plans, in the order of the accounts in the
+        household.
+        """
+        profiler = profiler or Profiler()
+        new_portfolio = PortfolioOverlay(household)
+        with profiler.phase('rebalancing'):
+            account_buys, cash = HouseholdRebalancer.buys_for_rebalancing(
+                household, profiler)
+        for buys in account_buys.values():
+            for ticker, buy_amount in buys.items():
+                new_portfolio[ticker].qty += buy_amount
+        new_portfolio.buying_power = sum(cash.values())
+        plans = {}
+        for account_id, buys in account_buys.items():
+            plans[account_id] = Rebalancer.plan(new_portfolio, buys)
+            plans[account_id]['remaining_cash'] = cash[account_id]
+        return plans
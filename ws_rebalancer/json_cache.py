@@ -0,0 +1,72 @@
+import json
+import os
+import time
+
+
+class JsonCache:
+    """A cache of entries that is stored as a JSON file in the cache
+    directory. Every entry records when it was cached, so that entries older
+    than the maximum age are treated as missing.
+    """
+
+    FILENAME = None
+
+    # Permissions the file is written with, or None to use the defaults
+    FILE_MODE = None
+
+    def __init__(self, cache_dir, max_age):
+        self._path = os.path.join(cache_dir, self.FILENAME)
+        self._max_age = max_age
+        self._entries = {}
+        self._changed = False
+        try:
+            with open(self._path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            # A missing or corrupt cache is treated as empty
+            pass
+
+    def _get(self, key):
+        """Get the entry for the key, or None if the key is not cached or the
+        entry has expired.
+        """
+        entry = self._entries.get(key)
+        if not entry or time.time() - entry['cached_at'] > self._max_age:
+            return None
+        return entry
+
+    def _set(self, key, cached_at=None, **entry):
+        """Cache the entry for the key."""
+        if cached_at is None:
+            cached_at = time.time()
+        self._entries[key] = dict(entry, cached_at=cached_at)
+        self._changed = True
+
+    def _delete(self, key):
+        """Forget the entry for the key."""
+        if self._entries.pop(key, None) is not None:
+            self._changed = True
+
+    def clear(self):
+        """Forget every cached entry."""
+        self._entries = {}
+        self._changed = True
+
+    def save(self):
+        """Write the cache to disk if it has changed."""
+        if not self._changed:
+            return
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        tmp_path = self._path + '.tmp'
+        mode = 0o666 if self.FILE_MODE is None else self.FILE_MODE
+        # The file is created with its permissions, so that it is never
+        # readable by anyone else even for a moment
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, 'w') as f:
+            if self.FILE_MODE is not None:
+                # A file left over from an earlier save keeps its own
+                # permissions, so they are set again before writing to it
+                os.chmod(tmp_path, self.FILE_MODE)
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self._path)
+        self._changed = False
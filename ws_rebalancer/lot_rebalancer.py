@@ -0,0 +1,448 @@
+import heapq
+import math
+import sys
+
+from ws_rebalancer.heap_rebalancer import HeapRebalancer
+from ws_rebalancer.profiler import Profiler
+
+
+class LotRebalancer(HeapRebalancer):
+    """Computes the same buys as the one-share-at-a-time greedy loop in
+    Rebalancer, but buys whole lots of shares in a single step so that the
+    planning time depends on the number of positions rather than on how many
+    shares the buying power can afford.
+
+    Planning happens in two phases:
+    1. Every affordable position is raised to a common drift level in one
+       step. The level is the highest one that still leaves enough cash to
+       afford any of these positions, which means the greedy loop could not
+       have skipped a position on the way there.
+    2. The remaining cash is spent by repeatedly taking the most underweight
+       position from a priority queue and buying as many shares of it as
+       possible before the next position in the queue overtakes it.
+
+    The cash and values are updated a lot at a time rather than a share at a
+    time, so they are rounded differently than in the greedy loop. Positions
+    in the queue within ROUNDING_TOLERANCE of each other are compared by
+    their values as the greedy loop adds them up, like DriftQueue does. Any
+    other decision within ROUNDING_TOLERANCE of going the other way, such as
+    a last share that costs exactly the cash left or a portfolio that lands
+    exactly on its target allocations, is decided by the rounding of the
+    greedy loop, so the buys are then computed share by share like
+    HeapRebalancer does instead.
+    """
+
+    # Number of bisection steps used to find the common drift level
+    _LEVEL_SEARCH_STEPS = 100
+
+    # Relative difference under which the rounding of the greedy loop may
+    # decide a comparison
+    ROUNDING_TOLERANCE = 1e-12
+
+    @staticmethod
+    def _is_close(a, b, scale):
+        """Whether a and b are close enough, relative to the scale, for the
+        rounding of the greedy loop to decide which one is larger.
+        """
+        return abs(a - b) <= LotRebalancer.ROUNDING_TOLERANCE * abs(scale)
+
+    @staticmethod
+    def _shares_below_level(value, price, target_allocation, level):
+        """The number of shares that need to be bought for the position to
+        reach the given level of value per target allocation percentage.
+        """
+        if value / target_allocation >= level:
+            return 0
+        shares = math.ceil((level * target_allocation - value) / price)
+        # Correct any rounding in the estimate so that it is exact
+        while (shares > 0 and
+               (value + (shares - 1) * price) / target_allocation >= level):
+            shares -= 1
+        while (value + shares * price) / target_allocation < level:
+            shares += 1
+        return shares
+
+    @staticmethod
+    def _raise_to_common_level(positions, values, total, buying_power):
+        """Finds the highest level that every affordable position can be
+        raised to while still leaving enough cash to buy any one of them.
+        Returns the number of shares that need to be bought for each ticker
+        to reach that level, or None if the rounding of the greedy loop
+        decides which shares it buys first.
+        """
+        affordable = [position for position in positions
+                      if position.price <= buying_power]
+        if not affordable:
+            return {}
+        budget = buying_power - max(p.price for p in affordable)
+
+        def cost(level):
+            return sum(LotRebalancer._shares_below_level(
+                values[p.ticker], p.price, p.target_allocation, level) *
+                p.price for p in affordable)
+
+        affordable_value = sum(values[p.ticker] for p in affordable)
+        affordable_target = sum(p.target_allocation for p in affordable)
+        low = min(values[p.ticker] / p.target_allocation for p in affordable)
+        high = (budget + affordable_value) / affordable_target + 1
+        if len(affordable) < len(positions):
+            # Positions that can't be afforded may hold the portfolio total
+            # down. Only raise positions up to the level where they would
+            # still be under their target allocation.
+            high = min(high, total / 100)
+        if high <= low:
+            return {}
+        for _ in range(LotRebalancer._LEVEL_SEARCH_STEPS):
+            level = (low + high) / 2
+            if cost(level) <= budget:
+                low = level
+            else:
+                high = level
+        # Positions with a lower drift are bought first by the greedy loop
+        order = {p.ticker: order for order, p in enumerate(positions)}
+        affordable.sort(key=lambda p: LotRebalancer._heap_entry(
+            order[p.ticker], p.ticker, values[p.ticker], p.price,
+            p.target_allocation))
+        lots = {}
+        next_levels = []
+        for position in affordable:
+            ticker = position.ticker
+            shares = LotRebalancer._shares_below_level(
+                values[ticker], position.price, position.target_allocation,
+                low)
+            next_levels.append((values[ticker] + shares * position.price) /
+                               position.target_allocation)
+            if shares:
+                lots[ticker] = shares
+        if not lots:
+            return lots
+        # The greedy loop buys every share that starts below the level before
+        # any share that starts above it, unless the rounding of the drifts
+        # swaps them
+        last_level = max((values[p.ticker] + (lots[p.ticker] - 1) * p.price) /
+                         p.target_allocation
+                         for p in affordable if p.ticker in lots)
+        if (last_level >= min(next_levels) or
+                LotRebalancer._is_close(last_level, min(next_levels),
+                                        last_level)):
+            return None
+        if not LotRebalancer._stays_underweight(affordable, values, lots,
+                                                total, last_level):
+            return None
+        return lots
+
+    @staticmethod
+    def _stays_underweight(affordable, values, lots, total, last_level):
+        """Whether every share bought while raising the positions to a common
+        level is clearly bought under its target allocation, whatever the
+        rounding.
+
+        The position bought next is the one with the lowest level, so it is
+        under its target allocation by the amount the portfolio total is
+        above 100 times that level. That amount is the value of the positions
+        that can't be afforded, less their share of that level, plus how far
+        every affordable position is above the level. It can only be close to
+        zero when the affordable positions are all close to the same level,
+        which is searched for among the levels of the position with the
+        fewest shares bought.
+        """
+        total_bought = total + sum(lots[p.ticker] * p.price
+                                   for p in affordable if p.ticker in lots)
+        tolerance = LotRebalancer.ROUNDING_TOLERANCE * total_bought
+        if last_level * 100 < total - tolerance:
+            return True
+        affordable_value = sum(values[p.ticker] for p in affordable)
+        affordable_target = sum(p.target_allocation for p in affordable)
+        first_level = min(values[p.ticker] / p.target_allocation
+                          for p in affordable)
+
+        def margin(level):
+            return (total - affordable_value -
+                    level * (100 - affordable_target))
+
+        # How far above the level the affordable positions can all be while
+        # the position bought is close to its target allocation
+        distance = tolerance - min(margin(first_level), margin(last_level))
+        if distance < 0.0:
+            return True
+        if any(values[p.ticker] - last_level * p.target_allocation > distance
+               for p in affordable if p.ticker not in lots):
+            return True
+        fewest = min((p for p in affordable if p.ticker in lots),
+                     key=lambda p: lots[p.ticker])
+        for shares in range(lots[fewest.ticker]):
+            level = ((values[fewest.ticker] + shares * fewest.price) /
+                     fewest.target_allocation)
+            for position in affordable:
+                below = (level * position.target_allocation -
+                         values[position.ticker])
+                if below <= 0.0:
+                    close = -below <= distance
+                else:
+                    below %= position.price
+                    close = (position.price - below <= distance or
+                             below <= distance *
+                             position.target_allocation /
+                             fewest.target_allocation)
+                if not close:
+                    break
+            else:
+                return False
+        return True
+
+    @staticmethod
+    def _is_decided(value, total, target_allocation):
+        """Whether it is clear, whatever the rounding, if the position is
+        under or over its target allocation.
+        """
+        return not LotRebalancer._is_close(value * 100,
+                                           target_allocation * total,
+                                           target_allocation * total)
+
+    @staticmethod
+    def _accumulated_value(value, price, shares):
+        """The value of a position after buying the given number of shares,
+        added up a share at a time the same way as by the greedy loop.
+        """
+        added_value = 0.0
+        for _ in range(shares):
+            added_value += price
+        return value + added_value
+
+    @staticmethod
+    def _has_lower_drift(value, other_value, total, target_allocation):
+        """Whether a position with the given value surely has a lower drift
+        percentage in the greedy loop than one with the other value and the
+        same target allocation, when the portfolio total in the greedy loop
+        is within ROUNDING_TOLERANCE of the given total.
+
+        Each step of computing the drift percentage rounds the result by at
+        most half the machine epsilon relative to it, so the drifts stay
+        apart as long as the difference between them is larger than these
+        roundings. Twice the machine epsilon is used to leave some margin.
+        """
+        if value >= other_value:
+            return False
+        epsilon = 2 * sys.float_info.epsilon
+        tolerance = LotRebalancer.ROUNDING_TOLERANCE
+        highest = other_value / (total * (1 - tolerance))
+        difference = (other_value - value) / (total * (1 + tolerance))
+        difference -= epsilon * highest
+        difference = difference * 100 - epsilon * highest * 100
+        drift = (abs(highest * 100 - target_allocation) +
+                 4 * tolerance * highest * 100)
+        difference -= epsilon * drift
+        difference = difference * 100 - epsilon * drift * 100
+        difference = (difference - epsilon * drift * 100) / target_allocation
+        return difference > 0.0
+
+    @staticmethod
+    def _tie_winner(entry, heap, buying_power, initial_buying_power, total,
+                    target_allocations, greedy_value):
+        """Finds the position the greedy loop buys next among the one in the
+        entry and those in the queue within ROUNDING_TOLERANCE of it. The
+        others are left in the queue. Returns None if the rounding of the
+        greedy loop decides the tie.
+
+        With the same portfolio total and target allocation, the drift of a
+        position rounds to a value that only goes up with the value of the
+        position, although two close values may round to the same drift. The
+        position with the lowest value in the greedy loop wins the tie if its
+        drift is surely lower than those of the others, or if it also comes
+        first by price and place in the portfolio.
+        """
+        limit = entry[0] + LotRebalancer.ROUNDING_TOLERANCE * entry[0]
+        popped = []
+        while heap and heap[0][0] <= limit:
+            popped.append(heapq.heappop(heap))
+        # Positions that can't be afforded are not considered
+        tied = [entry] + [tied_entry for tied_entry in popped
+                          if tied_entry[1] <= buying_power]
+        values = {tied_entry[3]: greedy_value(tied_entry[3], 0)
+                  for tied_entry in tied}
+        winner = min(tied, key=lambda tied_entry: (values[tied_entry[3]],) +
+                     tied_entry[1:3])
+        for tied_entry in [entry] + popped:
+            if tied_entry is not winner:
+                heapq.heappush(heap, tied_entry)
+        _, price, order, ticker = winner
+        target_allocation = target_allocations[ticker]
+        for tied_entry in [entry] + popped:
+            tied_ticker = tied_entry[3]
+            if tied_entry is winner or tied_entry[1] > buying_power:
+                if LotRebalancer._is_close(tied_entry[1], buying_power,
+                                           initial_buying_power):
+                    return None
+                continue
+            if target_allocations[tied_ticker] != target_allocation:
+                return None
+            if (price, order) > tied_entry[1:3] and \
+                    not LotRebalancer._has_lower_drift(
+                        values[ticker], values[tied_ticker], total,
+                        target_allocation):
+                return None
+        return winner
+
+    @staticmethod
+    def _lot_size(entry, values, total, buying_power, heap,
+                  initial_buying_power, target_allocations, greedy_value):
+        """The number of shares of the position in the entry that the greedy
+        loop would buy in a row before another position overtakes it, it
+        becomes overweight or it can no longer be afforded. Returns None if
+        the rounding of the greedy loop decides whether the last of these
+        shares is bought.
+
+        The next time the position comes out of the queue, whether the greedy
+        loop buys any more of it is checked again, so the lot only needs to
+        be checked at its last share.
+        """
+        _, price, order, ticker = entry
+        value = values[ticker]
+        target_allocation = target_allocations[ticker]
+        competitor = heap[0] if heap else None
+
+        def key(shares):
+            return LotRebalancer._heap_entry(
+                order, ticker, value + shares * price, price,
+                target_allocation)
+
+        def can_buy(shares):
+            cash = buying_power - shares * price
+            if cash <= 0.0 or price > cash:
+                return False
+            if not LotRebalancer._is_underweight(value + shares * price,
+                                                 total + shares * price,
+                                                 target_allocation):
+                return False
+            return competitor is None or key(shares) < competitor
+
+        # can_buy(0) is always true and can_buy(high) is always false
+        low = 0
+        high = math.floor(buying_power / price) + 1
+        while high - low > 1:
+            middle = (low + high) // 2
+            if can_buy(middle):
+                low = middle
+            else:
+                high = middle
+        cash = buying_power - low * price
+        if (LotRebalancer._is_close(cash, 0.0, initial_buying_power) or
+                LotRebalancer._is_close(cash, price, initial_buying_power)):
+            return None
+        if not LotRebalancer._is_decided(value + low * price,
+                                         total + low * price,
+                                         target_allocation):
+            return None
+        # Positions with no value are ordered by their drift, which is
+        # rounded the same way as in the greedy loop
+        if (low > 0 and competitor is not None and key(low)[0] > 0.0 and
+                LotRebalancer._is_close(key(low)[0], competitor[0],
+                                        competitor[0])):
+            # Leave the tie to be decided when the position comes out of the
+            # queue again
+            if LotRebalancer._is_close(key(low - 1)[0], competitor[0],
+                                       competitor[0]):
+                return None
+            return low
+        return high
+
+    @staticmethod
+    def _lots(portfolio, profiler):
+        """The number of shares the greedy loop buys of each ticker and the
+        cash left over, or None if the rounding of the greedy loop decides
+        the buys. The queue entries built are counted in the profiler.
+        """
+        positions = list(portfolio.positions.values())
+        values = {p.ticker: p.price * p.qty for p in positions}
+        target_allocations = {p.ticker: p.target_allocation
+                              for p in positions}
+        total = sum(values.values())
+        initial_buying_power = buying_power = portfolio.buying_power
+        buys = LotRebalancer._raise_to_common_level(positions, values, total,
+                                                    buying_power)
+        if buys is None:
+            return None
+
+        def greedy_value(ticker, shares):
+            return LotRebalancer._accumulated_value(
+                portfolio._value(ticker), portfolio[ticker].price,
+                buys.get(ticker, 0) + shares)
+
+        for ticker, shares in buys.items():
+            values[ticker] += shares * portfolio[ticker].price
+            total += shares * portfolio[ticker].price
+            buying_power -= shares * portfolio[ticker].price
+        heap = [LotRebalancer._heap_entry(order, p.ticker, values[p.ticker],
+                                          p.price, p.target_allocation)
+                for order, p in enumerate(positions)]
+        heapq.heapify(heap)
+        profiler.count('drift evaluations', len(heap))
+        while heap:
+            if LotRebalancer._is_close(buying_power, 0.0,
+                                       initial_buying_power):
+                return None
+            if buying_power <= 0.0:
+                break
+            entry = heapq.heappop(heap)
+            if LotRebalancer._is_close(entry[1], buying_power,
+                                       initial_buying_power):
+                return None
+            if entry[1] > buying_power:
+                # The remaining cash only goes down, so this position can
+                # never be bought again
+                continue
+            while heap and heap[0][1] > buying_power:
+                if LotRebalancer._is_close(heap[0][1], buying_power,
+                                           initial_buying_power):
+                    return None
+                heapq.heappop(heap)
+            if (heap and entry[0] > 0.0 and
+                    LotRebalancer._is_close(entry[0], heap[0][0], entry[0])):
+                entry = LotRebalancer._tie_winner(
+                    entry, heap, buying_power, initial_buying_power, total,
+                    target_allocations, greedy_value)
+                if entry is None:
+                    return None
+            _, price, order, ticker = entry
+            target_allocation = target_allocations[ticker]
+            if not LotRebalancer._is_decided(values[ticker], total,
+                                             target_allocation):
+                return None
+            if not LotRebalancer._is_underweight(values[ticker], total,
+                                                 target_allocation):
+                # The position with the lowest drift is over its target
+                # allocation, so every other position is as well
+                break
+            shares = LotRebalancer._lot_size(entry, values, total,
+                                             buying_power, heap,
+                                             initial_buying_power,
+                                             target_allocations, greedy_value)
+            if shares is None:
+                return None
+            values[ticker] += shares * price
+            total += shares * price
+            buying_power -= shares * price
+            buys[ticker] = buys.get(ticker, 0) + shares
+            heapq.heappush(heap, LotRebalancer._heap_entry(
+                order, ticker, values[ticker], price, target_allocation))
+            profiler.count('drift evaluations')
+        return buys, buying_power
+
+    @staticmethod
+    def buys_for_rebalancing(portfolio, profiler=None):
+        """Buys shares in the portfolio until the buying power runs out or no
+        positions remain that are below their target allocation and can be
+        afforded. Returns the number of shares bought for each ticker. If a
+        profiler is given, the drifts evaluated are counted in it.
+        """
+        profiler = profiler or Profiler()
+        lots = LotRebalancer._lots(portfolio, profiler)
+        if lots is None:
+            # Only buying a share at a time rounds the cash and values the
+            # same way as the greedy loop
+            return HeapRebalancer.buys_for_rebalancing(portfolio, profiler)
+        buys, buying_power = lots
+        for ticker, buy_amount in buys.items():
+            portfolio[ticker].qty += buy_amount
+        portfolio.buying_power = buying_power
+        return buys
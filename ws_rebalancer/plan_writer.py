@@ -0,0 +1,94 @@
+import click
+import csv
+import io
+import json
+import time
+
+
+class PlanWriter:
+    """Writes rebalancing plans to stdout, either as text for people to read
+    or as JSON or CSV for other tools to consume. The plans are given as a
+    dict of account IDs to plans, where the account ID is None when only a
+    single account was rebalanced.
+    """
+
+    FORMATS = ['text', 'json', 'csv']
+
+    CSV_COLUMNS = ['account_id', 'action', 'ticker', 'quantity', 'price',
+                   'new_allocation', 'quote_time']
+
+    @staticmethod
+    def _format_time(timestamp, fmt):
+        if timestamp is None:
+            return None
+        return time.strftime(fmt, time.localtime(timestamp))
+
+    @staticmethod
+    def _trades(plan):
+        """The trades of the plan, with the sells before the buys, along with
+        the action of each trade.
+        """
+        for sell in plan['sells']:
+            yield 'sell', sell
+        for buy in plan['buys']:
+            yield 'buy', buy
+
+    @staticmethod
+    def _write_text(plans, show_quote_times):
+        for account_id, plan in plans.items():
+            if account_id is not None:
+                click.echo("Account {}:".format(account_id))
+            for action, trade in PlanWriter._trades(plan):
+                quote_time = ""
+                if show_quote_times and trade['quote_time'] is not None:
+                    quote_time = " (quoted {})".format(PlanWriter._format_time(
+                        trade['quote_time'], "%Y-%m-%d %H:%M:%S"))
+                click.echo(
+                    "{} {}X {} @ {:.2f}{} - New allocation {:.2f}%".format(
+                        action.capitalize(), trade['quantity'],
+                        trade['ticker'], trade['price'], quote_time,
+                        round(trade['new_allocation'], 2)))
+            click.echo("Remaining cash ${:.2f}".format(plan['remaining_cash']))
+
+    @staticmethod
+    def _write_json(plans):
+        accounts = []
+        for account_id, plan in plans.items():
+            account = {'account_id': account_id}
+            for action, trades in (('sells', plan['sells']),
+                                   ('buys', plan['buys'])):
+                account[action] = [
+                    dict(trade, quote_time=PlanWriter._format_time(
+                        trade['quote_time'], "%Y-%m-%dT%H:%M:%S%z"))
+                    for trade in trades]
+            account['remaining_cash'] = round(plan['remaining_cash'], 2)
+            accounts.append(account)
+        click.echo(json.dumps({'accounts': accounts}, indent=2))
+
+    @staticmethod
+    def _write_csv(plans):
+        output = io.StringIO()
+        writer = csv.DictWriter(output, PlanWriter.CSV_COLUMNS)
+        writer.writeheader()
+        for account_id, plan in plans.items():
+            for action, trade in PlanWriter._trades(plan):
+                writer.writerow(dict(
+                    trade, account_id=account_id, action=action,
+                    quote_time=PlanWriter._format_time(
+                        trade['quote_time'], "%Y-%m-%dT%H:%M:%S%z")))
+            # The remaining cash is given as the price of a cash row
+            writer.writerow({'account_id': account_id, 'action': 'cash',
+                             'price': round(plan['remaining_cash'], 2)})
+        click.echo(output.getvalue(), nl=False)
+
+    @staticmethod
+    def write(plans, output_format='text', show_quote_times=False):
+        """Write the plans in the given format. Quote times are always
+        included in the JSON and CSV formats.
+        """
+        if output_format == 'json':
+            PlanWriter._write_json(plans)
+        elif output_format == 'csv':
+            PlanWriter._write_csv(plans)
+        else:
+            PlanWriter._write_text(plans, show_quote_times)
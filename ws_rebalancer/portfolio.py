@@ -1,19 +1,80 @@
+import math
+
+
 class Portfolio:
-    """Represents a collection of positions in a portfolio."""
+    """Represents a collection of positions in a portfolio.
+
+    The value of each position and the total value of the portfolio are kept
+    up to date incrementally. Positions notify the portfolio when their
+    quantity changes, and only those positions are revalued the next time a
+    value is needed. The changes in value are added to the total exactly, so
+    that it is rounded the same way however many times the positions have
+    changed.
+    """
+
+    # Number of partial sums that the exact total may be split into before
+    # it is summed again from the values of the positions
+    _MAX_PARTIALS = 16
 
     def __init__(self, buying_power):
         self._positions = {}
         self._buying_power = buying_power
+        self._values = {}
+        self._total_value = 0.0
+        # The exact total, as partial sums that don't overlap
+        self._partials = []
+        self._dirty_tickers = set()
 
     def __getitem__(self, ticker):
         return self._positions[ticker]
 
+    @staticmethod
+    def _add_exactly(partials, value):
+        """Add the value to the exact sum kept in the partials, the same way
+        as math.fsum does.
+        """
+        i = 0
+        for partial in partials:
+            if abs(value) < abs(partial):
+                value, partial = partial, value
+            high = value + partial
+            low = partial - (high - value)
+            if low:
+                partials[i] = low
+                i += 1
+            value = high
+        partials[i:] = [value]
+
+    def _refresh(self):
+        """Revalue the positions that have changed since the last refresh."""
+        if not self._dirty_tickers:
+            return
+        partials = self._partials
+        for ticker in self._dirty_tickers:
+            position = self._positions[ticker]
+            value = position.price * position.qty
+            # Adding up the differences in value would round the total
+            # differently depending on the order of the changes, so the old
+            # and new values are added to the exact total separately
+            Portfolio._add_exactly(partials, value)
+            Portfolio._add_exactly(partials, -self._values[ticker])
+            self._values[ticker] = value
+        self._dirty_tickers.clear()
+        if len(partials) > self._MAX_PARTIALS:
+            partials.clear()
+            for value in self._values.values():
+                Portfolio._add_exactly(partials, value)
+        self._total_value = math.fsum(partials)
+
     def _total(self):
         """The total value of the portfolio."""
-        total = 0.0
-        for position in self._positions.values():
-            total += position.price * position.qty
-        return total
+        self._refresh()
+        return self._total_value
+
+    def _value(self, ticker):
+        """The value of the position with the given ticker."""
+        self._refresh()
+        return self._values[ticker]
 
     @property
     def positions(self):
@@ -34,7 +95,30 @@ class Portfolio:
 
     def add_position(self, position):
         """Add a position to the portfolio."""
+        if position.ticker not in self._positions:
+            self._values[position.ticker] = 0.0
         self._positions[position.ticker] = position
+        position.portfolio = self
+        self.invalidate(position.ticker)
+
+    def invalidate(self, ticker):
+        """Mark the position with the given ticker as changed so that it gets
+        revalued the next time the portfolio value is needed.
+        """
+        self._dirty_tickers.add(ticker)
+
+    def drift_percentage(self, ticker):
+        """Get the drift percentage of a single position in this portfolio.
+        See drift_percentages for the definition of drift percentage.
+        """
+        position = self._positions[ticker]
+        total = self._total()
+        current_allocation_pct = 0.0
+        if total > 0.0:
+            current_allocation_pct = self._values[ticker] / total
+            current_allocation_pct *= 100
+        drift = current_allocation_pct - position.target_allocation
+        return (drift * 100) / position.target_allocation
 
     def drift_percentages(self):
         """Get the drift percentages for all the positions in this portfolio.
@@ -45,21 +129,11 @@ class Portfolio:
         A positive drift percentage means that the current position allocation
         is over the target allocation.
         """
-        drift_pcts = {}
-        for position in self._positions.values():
-            current_allocation_pct = 0.0
-            if self._total() > 0.0:
-                position_value = position.price * position.qty
-                current_allocation_pct = position_value / self._total()
-                current_allocation_pct *= 100
-            drift = current_allocation_pct - position.target_allocation
-            drift_pct = (drift * 100) / position.target_allocation
-            drift_pcts[position.ticker] = drift_pct
-        return drift_pcts
+        return {ticker: self.drift_percentage(ticker)
+                for ticker in self._positions}
 
     def get_current_allocation(self, ticker):
         """Returns the portion of the current portfolio that is comprised of
         the queried ticker.
         """
-        position = self._positions[ticker]
-        return (position.price * position.qty * 100) / self._total()
+        return (self._value(ticker) * 100) / self._total()
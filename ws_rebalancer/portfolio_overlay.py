@@ -0,0 +1,168 @@
+from collections.abc import Mapping
+
+
+class OverlayPosition:
+    """A view of a position in the base portfolio of a PortfolioOverlay that
+    has the same attributes as a Position. Changing the quantity only
+    records the shares added in the overlay. The other attributes can't
+    change while the overlay is in use, so they are copied from the base
+    position up front.
+    """
+
+    __slots__ = ('_overlay', '_base_qty', 'ticker', 'price',
+                 'target_allocation', 'quote_time')
+
+    def __init__(self, overlay, position):
+        self._overlay = overlay
+        self._base_qty = position.qty
+        self.ticker = position.ticker
+        self.price = position.price
+        self.target_allocation = position.target_allocation
+        self.quote_time = position.quote_time
+
+    @property
+    def qty(self):
+        return (self._base_qty +
+                self._overlay._added_shares.get(self.ticker, 0))
+
+    @qty.setter
+    def qty(self, qty):
+        self._overlay._add_shares(self.ticker, qty - self.qty)
+
+
+class OverlayPositions(Mapping):
+    """A read-only mapping of tickers to the positions of a PortfolioOverlay.
+    """
+
+    def __init__(self, overlay):
+        self._overlay = overlay
+
+    def __getitem__(self, ticker):
+        return self._overlay[ticker]
+
+    def __iter__(self):
+        return iter(self._overlay._base.positions)
+
+    def __len__(self):
+        return len(self._overlay._base.positions)
+
+    def __contains__(self, ticker):
+        return ticker in self._overlay._base.positions
+
+
+class PortfolioOverlay:
+    """A scenario on top of a base portfolio that only records the shares
+    added to each position and the buying power left over. Everything else
+    is read from the base portfolio, so any number of overlays can share one
+    base portfolio without copying it. This has the same interface as
+    Portfolio, except that positions can't be added.
+
+    The base portfolio must not change while overlays on it are in use.
+    Overlays can themselves be used as the base of another overlay.
+    """
+
+    def __init__(self, base):
+        self._base = base
+        self._buying_power = base.buying_power
+        self._added_shares = {}
+        self._added_values = {}
+        self._added_value = 0.0
+        self._base_total = base._total()
+        self._positions = {}
+
+    @staticmethod
+    def of(base):
+        """Build an overlay on the base portfolio. Portfolio backends that
+        can compute drift faster than position by position provide their own
+        kind of overlay in OVERLAY_CLASS.
+        """
+        overlay_class = getattr(type(base), 'OVERLAY_CLASS', PortfolioOverlay)
+        return overlay_class(base)
+
+    def __getitem__(self, ticker):
+        position = self._positions.get(ticker)
+        if position is None:
+            position = OverlayPosition(self, self._base[ticker])
+            self._positions[ticker] = position
+        return position
+
+    def _add_shares(self, ticker, shares):
+        """Record shares added to (or removed from) a position."""
+        value = shares * self[ticker].price
+        self._added_shares[ticker] = (self._added_shares.get(ticker, 0) +
+                                      shares)
+        # The value added to each position is accumulated the same way as
+        # the total, so that a position never appears to be worth more than
+        # the whole portfolio due to rounding
+        self._added_values[ticker] = (self._added_values.get(ticker, 0.0) +
+                                      value)
+        self._added_value += value
+
+    def _total(self):
+        """The total value of the portfolio."""
+        return self._base_total + self._added_value
+
+    def _value(self, ticker):
+        """The value of the position with the given ticker."""
+        position = self[ticker]
+        return (position.price * position._base_qty +
+                self._added_values.get(ticker, 0.0))
+
+    @property
+    def added_shares(self):
+        """Get the number of shares added to each position in this overlay.
+        """
+        return dict(self._added_shares)
+
+    @property
+    def cash_spent(self):
+        """Get the amount of buying power spent in this overlay."""
+        return self._base.buying_power - self._buying_power
+
+    @property
+    def positions(self):
+        """Get the positions that are a part of this portfolio."""
+        return OverlayPositions(self)
+
+    @property
+    def buying_power(self):
+        """Get the amount of cash that is available to be used for trading."""
+        return self._buying_power
+
+    @buying_power.setter
+    def buying_power(self, buying_power):
+        """Set the new amount of cash that is available to be used for
+        trading.
+        """
+        self._buying_power = buying_power
+
+    def drift_percentage(self, ticker):
+        """Get the drift percentage of a single position in this portfolio.
+        See Portfolio.drift_percentages for the definition of drift
+        percentage.
+        """
+        target_allocation = self[ticker].target_allocation
+        total = self._total()
+        current_allocation_pct = 0.0
+        if total > 0.0:
+            current_allocation_pct = self._value(ticker) / total
+            current_allocation_pct *= 100
+        drift = current_allocation_pct - target_allocation
+        return (drift * 100) / target_allocation
+
+    def drift_percentages(self):
+        """Get the drift percentages for all the positions in this portfolio.
+        See Portfolio.drift_percentages for the definition of drift
+        percentage.
+        """
+        return {ticker: self.drift_percentage(ticker)
+                for ticker in self._base.positions}
+
+    def get_current_allocation(self, ticker):
+        """Returns the portion of the current portfolio that is comprised of
+        the queried ticker. An empty portfolio has no allocation.
+        """
+        total = self._total()
+        if total <= 0.0:
+            return 0.0
+        return (self._value(ticker) * 100) / total
@@ -1,11 +1,26 @@
 class Position:
-    """Holds information about a position in the portfolio."""
+    """Holds information about a position in the portfolio.
 
-    def __init__(self, ticker, qty, price, target_allocation=None):
+    Positions are stored in slots rather than an instance dict, since large
+    portfolios hold many of them and the rebalancing engines read their
+    attributes in tight loops. The quantity goes through a property, so that
+    the portfolio holding the position is told when it changes. The ticker
+    and price are read-only, since the portfolio values the position by
+    them.
+    """
+
+    __slots__ = ('_ticker', '_qty', '_price', 'target_allocation',
+                 'quote_time', '_portfolio')
+
+    def __init__(self, ticker, qty, price, target_allocation=None,
+                 quote_time=None):
         self._ticker = ticker
         self._qty = qty
         self._price = price
-        self._target_allocation = target_allocation
+        self.target_allocation = target_allocation
+        # The time the price was quoted at as a UNIX timestamp, if known
+        self.quote_time = quote_time
+        self._portfolio = None
 
     @property
     def ticker(self):
@@ -20,13 +35,18 @@ class Position:
         return self._price
 
     @property
-    def target_allocation(self):
-        return self._target_allocation
+    def portfolio(self):
+        return self._portfolio
 
     @qty.setter
     def qty(self, qty):
         self._qty = qty
+        if self._portfolio is not None:
+            self._portfolio.invalidate(self.ticker)
 
-    @target_allocation.setter
-    def target_allocation(self, target_allocation):
-        self._target_allocation = target_allocation
+    @portfolio.setter
+    def portfolio(self, portfolio):
+        """Set the portfolio that holds this position. The portfolio is told
+        whenever the quantity of this position changes.
+        """
+        self._portfolio = portfolio
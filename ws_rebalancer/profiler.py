@@ -0,0 +1,151 @@
+import click
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+class Profiler:
+    """Records where the time of a run goes: the wall time of each phase, the
+    number and latency of the calls made to the WealthSimple API, and
+    counters for the work done while planning the buys.
+
+    A disabled profiler doesn't record anything. The planning engines count
+    their work in local variables and add it to the counters once they are
+    done, so the planning loops don't take the lock for every step.
+    """
+
+    FORMATS = ['text', 'json']
+
+    # The WealthSimple API methods whose calls are recorded
+    API_METHODS = ['get_account_ids', 'get_account', 'get_positions',
+                   'get_securities_from_ticker', 'get_security']
+
+    def __init__(self, enabled=False):
+        self._enabled = enabled
+        self._phases = {}
+        self._api_calls = {}
+        self._counters = {}
+        # API calls are made from several threads at once
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @contextlib.contextmanager
+    def _timed_phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._phases[name] = self._phases.get(name, 0.0) + elapsed
+
+    def phase(self, name):
+        """Time a phase of the run. Phases with the same name add up."""
+        if not self._enabled:
+            return contextlib.nullcontext()
+        return self._timed_phase(name)
+
+    def count(self, counter, amount=1):
+        """Add to a counter."""
+        if self._enabled:
+            with self._lock:
+                self._counters[counter] = (
+                    self._counters.get(counter, 0) + amount)
+
+    def _record_api_call(self, method, elapsed):
+        with self._lock:
+            self._api_calls.setdefault(method, []).append(elapsed)
+
+    def _timed_api_method(self, method, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._record_api_call(method, time.perf_counter() - start)
+        return wrapper
+
+    def record_api_calls(self, ws):
+        """Record the calls made to the WealthSimple API through ws."""
+        if not self._enabled:
+            return
+        for method in self.API_METHODS:
+            setattr(ws, method,
+                    self._timed_api_method(method, getattr(ws, method)))
+
+    @staticmethod
+    def _peak_memory():
+        """The peak memory used by the process in bytes, or None if it can't
+        be measured on this platform.
+        """
+        if resource is None:  # pragma: no cover
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':  # pragma: no cover
+            return peak
+        return peak * 1024
+
+    def summary(self):
+        """Get everything that was recorded as a dict."""
+        api_calls = {}
+        for method, latencies in self._api_calls.items():
+            api_calls[method] = {
+                'count': len(latencies),
+                'total_seconds': sum(latencies),
+                'mean_seconds': sum(latencies) / len(latencies),
+                'max_seconds': max(latencies),
+            }
+        return {
+            'phases': dict(self._phases),
+            'api_calls': api_calls,
+            'counters': dict(self._counters),
+            'peak_memory_bytes': self._peak_memory(),
+        }
+
+    @staticmethod
+    def _format_text(summary):
+        lines = ["Profile:", "  Phases:"]
+        for name, seconds in summary['phases'].items():
+            lines.append("    {:<24} {:>10.3f}s".format(name, seconds))
+        lines.append("  API calls:")
+        for method, calls in summary['api_calls'].items():
+            lines.append(
+                "    {:<24} {:>6} calls, {:.3f}s total, {:.3f}s mean, "
+                "{:.3f}s max".format(method, calls['count'],
+                                     calls['total_seconds'],
+                                     calls['mean_seconds'],
+                                     calls['max_seconds']))
+        lines.append("  Counters:")
+        for counter, count in summary['counters'].items():
+            lines.append("    {:<24} {:>10}".format(counter, count))
+        if summary['peak_memory_bytes'] is not None:
+            lines.append("  Peak memory: {:.1f} MiB".format(
+                summary['peak_memory_bytes'] / (1024 * 1024)))
+        return "\n".join(lines)
+
+    def write(self, output_format='text', profile_file=None):
+        """Write the summary as text or JSON, to stderr unless a file is
+        given.
+        """
+        summary = self.summary()
+        if output_format == 'json':
+            text = json.dumps(summary, indent=2)
+        else:
+            text = self._format_text(summary)
+        if profile_file is None:
+            click.echo(text, err=True)
+        else:
+            with open(profile_file, 'w') as f:
+                f.write(text + "\n")
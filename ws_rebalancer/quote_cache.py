@@ -0,0 +1,21 @@
+from ws_rebalancer.json_cache import JsonCache
+
+
+class QuoteCache(JsonCache):
+    """Remembers the latest price of each ticker along with the time it was
+    quoted, so that prices that are recent enough don't have to be fetched
+    from WealthSimple again.
+    """
+
+    FILENAME = 'quotes.json'
+
+    def get(self, ticker):
+        """Get the price of the ticker and the time it was quoted, or None if
+        the ticker is not cached or the quote is too old.
+        """
+        entry = self._get(ticker)
+        return (entry['price'], entry['cached_at']) if entry else None
+
+    def set(self, ticker, price, quote_time):
+        """Remember the price of the ticker quoted at the given time."""
+        self._set(ticker, cached_at=quote_time, price=price)
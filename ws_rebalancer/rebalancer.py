@@ -1,5 +1,13 @@
-import click
-import copy
+from ws_rebalancer.exact_rebalancer import ExactRebalancer
+from ws_rebalancer.fixed_point_rebalancer import FixedPointRebalancer
+from ws_rebalancer.fractional_rebalancer import FractionalRebalancer
+from ws_rebalancer.heap_rebalancer import HeapRebalancer
+from ws_rebalancer.lot_rebalancer import LotRebalancer
+from ws_rebalancer.plan_writer import PlanWriter
+from ws_rebalancer.portfolio_overlay import PortfolioOverlay
+from ws_rebalancer.profiler import Profiler
+from ws_rebalancer.tree_rebalancer import TreeRebalancer
+from ws_rebalancer.two_sided_rebalancer import TwoSidedRebalancer
 
 
 class Rebalancer:
@@ -43,26 +51,92 @@ class Rebalancer:
         return position_with_highest_drift
 
     @staticmethod
-    def print_buys_for_rebalancing(old_portfolio):
-        """Prints a list of buys needed to bring the portfolio as close as
-        possible to the target allocations.
+    def _greedy_buys_for_rebalancing(portfolio, profiler=None):
+        """Buys one share at a time of the position with the highest drift
+        until the buying power runs out or no position can be bought. Returns
+        the number of shares bought for each ticker. If a profiler is given,
+        the iterations of the loop and the drifts evaluated are counted in it.
         """
-        new_portfolio = copy.deepcopy(old_portfolio)
+        profiler = profiler or Profiler()
         buys = {}
-        while new_portfolio.buying_power > 0.0:
-            position = Rebalancer._position_with_highest_drift(new_portfolio)
+        iterations = 0
+        while portfolio.buying_power > 0.0:
+            iterations += 1
+            position = Rebalancer._position_with_highest_drift(portfolio)
             if not position:
                 # No positions remain that are below the target allocation and
                 # have a unit price less than the remaning cash amount
                 break
-            new_portfolio[position.ticker].qty += 1
-            new_portfolio.buying_power -= position.price
+            portfolio[position.ticker].qty += 1
+            portfolio.buying_power -= position.price
             if position.ticker not in buys:
                 buys[position.ticker] = 0
             buys[position.ticker] += 1
-        for ticker, buy_amount in buys.items():
+        profiler.count('greedy iterations', iterations)
+        # Every iteration evaluates the drift of every position
+        profiler.count('drift evaluations',
+                       iterations * len(portfolio.positions))
+        return buys
+
+    @staticmethod
+    def plan_for_rebalancing(old_portfolio, engine='greedy', profiler=None,
+                             **engine_options):
+        """Computes the buys needed to bring the portfolio as close as
+        possible to the target allocations. Any engine options are passed on
+        to the engine that computes the buys. Returns the plan as a dict with
+        the list of sells, the list of buys and the remaining cash. Only the
+        two-sided engine sells anything. If a profiler is given, the time and
+        work spent planning is recorded in it.
+
+        The buys are planned in an overlay of the portfolio, so the portfolio
+        itself is left unchanged and can be planned for again.
+        """
+        profiler = profiler or Profiler()
+        new_portfolio = PortfolioOverlay.of(old_portfolio)
+        with profiler.phase('rebalancing'):
+            trades = ENGINES[engine](new_portfolio, profiler=profiler,
+                                     **engine_options)
+        return Rebalancer.plan(new_portfolio, trades)
+
+    @staticmethod
+    def plan(new_portfolio, trades):
+        """Builds the plan for the trades made in the portfolio. Engines that
+        sell return the shares sold as negative amounts.
+        """
+        plan = {'sells': [], 'buys': [],
+                'remaining_cash': new_portfolio.buying_power}
+        for ticker, trade_amount in trades.items():
             position = new_portfolio[ticker]
-            allocation = new_portfolio.get_current_allocation(ticker)
-            click.echo("Buy {}X {} @ {:.2f} - New allocation {:.2f}%".format(
-                buy_amount, ticker, position.price, round(allocation, 2)))
-        click.echo("Remaining cash ${:.2f}".format(new_portfolio.buying_power))
+            action = 'sells' if trade_amount < 0 else 'buys'
+            plan[action].append({
+                'ticker': ticker,
+                'quantity': abs(trade_amount),
+                'price': position.price,
+                'new_allocation': new_portfolio.get_current_allocation(ticker),
+                'quote_time': position.quote_time,
+            })
+        return plan
+
+    @staticmethod
+    def print_buys_for_rebalancing(old_portfolio, engine='greedy',
+                                   show_quote_times=False, **engine_options):
+        """Prints a list of buys needed to bring the portfolio as close as
+        possible to the target allocations. Any engine options are passed on
+        to the engine that computes the buys.
+        """
+        plan = Rebalancer.plan_for_rebalancing(old_portfolio, engine=engine,
+                                               **engine_options)
+        PlanWriter.write({None: plan}, show_quote_times=show_quote_times)
+
+
+# The engines that can be used to compute the buys for rebalancing
+ENGINES = {
+    'greedy': Rebalancer._greedy_buys_for_rebalancing,
+    'heap': HeapRebalancer.buys_for_rebalancing,
+    'lot': LotRebalancer.buys_for_rebalancing,
+    'exact': ExactRebalancer.buys_for_rebalancing,
+    'fixed': FixedPointRebalancer.buys_for_rebalancing,
+    'two-sided': TwoSidedRebalancer.buys_for_rebalancing,
+    'fractional': FractionalRebalancer.buys_for_rebalancing,
+    'tree': TreeRebalancer.buys_for_rebalancing,
+}
@@ -0,0 +1,198 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from requests.adapters import DEFAULT_POOLSIZE
+
+from ws_rebalancer.profiler import Profiler
+
+
+class ApiFailure(Exception):
+    """A failed call to the WealthSimple API, with the HTTP status code of
+    the response.
+    """
+
+    def __init__(self, method, status_code):
+        Exception.__init__(self, "{} failed with status {}".format(
+            method, status_code))
+        self.status_code = status_code
+
+
+class RequestScheduler:
+    """Paces the requests made to the WealthSimple API so that large runs go
+    as fast as the API allows without getting throttled.
+
+    Requests are started at most at the given rate, with bursts of up to
+    BURST requests, or as soon as possible if the rate is None. At most the
+    given number of requests are in flight at the same time. Requests that
+    get throttled or hit a server error are retried with exponential backoff
+    and random jitter, waiting at least as long as the API asks for, unless
+    they are made without retries because making them twice isn't safe.
+    Lookups that are already in flight are not made again, and wait for the
+    response of the request in flight instead.
+
+    If a profiler is given, the number of retried and coalesced requests is
+    counted in it.
+    """
+
+    # Number of requests per second that are started on average
+    RATE = 10.0
+
+    # Number of requests that can be started at once after being idle
+    BURST = 20
+
+    # Maximum number of requests in flight at the same time
+    MAX_CONCURRENCY = 8
+
+    # Number of times a throttled or failed request is retried
+    MAX_RETRIES = 5
+
+    # Number of seconds waited before the first retry, doubling with every
+    # retry up to MAX_DELAY
+    BASE_DELAY = 0.5
+
+    MAX_DELAY = 30.0
+
+    def __init__(self, rate=RATE, max_concurrency=MAX_CONCURRENCY,
+                 profiler=None):
+        self._rate = rate
+        self._max_concurrency = max_concurrency
+        self._profiler = profiler or Profiler()
+        self._tokens = float(self.BURST)
+        self._last_refill = time.monotonic()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _status_code(outcome):
+        """The status code of a response or of a failed call, or None if it
+        has none.
+        """
+        return getattr(outcome, 'status_code', None)
+
+    @staticmethod
+    def _is_retryable(status_code):
+        """Whether a request with the status code was throttled or hit a
+        server error, and may succeed if it is made again.
+        """
+        return status_code is not None and (status_code == 429 or
+                                            500 <= status_code < 600)
+
+    def _retry_delay(self, attempt, response):
+        """The number of seconds to wait before retrying a request after the
+        given number of earlier retries.
+        """
+        delay = min(self.BASE_DELAY * 2 ** attempt, self.MAX_DELAY)
+        delay = random.uniform(delay / 2, delay)
+        try:
+            # Throttled responses can say how long to wait for
+            delay = max(delay, float(response.headers['Retry-After']))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            pass
+        return delay
+
+    def _take_token(self):
+        """Wait until a request can be started without going over the
+        rate.
+        """
+        if self._rate is None:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._tokens + (now - self._last_refill) *
+                                   self._rate, self.BURST)
+                self._last_refill = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def _call_with_retries(self, name, func, args, kwargs, max_retries):
+        for attempt in range(max_retries + 1):
+            self._take_token()
+            response = None
+            with self._slots:
+                try:
+                    response = func(*args, **kwargs)
+                    status_code = self._status_code(response)
+                except Exception as e:
+                    status_code = self._status_code(e)
+                    if (not self._is_retryable(status_code) or
+                            attempt == max_retries):
+                        raise
+            if not self._is_retryable(status_code):
+                return response
+            if attempt == max_retries:
+                raise ApiFailure(name, status_code)
+            self._profiler.count('API retries')
+            time.sleep(self._retry_delay(attempt, response))
+
+    def call(self, name, func, *args, coalesce=False, retry=True, **kwargs):
+        """Make a request by calling func with the arguments, and return its
+        response. Requests that are coalesced and have the same name and
+        arguments as a request in flight share its response. Requests made
+        without retries fail with an ApiFailure the first time they are
+        throttled or hit a server error.
+        """
+        max_retries = self.MAX_RETRIES if retry else 0
+        if not coalesce:
+            return self._call_with_retries(name, func, args, kwargs,
+                                           max_retries)
+        # The arguments can be dicts of request parameters, which can't be
+        # hashed
+        key = (name, repr(args), repr(sorted(kwargs.items())))
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._in_flight[key] = Future()
+        if not is_leader:
+            self._profiler.count('coalesced API calls')
+            return future.result()
+        try:
+            future.set_result(self._call_with_retries(name, func, args,
+                                                      kwargs, max_retries))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+    def schedule_requests(self, requestor):
+        """Make the requests of a WealthSimple API requestor through the
+        scheduler. Only GET requests are coalesced and retried, since they
+        don't change anything. Logging in or refreshing a session twice could
+        use up a 2FA code or a refresh token.
+        """
+        make_request = requestor.makeRequest
+
+        def scheduled(method, endpoint, *args, **kwargs):
+            return self.call("{} {}".format(method, endpoint), make_request,
+                             method, endpoint, *args,
+                             coalesce=method == 'GET',
+                             retry=method == 'GET', **kwargs)
+        requestor.makeRequest = scheduled
+
+    def schedule_api(self, ws):
+        """Make the calls to the API methods of ws through the scheduler,
+        for APIs that fail by raising an ApiFailure rather than returning
+        a response, like ReplayApi.
+        """
+        for method in Profiler.API_METHODS:
+            func = getattr(ws, method)
+            setattr(ws, method, lambda *args, method=method, func=func:
+                    self.call(method, func, *args, coalesce=True))
+
+    def pool_connections(self, session, url):
+        """Size the connection pool of the session for the given URL so that
+        every request in flight can keep its connection alive, and no more.
+        """
+        if not hasattr(session, 'get_adapter'):
+            return
+        session.get_adapter(url).init_poolmanager(DEFAULT_POOLSIZE,
+                                                  self._max_concurrency)
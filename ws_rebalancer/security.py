@@ -1,15 +1,13 @@
-class Security:
-    """Contains information about a security on WealthSimple."""
+from collections import namedtuple
 
-    def __init__(self, security_id, ticker, price):
-        self._security_id = security_id
-        self._ticker = ticker
-        self._price = price
 
-    @property
-    def ticker(self):
-        return self._ticker
+class Security(namedtuple('Security',
+                          ['security_id', 'ticker', 'price', 'quote_time'],
+                          defaults=[None])):
+    """Contains information about a security on WealthSimple. The quote time
+    is the time the price was quoted at as a UNIX timestamp, if known.
 
-    @property
-    def price(self):
-        return self._price
+    Securities are immutable tuples, so they don't carry an instance dict.
+    """
+
+    __slots__ = ()
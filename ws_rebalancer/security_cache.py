@@ -0,0 +1,28 @@
+from ws_rebalancer.json_cache import JsonCache
+
+
+class SecurityCache(JsonCache):
+    """Remembers which WealthSimple security was chosen for each ticker in
+    the target-allocations CSV, so that later runs don't have to search for
+    the ticker or prompt for the security again. Entries expire after a while
+    in case a ticker gets reassigned to a different security.
+    """
+
+    FILENAME = 'securities.json'
+
+    # Number of seconds after which a cached security is looked up again
+    MAX_AGE = 90 * 24 * 60 * 60
+
+    def __init__(self, cache_dir):
+        JsonCache.__init__(self, cache_dir, self.MAX_AGE)
+
+    def get(self, ticker):
+        """Get the ID of the security chosen for the ticker, or None if the
+        ticker is not cached or the cached entry has expired.
+        """
+        entry = self._get(ticker)
+        return entry['security_id'] if entry else None
+
+    def set(self, ticker, security_id):
+        """Remember the ID of the security chosen for the ticker."""
+        self._set(ticker, security_id=security_id)
@@ -0,0 +1,35 @@
+from ws_rebalancer.json_cache import JsonCache
+
+
+class SessionStore(JsonCache):
+    """Remembers the refresh token of the WealthSimple session for each
+    email, so that later runs can refresh the session instead of logging in
+    with a password and 2FA again. The file is only readable by the user
+    running the tool, since anyone with the refresh token can access the
+    account.
+    """
+
+    FILENAME = 'sessions.json'
+
+    FILE_MODE = 0o600
+
+    # Number of seconds after which a saved session is no longer used
+    MAX_AGE = 30 * 24 * 60 * 60
+
+    def __init__(self, cache_dir):
+        JsonCache.__init__(self, cache_dir, self.MAX_AGE)
+
+    def get(self, email):
+        """Get the refresh token saved for the email, or None if there is no
+        session saved for it.
+        """
+        entry = self._get(email)
+        return entry['refresh_token'] if entry else None
+
+    def set(self, email, refresh_token):
+        """Save the refresh token of the session for the email."""
+        self._set(email, refresh_token=refresh_token)
+
+    def delete(self, email):
+        """Forget the session saved for the email."""
+        self._delete(email)
@@ -0,0 +1,197 @@
+import click
+import os
+import sqlite3
+import time
+
+from ws_rebalancer.position import Position
+from ws_rebalancer.wealthsimple_portfolio_reader import BACKENDS
+
+
+class Snapshot:
+    """The buying power, positions and quotes of an account as they were read
+    from WealthSimple at some point in time. Tickers that were quoted without
+    being held, such as the new tickers in the target-allocations CSV, are
+    kept with 0 shares.
+    """
+
+    def __init__(self, snapshot_id, account_id, taken_at, buying_power,
+                 rows):
+        self.snapshot_id = snapshot_id
+        self.account_id = account_id
+        self.taken_at = taken_at
+        self.buying_power = buying_power
+        # Tuples of the ticker, number of shares, price and quote time
+        self.rows = rows
+
+    def portfolio(self, backend='objects'):
+        """Build the portfolio of the account out of the positions held."""
+        portfolio = BACKENDS[backend](self.buying_power)
+        for ticker, qty, price, quote_time in self.rows:
+            if qty:
+                portfolio.add_position(Position(ticker, qty, price,
+                                                quote_time=quote_time))
+        return portfolio
+
+
+class SnapshotQuotes:
+    """Serves the quotes kept in snapshots in place of the WealthSimple API,
+    so that the securities of new tickers can be looked up offline. The ID of
+    every security is its ticker, and the latest quote of each ticker is
+    used.
+    """
+
+    def __init__(self, snapshots):
+        self._quotes = {}
+        for snapshot in sorted(snapshots, key=lambda s: s.taken_at):
+            for ticker, _, price, quote_time in snapshot.rows:
+                self._quotes[ticker] = (price, quote_time)
+
+    @property
+    def security_ids(self):
+        """The ID of the security of every ticker that has a quote."""
+        return {ticker: ticker for ticker in self._quotes}
+
+    def _security(self, ticker):
+        price, quote_time = self._quotes[ticker]
+        return {
+            'id': ticker,
+            'stock': {
+                'symbol': ticker,
+                'name': ticker,
+                'primary_exchange': 'snapshot',
+            },
+            'quote': {'amount': price},
+            'quote_time': quote_time,
+        }
+
+    def get_securities_from_ticker(self, ticker):
+        if ticker not in self._quotes:
+            return []
+        return [self._security(ticker)]
+
+    def get_security(self, security_id):
+        if security_id not in self._quotes:
+            raise click.ClickException(
+                "Security '{}' is not in the snapshot".format(security_id))
+        return self._security(security_id)
+
+
+class SnapshotStore:
+    """Keeps a history of snapshots of every account in a SQLite database in
+    the cache directory, so that the accounts can be rebalanced again without
+    logging in to WealthSimple.
+    """
+
+    FILENAME = 'snapshots.sqlite3'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id TEXT NOT NULL,
+            taken_at REAL NOT NULL,
+            buying_power REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS positions (
+            snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+            ticker TEXT NOT NULL,
+            qty REAL NOT NULL,
+            price REAL NOT NULL,
+            quote_time REAL,
+            PRIMARY KEY (snapshot_id, ticker)
+        );
+        CREATE INDEX IF NOT EXISTS snapshots_by_account
+            ON snapshots (account_id, taken_at);
+    """
+
+    def __init__(self, cache_dir):
+        self._path = os.path.join(cache_dir, self.FILENAME)
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        connection = sqlite3.connect(self._path)
+        connection.executescript(self.SCHEMA)
+        return connection
+
+    def save(self, account_id, portfolio, quotes=(), taken_at=None):
+        """Save a snapshot of the buying power and positions of the account,
+        along with the quotes of any other tickers that were looked up.
+        Returns the ID of the snapshot.
+        """
+        if taken_at is None:
+            taken_at = time.time()
+        rows = {p.ticker: (p.ticker, 0, p.price, p.quote_time)
+                for p in quotes}
+        rows.update((p.ticker, (p.ticker, p.qty, p.price, p.quote_time))
+                    for p in portfolio.positions.values())
+        with self._connect() as connection:
+            snapshot_id = connection.execute(
+                "INSERT INTO snapshots (account_id, taken_at, buying_power) "
+                "VALUES (?, ?, ?)",
+                (account_id, taken_at, portfolio.buying_power)).lastrowid
+            connection.executemany(
+                "INSERT INTO positions (snapshot_id, ticker, qty, price, "
+                "quote_time) VALUES (?, ?, ?, ?, ?)",
+                [(snapshot_id,) + row for row in rows.values()])
+        connection.close()
+        return snapshot_id
+
+    def _load(self, connection, snapshot):
+        snapshot_id, account_id, taken_at, buying_power = snapshot
+        rows = connection.execute(
+            "SELECT ticker, qty, price, quote_time FROM positions "
+            "WHERE snapshot_id = ? ORDER BY rowid", (snapshot_id,)).fetchall()
+        return Snapshot(snapshot_id, account_id, taken_at, buying_power,
+                        rows)
+
+    def get(self, snapshot_id):
+        """Get the snapshot with the given ID."""
+        connection = self._connect()
+        try:
+            snapshot = connection.execute(
+                "SELECT id, account_id, taken_at, buying_power FROM "
+                "snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+            if snapshot is None:
+                raise click.ClickException(
+                    "Snapshot {} cannot be found".format(snapshot_id))
+            return self._load(connection, snapshot)
+        finally:
+            connection.close()
+
+    def latest(self, account_ids=None):
+        """Get the latest snapshot of each account, or only of the accounts
+        with the given IDs. Returns a dict of account IDs to snapshots.
+        """
+        connection = self._connect()
+        try:
+            # Snapshots are saved in order, so the latest has the highest ID
+            snapshots = connection.execute(
+                "SELECT id, account_id, taken_at, buying_power FROM "
+                "snapshots WHERE id IN (SELECT MAX(id) FROM snapshots GROUP "
+                "BY account_id) ORDER BY id").fetchall()
+            latest = {snapshot[1]: self._load(connection, snapshot)
+                      for snapshot in snapshots}
+        finally:
+            connection.close()
+        if account_ids is None:
+            return latest
+        for account_id in account_ids:
+            if account_id not in latest:
+                raise click.ClickException(
+                    "No snapshot of account '{}' has been saved".format(
+                        account_id))
+        return {account_id: latest[account_id] for account_id in account_ids}
+
+    def history(self):
+        """Get the ID, account ID, time taken, buying power and number of
+        positions of every snapshot, oldest first.
+        """
+        connection = self._connect()
+        try:
+            return connection.execute(
+                "SELECT id, account_id, taken_at, buying_power, "
+                "(SELECT COUNT(*) FROM positions WHERE snapshot_id = "
+                "snapshots.id "
+                "AND qty != 0) FROM snapshots ORDER BY taken_at, id"
+            ).fetchall()
+        finally:
+            connection.close()
@@ -0,0 +1,84 @@
+import click
+
+from ws_rebalancer.allocation_tree import AllocationTree
+from ws_rebalancer.fixed_point import FixedPoint
+from ws_rebalancer.target_allocations_csv_reader import (
+    TargetAllocationsCsvReader
+)
+
+
+class TargetAllocationTreeCsvReader(TargetAllocationsCsvReader):
+    '''Reads and verifies a CSV-file of nested target allocations, where the
+    first column of each row is the path of an asset class or ticker, with
+    the names separated by slashes, and the second column is its target
+    allocation as a percentage of the asset class it is in. For example:
+
+        equity, 60%
+        equity/canada, 50%
+        equity/canada/XIC, 100%
+        equity/us, 50%
+        equity/us/VFV, 100%
+        bonds, 40%
+        bonds/ZAG, 100%
+
+    The last name in each path that has no rows below it is a ticker. Every
+    asset class needs a row of its own, and the target allocations of the
+    rows directly below each asset class have to add up to 100%.
+
+    The target allocation of each ticker in the portfolio is the product of
+    the target allocations along its path. The tree is kept so that the
+    tree engine can rebalance the asset classes as well as the tickers.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        TargetAllocationsCsvReader.__init__(self, *args, **kwargs)
+        self._tree = None
+
+    @property
+    def tree(self):
+        """The tree of target allocations read by update_portfolio."""
+        return self._tree
+
+    def _verify_tree(self, tree):
+        """Ensure that every node has a target allocation, that the nodes
+        directly below each node add up to 100% and that no ticker is in
+        more than one asset class.
+        """
+        for node in tree.nodes():
+            if node.target_allocation is None:
+                raise click.ClickException(
+                    "Asset class '{}' does not have a target "
+                    "allocation".format(node.path))
+        for node in [tree.root] + list(tree.nodes()):
+            if node.is_leaf:
+                continue
+            total_allocation_pct = sum(child.target_allocation
+                                       for child in node.children.values())
+            if not FixedPoint.is_total_allocation(total_allocation_pct):
+                raise click.ClickException(
+                    "Total combined allocation percentage ({}) of {} is not "
+                    "100%".format(total_allocation_pct,
+                                  "'{}'".format(node.path) if node.name
+                                  else "the top-level rows"))
+        seen_tickers = set()
+        for leaf in tree.leaves():
+            if leaf.name in seen_tickers:
+                raise click.ClickException(
+                    "Duplicate entry of ticker '{}' on row {}".format(
+                        leaf.name, leaf.row_num))
+            seen_tickers.add(leaf.name)
+
+    def _parse_rows(self, f):
+        """Read the whole tree and verify it, since the target allocation of
+        a ticker depends on the rows of the asset classes it is in. Yields
+        the row number, ticker and target allocation of the whole portfolio
+        of each ticker.
+        """
+        tree = AllocationTree()
+        for row_num, path, target_allocation in (
+                TargetAllocationsCsvReader._parse_rows(self, f)):
+            tree.add(path, target_allocation, row_num)
+        self._verify_tree(tree)
+        self._tree = tree
+        for leaf in tree.leaves():
+            yield leaf.row_num, leaf.name, tree.portfolio_allocation(leaf)
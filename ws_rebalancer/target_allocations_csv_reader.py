@@ -1,7 +1,11 @@
 import click
 import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from ws_rebalancer.fixed_point import FixedPoint
 from ws_rebalancer.position import Position
+from ws_rebalancer.profiler import Profiler
 from ws_rebalancer.security import Security
 
 
@@ -14,11 +18,44 @@ class TargetAllocationsCsvReader:
     Will compare the ticker to see if it can be found in your current
     portfolio. If it can be found, it will extract the number of shares owned.
     Otherwise, it will assume that you own 0 shares of the asset.
+
+    The CSV-file is read in two passes. The rows are first streamed from the
+    file and validated locally, so a malformed row, a duplicate ticker or
+    target allocations that don't add up to 100% are reported before any
+    request is made to WealthSimple. Only the rows with tickers that are not
+    in your portfolio are kept for the second pass, which looks them up.
+
+    Tickers that are not in your portfolio are searched for on WealthSimple
+    concurrently once the whole CSV-file has been read, and you are only
+    prompted to pick the securities once all the searches have come back. If
+    a security cache is given, the securities picked for each ticker are
+    remembered so that later runs skip both the search and the prompt. If a
+    quote cache is given, the prices of those securities are only fetched if
+    the cached quotes are too old.
+
+    Securities can also be pinned to tickers up front by passing their IDs,
+    which takes precedence over the security cache. When not interactive,
+    every new ticker has to be pinned or cached since there is nobody to pick
+    the security.
+
+    If a profiler is given, the time spent reading the CSV-file and looking
+    up the securities is recorded in it.
     '''
 
-    def __init__(self, target_allocations_csv, ws):
+    # Maximum number of requests made to WealthSimple at the same time when
+    # looking up new tickers
+    MAX_WORKERS = 8
+
+    def __init__(self, target_allocations_csv, ws, security_cache=None,
+                 quote_cache=None, security_ids=None, interactive=True,
+                 profiler=None):
         self._target_allocations_csv = target_allocations_csv
         self._ws = ws
+        self._security_cache = security_cache
+        self._quote_cache = quote_cache
+        self._security_ids = security_ids or {}
+        self._interactive = interactive
+        self._profiler = profiler or Profiler()
 
     def _verify_columns_in_row(self, row, row_num):
         """Ensure that the number of the columns in the row is expected."""
@@ -27,21 +64,27 @@ class TargetAllocationsCsvReader:
                 "Row {} malformed - expecting row in this format: "
                 "TICKER TARET_ALLOCATION".format(row_num))
 
-    def _verify_all_positions_have_target_allocation(self, portfolio):
-        """Ensure that every position in the portfolio has a target
-        allocation.
+    def _verify_all_positions_have_target_allocation(self, portfolio,
+                                                     new_rows):
+        """Ensure that every position in the portfolio, and every position
+        that is about to be added for the new rows, has a target allocation.
         """
         for position in portfolio.positions.values():
             if not position.target_allocation:
                 raise click.ClickException(
                     "Ticker {} does not have a target allocation".format(
                         position.ticker))
+        for _, ticker, target_allocation in new_rows:
+            if not target_allocation:
+                raise click.ClickException(
+                    "Ticker {} does not have a target allocation".format(
+                        ticker))
 
     def _verify_total_target_allocation(self, total_target_allocation):
         """Ensure that the total target allocation of all positions in the
-        portfolio is exactly 100.
+        portfolio is 100, up to the precision of FixedPoint.
         """
-        if total_target_allocation != 100:
+        if not FixedPoint.is_total_allocation(total_target_allocation):
             raise click.ClickException(
                 "Total combined allocation percentage ({}) of all rows is not "
                 "100%".format(total_target_allocation))
@@ -60,9 +103,10 @@ class TargetAllocationsCsvReader:
                 "Row {} - Target allocation is not a float/integer".format(
                     row_num))
 
-    def _get_security(self, ticker_query, row_num):
-        """Search for the security on WealthSimple given a ticker query."""
-        securities = self._ws.get_securities_from_ticker(ticker_query)
+    def _choose_security(self, ticker_query, row_num, securities):
+        """Prompt for the security that matches the ticker query out of the
+        securities found on WealthSimple. Returns the ID of the security.
+        """
         if len(securities) == 0:
             raise click.ClickException(
                 "Row {} - ticker '{}' cannot be found".format(row_num,
@@ -75,56 +119,155 @@ class TargetAllocationsCsvReader:
                 security_num, ticker, name, exchange))
         security_idx = click.prompt("Please input the security you want",
                                     type=int)
-        security_id = securities[security_idx]['id']
+        return securities[security_idx]['id']
+
+    def _get_security(self, security_id):
+        """Get the ticker and price of a security on WealthSimple."""
+        quote_time = time.time()
         security = self._ws.get_security(security_id)
         ticker = security['stock']['symbol']
         price = float(security['quote']['amount'])
-        return Security(security_id, ticker, price)
+        # Securities served from a snapshot were quoted when it was taken
+        quote_time = security.get('quote_time', quote_time)
+        return Security(security_id, ticker, price, quote_time=quote_time)
+
+    def _get_cached_security(self, security_id, ticker):
+        """Get the security from the quote cache, or None if there is no
+        recent enough quote for it.
+        """
+        if self._quote_cache is None:
+            return None
+        quote = self._quote_cache.get(ticker)
+        if quote is None:
+            return None
+        price, quote_time = quote
+        return Security(security_id, ticker, price, quote_time=quote_time)
+
+    def _get_security_id(self, ticker, row_num):
+        """Get the ID of the security pinned to or cached for the ticker, or
+        None if it has to be searched for.
+        """
+        if ticker in self._security_ids:
+            return self._security_ids[ticker]
+        if self._security_cache is not None:
+            security_id = self._security_cache.get(ticker)
+            if security_id is not None:
+                return security_id
+        if not self._interactive:
+            raise click.ClickException(
+                "Row {} - no security is pinned for ticker '{}'".format(
+                    row_num, ticker))
+        return None
+
+    def _get_securities(self, new_rows):
+        """Search for the securities on WealthSimple for every row with a
+        ticker that is not in the portfolio or pinned to a security. The
+        searches are done concurrently, and then the security for each row is
+        chosen in row order. The prices of the securities that are not in the
+        quote cache are then fetched in one concurrent batch. Returns the
+        securities in the same order as the rows.
+        """
+        security_ids = [self._get_security_id(ticker, row_num)
+                        for row_num, ticker, _ in new_rows]
+        # Cached securities are known to have the same ticker as the row, so
+        # their quotes can be looked up by ticker. Pinned securities are
+        # always fetched so that a wrongly pinned ID gets caught.
+        securities = [
+            self._get_cached_security(security_id, ticker)
+            if security_id is not None and ticker not in self._security_ids
+            else None
+            for (_, ticker, _), security_id in zip(new_rows, security_ids)]
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            uncached_tickers = [
+                ticker for (_, ticker, _), security_id in zip(new_rows,
+                                                              security_ids)
+                if security_id is None]
+            # Wait for every search to come back before prompting
+            searches = iter(list(executor.map(
+                self._ws.get_securities_from_ticker, uncached_tickers)))
+            for idx, (row_num, ticker, _) in enumerate(new_rows):
+                if security_ids[idx] is None:
+                    security_ids[idx] = self._choose_security(
+                        ticker, row_num, next(searches))
+            stale = [idx for idx, security in enumerate(securities)
+                     if security is None]
+            fetched = executor.map(self._get_security,
+                                   [security_ids[idx] for idx in stale])
+            for idx, security in zip(stale, fetched):
+                securities[idx] = security
+                if self._quote_cache is not None:
+                    self._quote_cache.set(security.ticker, security.price,
+                                          security.quote_time)
+        return securities
+
+    def _add_new_positions(self, portfolio, new_rows, securities):
+        """Add a position with 0 shares to the portfolio for every row with a
+        ticker that is not in the portfolio.
+        """
+        for (row_num, ticker, target_allocation), security in zip(new_rows,
+                                                                  securities):
+            if ticker != security.ticker:
+                # Ticker is not spelled correctly in the target allocations
+                # CSV file - needs to be renamed
+                raise click.ClickException(
+                    "Row {} - rename ticker '{}' to '{}'".format(
+                        row_num, ticker, security.ticker))
+            if self._security_cache is not None:
+                self._security_cache.set(ticker, security.security_id)
+            click.secho(
+                "Warning: '{}' is not in your portfolio".format(ticker),
+                fg='red', err=True)
+            position = Position(
+                security.ticker,
+                0,
+                security.price,
+                target_allocation=target_allocation,
+                quote_time=security.quote_time)
+            portfolio.add_position(position)
+
+    def _parse_rows(self, f):
+        """Stream the rows of the CSV-file, checking the number of columns,
+        the target allocation and that no ticker is repeated. Yields the row
+        number, ticker and target allocation of each row.
+        """
+        seen_tickers = set()
+        for row_num, row in enumerate(csv.reader(f)):
+            self._verify_columns_in_row(row, row_num)
+            ticker = self._sanitize_ticker(row)
+            target_allocation = self._sanitize_target_allocation(row, row_num)
+            if ticker in seen_tickers:
+                raise click.ClickException(
+                    "Duplicate entry of ticker '{}' on row {}".format(
+                        ticker, row_num))
+            seen_tickers.add(ticker)
+            yield row_num, ticker, target_allocation
 
     def update_portfolio(self, portfolio):
         """Assign target allocations to the positions in the portfolio and add
         any new positions that are present in the target-allocations CSV but
         not in the current portfolio. These are new positions that we want to
         open in our portfolio.
+
+        The whole CSV-file is validated before any new ticker is looked up on
+        WealthSimple.
         """
-        seen_tickers = set()
+        new_rows = []
         total_allocation_pct = 0.0
-        with open(self._target_allocations_csv, newline='') as f:
-            reader = csv.reader(f)
-            for row_num, row in enumerate(reader):
-                self._verify_columns_in_row(row, row_num)
-                ticker = self._sanitize_ticker(row)
-                target_allocation = self._sanitize_target_allocation(row,
-                                                                     row_num)
+        with self._profiler.phase('CSV parse'), \
+                open(self._target_allocations_csv, newline='') as f:
+            for row_num, ticker, target_allocation in self._parse_rows(f):
+                total_allocation_pct += target_allocation
                 if ticker not in portfolio.positions:
-                    # Ticker cannot be found in the current portfolio
-                    security = self._get_security(ticker, row_num)
-                    if ticker != security.ticker:
-                        # Ticker is not spelled correctly in the target
-                        # allocations CSV file - needs to be renamed
-                        raise click.ClickException(
-                            "Row {} - rename ticker '{}' to '{}'".format(
-                                row_num, ticker, security.ticker))
-                    click.secho(
-                        "Warning: '{}' is not in your portfolio".format(
-                            ticker),
-                        fg='red')
-                    position = Position(
-                        security.ticker,
-                        0,
-                        security.price,
-                        target_allocation=target_allocation)
-                    portfolio.add_position(position)
+                    # Ticker cannot be found in the current portfolio - look
+                    # it up once every row has been validated
+                    new_rows.append((row_num, ticker, target_allocation))
                 else:
                     # Ticker exists in the portfolio
                     position = portfolio[ticker]
                     position.target_allocation = target_allocation
-                if ticker in seen_tickers:
-                    raise click.ClickException(
-                        "Duplicate entry of ticker '{}' on row {}".format(
-                            ticker, row_num))
-                seen_tickers.add(ticker)
-                total_allocation_pct += target_allocation
-        self._verify_all_positions_have_target_allocation(portfolio)
+        self._verify_all_positions_have_target_allocation(portfolio, new_rows)
         self._verify_total_target_allocation(total_allocation_pct)
+        with self._profiler.phase('security lookups'):
+            securities = self._get_securities(new_rows)
+        self._add_new_positions(portfolio, new_rows, securities)
         return portfolio
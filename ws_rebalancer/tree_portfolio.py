@@ -0,0 +1,49 @@
+from ws_rebalancer.portfolio_overlay import PortfolioOverlay
+
+
+class TreePortfolio(PortfolioOverlay):
+    """An overlay of a portfolio that also keeps the value of every node in
+    a tree of target allocations up to date. Changing the quantity of a
+    position only updates the values of the nodes on the path from its
+    ticker up to the top of the tree.
+
+    Every position in the portfolio has to be a ticker in the tree.
+    """
+
+    def __init__(self, base, tree):
+        PortfolioOverlay.__init__(self, base)
+        self._tree = tree
+        self._node_values = {node: 0.0 for node in tree.nodes()}
+        for leaf in tree.leaves():
+            value = self._value(leaf.name)
+            for node in tree.ancestors(leaf):
+                self._node_values[node] += value
+
+    @property
+    def tree(self):
+        return self._tree
+
+    def _add_shares(self, ticker, shares):
+        PortfolioOverlay._add_shares(self, ticker, shares)
+        value = shares * self[ticker].price
+        for node in self._tree.ancestors(self._tree.leaf(ticker)):
+            self._node_values[node] += value
+
+    def node_value(self, node):
+        """The value of the positions in the node."""
+        return self._node_values[node]
+
+    def node_drift_percentage(self, node):
+        """Get the drift percentage of a node in the tree, which is how far
+        its share of the node it is in is from its target allocation. See
+        Portfolio.drift_percentages for the definition of drift percentage.
+        """
+        parent_value = self._total()
+        if node.parent is not self._tree.root:
+            parent_value = self._node_values[node.parent]
+        current_allocation_pct = 0.0
+        if parent_value > 0.0:
+            current_allocation_pct = self._node_values[node] / parent_value
+            current_allocation_pct *= 100
+        drift = current_allocation_pct - node.target_allocation
+        return (drift * 100) / node.target_allocation
@@ -0,0 +1,112 @@
+import heapq
+
+from ws_rebalancer.heap_rebalancer import HeapRebalancer
+from ws_rebalancer.profiler import Profiler
+from ws_rebalancer.tree_portfolio import TreePortfolio
+
+
+class TreeRebalancer(HeapRebalancer):
+    """Buys one share at a time like the greedy loop in Rebalancer, but picks
+    the share by walking down a tree of target allocations: the most
+    underweight ticker in the most underweight asset class of the most
+    underweight asset class, and so on.
+
+    Every asset class keeps the nodes directly below it in a priority queue
+    ordered by drift. Buying a share only changes the value of the nodes on
+    the path from its ticker to the top of the tree, so only those entries
+    are updated, and nothing else in the tree is recomputed.
+    """
+
+    @staticmethod
+    def _min_prices(tree, portfolio):
+        """The lowest price of a ticker in each node of the tree."""
+        min_prices = {}
+        for node in reversed(list(tree.nodes())):
+            if node.is_leaf:
+                min_prices[node] = portfolio[node.name].price
+            else:
+                min_prices[node] = min(min_prices[child]
+                                       for child in node.children.values())
+        return min_prices
+
+    @staticmethod
+    def _node_entry(order, node, tree_portfolio, min_prices):
+        """Build the priority queue entry for a node. Ties in drift are
+        broken by the lowest price of a ticker in the node, and then by the
+        order of the node in its asset class.
+        """
+        return TreeRebalancer._heap_entry(
+            order, node, tree_portfolio.node_value(node), min_prices[node],
+            node.target_allocation)
+
+    @staticmethod
+    def buys_for_rebalancing(portfolio, tree, profiler=None):
+        """Buys shares in the portfolio until the buying power runs out or
+        no ticker that is below its target allocation can be afforded.
+        Tickers over their target allocation are skipped. Returns the number
+        of shares bought for each ticker. If a profiler is given, the drifts
+        evaluated are counted in it.
+        """
+        profiler = profiler or Profiler()
+        tree_portfolio = TreePortfolio(portfolio, tree)
+        min_prices = TreeRebalancer._min_prices(tree, portfolio)
+        heaps = {}
+        evaluations = 0
+        for node in [tree.root] + list(tree.nodes()):
+            if not node.is_leaf:
+                heaps[node] = [
+                    TreeRebalancer._node_entry(order, child, tree_portfolio,
+                                               min_prices)
+                    for order, child in enumerate(node.children.values())]
+                heapq.heapify(heaps[node])
+                evaluations += len(heaps[node])
+        buys = {}
+        # Entries taken out of their asset class because the ticker, or every
+        # ticker in the node, is over its target allocation for now
+        set_aside = []
+        while tree_portfolio.buying_power > 0.0:
+            path = []
+            node = tree.root
+            while not node.is_leaf:
+                heap = heaps[node]
+                while heap and heap[0][1] > tree_portfolio.buying_power:
+                    # The remaining cash only goes down, so nothing in this
+                    # node can ever be bought again
+                    heapq.heappop(heap)
+                if not heap:
+                    break
+                node = heap[0][3]
+                path.append(node)
+            if node.is_leaf and tree_portfolio.drift_percentage(
+                    node.name) <= 0.0:
+                ticker = node.name
+                position = tree_portfolio[ticker]
+                position.qty += 1
+                tree_portfolio.buying_power -= position.price
+                buys[ticker] = buys.get(ticker, 0) + 1
+                for node in path:
+                    heap = heaps[node.parent]
+                    order = heap[0][2]
+                    heapq.heapreplace(heap, TreeRebalancer._node_entry(
+                        order, node, tree_portfolio, min_prices))
+                evaluations += len(path)
+                # The share lowered the allocation of every other ticker
+                for parent, entry in set_aside:
+                    heapq.heappush(heaps[parent], entry)
+                set_aside = []
+            elif path:
+                # Skip the ticker, or the asset class with nothing left to
+                # buy in it, and look for the next ticker to buy in the asset
+                # class above it
+                node = path[-1]
+                set_aside.append((node.parent,
+                                  heapq.heappop(heaps[node.parent])))
+            else:
+                # Every ticker is over its target allocation or can't be
+                # afforded
+                break
+        profiler.count('drift evaluations', evaluations)
+        for ticker, buy_amount in buys.items():
+            portfolio[ticker].qty += buy_amount
+        portfolio.buying_power = tree_portfolio.buying_power
+        return buys
@@ -0,0 +1,146 @@
+import math
+
+from ws_rebalancer.heap_rebalancer import HeapRebalancer
+from ws_rebalancer.profiler import Profiler
+
+
+class TwoSidedRebalancer(HeapRebalancer):
+    """Computes both the sells and the buys that bring the portfolio close to
+    its target allocations. Overweight positions are trimmed down to their
+    target allocation to fund the underweight ones, so that large drifts can
+    be corrected without new cash.
+
+    The trades are computed from the positions sorted by drift, rather than
+    one share at a time:
+    1. The target value of every position is its target allocation of the
+       portfolio total, less the cash reserve. Overweight positions sell the
+       whole shares that are above their target value.
+    2. The cash is spread over the underweight positions by raising the most
+       underweight ones together to a common drift level, the highest one
+       the cash can pay for. The shares needed to reach that level are
+       rounded down.
+    3. The cash left over from rounding buys at most one more share of each
+       position that is still at or below its target allocation, starting
+       with the most underweight one.
+
+    Trades worth less than the minimum trade size are dropped, except for
+    the sells needed to raise the cash reserve, which is never spent.
+    Positions that are sold are not bought back.
+    """
+
+    @staticmethod
+    def _sells(positions, values, target_values, min_trade, shortfall=0.0):
+        """The number of shares to sell of each overweight position, starting
+        with the most overweight one. Positions are sold down to their target
+        value, or further if that is needed to make up the shortfall of cash
+        for the cash reserve. Sells that are only needed to rebalance are
+        dropped if they are worth less than the minimum trade size, but the
+        sells needed for the cash reserve are always made.
+        """
+        sells = {}
+        for _, position in positions:
+            excess = values[position.ticker] - target_values[position.ticker]
+            if excess <= 0.0:
+                continue
+            shares = math.floor(excess / position.price)
+            if shares * position.price < min_trade:
+                shares = 0
+            if shares * position.price < shortfall:
+                shares = min(math.ceil(shortfall / position.price),
+                             position.qty)
+            if shares > 0:
+                sells[position.ticker] = shares
+                shortfall -= shares * position.price
+        return sells
+
+    @staticmethod
+    def _common_level(positions, values, cash, max_level):
+        """The highest value per target allocation percentage that all the
+        positions below it can be raised to with the cash, given the
+        positions sorted from the most to the least underweight.
+        """
+        level = max_level
+        total_value = 0.0
+        total_target = 0.0
+        for i, (_, position) in enumerate(positions):
+            total_value += values[position.ticker]
+            total_target += position.target_allocation
+            level = (cash + total_value) / total_target
+            if i + 1 == len(positions):
+                break
+            _, next_position = positions[i + 1]
+            if (values[next_position.ticker] /
+                    next_position.target_allocation >= level):
+                break
+        return min(level, max_level)
+
+    @staticmethod
+    def buys_for_rebalancing(portfolio, min_trade=0.0, cash_reserve=0.0,
+                             profiler=None):
+        """Sells and buys shares in the portfolio, leaving at least the cash
+        reserve unspent. Returns the number of shares traded for each ticker,
+        with the sells first as negative numbers of shares. If a profiler is
+        given, the drifts evaluated are counted in it.
+        """
+        profiler = profiler or Profiler()
+        positions = list(enumerate(portfolio.positions.values()))
+        values = {p.ticker: p.price * p.qty for _, p in positions}
+        investable = max(sum(values.values()) + portfolio.buying_power -
+                         cash_reserve, 0.0)
+        target_values = {p.ticker: investable * p.target_allocation / 100
+                         for _, p in positions}
+
+        def by_drift(entry):
+            order, position = entry
+            return TwoSidedRebalancer._heap_entry(
+                order, position.ticker, values[position.ticker],
+                position.price, position.target_allocation)
+
+        positions.sort(key=by_drift)
+        profiler.count('drift evaluations', len(positions))
+        sells = TwoSidedRebalancer._sells(
+            reversed(positions), values, target_values, min_trade,
+            cash_reserve - portfolio.buying_power)
+        cash = portfolio.buying_power - cash_reserve
+        for ticker, shares in sells.items():
+            values[ticker] -= shares * portfolio[ticker].price
+            cash += shares * portfolio[ticker].price
+
+        # Buying back what was sold for the cash reserve would spend it again
+        underweight = [(order, position) for order, position in positions
+                       if position.ticker not in sells and
+                       values[position.ticker] <
+                       target_values[position.ticker]]
+        buys = {}
+        if underweight and cash > 0.0:
+            level = TwoSidedRebalancer._common_level(
+                underweight, values, cash, investable / 100)
+            for _, position in underweight:
+                shortfall = (level * position.target_allocation -
+                             values[position.ticker])
+                shares = max(math.floor(shortfall / position.price), 0)
+                if shares > 0 and shares * position.price >= min_trade:
+                    buys[position.ticker] = shares
+                    cash -= shares * position.price
+            for ticker, shares in buys.items():
+                values[ticker] += shares * portfolio[ticker].price
+            # Spend what is left over from rounding down on the positions
+            # that are still the most underweight
+            underweight.sort(key=by_drift)
+            profiler.count('drift evaluations', len(underweight))
+            for _, position in underweight:
+                ticker = position.ticker
+                shares = buys.get(ticker, 0) + 1
+                if (position.price <= cash and
+                        values[ticker] <= target_values[ticker] and
+                        shares * position.price >= min_trade):
+                    buys[ticker] = shares
+                    values[ticker] += position.price
+                    cash -= position.price
+
+        trades = {ticker: -shares for ticker, shares in sells.items()}
+        trades.update(buys)
+        for ticker, shares in trades.items():
+            portfolio[ticker].qty += shares
+            portfolio.buying_power -= shares * portfolio[ticker].price
+        return trades
@@ -1,14 +1,33 @@
 import click
 import wealthsimple
 
+from ws_rebalancer.request_scheduler import RequestScheduler
+
 
 class WealthSimpleLogin(wealthsimple.WSTrade):
     """Wraps the WealthSimple Trade API with a login interface. This class can
     is used to login to the client's WealthSimple account and interact with the
     WealthSimple Trade API.
+
+    If a session store is given, the session is saved in it after logging in,
+    and later logins refresh the saved session instead of logging in with the
+    email and password. If the saved session can't be refreshed, this falls
+    back to logging in with the email and password, prompting for the password
+    if it wasn't given. When not interactive, nothing is prompted for and the
+    login fails instead.
+
+    Every request made to the API, starting with the login, goes through a
+    request scheduler, which keeps the requests under the rate limits of the
+    API and retries the lookups that get throttled.
     """
 
-    def __init__(self, email, password, two_factor_auth=False):
+    def __init__(self, email, password, two_factor_auth=False,
+                 session_store=None, interactive=True,
+                 request_scheduler=None):
+        self._session_store = session_store
+        self._interactive = interactive
+        self._request_scheduler = request_scheduler or RequestScheduler()
+        self._scheduled_requestor = None
         two_factor_callback = (
             self.two_factor_function if two_factor_auth else None)
         wealthsimple.WSTrade.__init__(self,
@@ -16,10 +35,85 @@ class WealthSimpleLogin(wealthsimple.WSTrade):
                                       password,
                                       two_factor_callback=two_factor_callback)
 
+    def _schedule_requests(self):
+        """Make the requests of the API requestor go through the request
+        scheduler. WSTrade creates the requestor and logs in right away, so
+        this is done when the login starts.
+        """
+        if self._scheduled_requestor is self.TradeAPI:
+            return
+        self._request_scheduler.schedule_requests(self.TradeAPI)
+        self._request_scheduler.pool_connections(
+            self.session, getattr(self, 'APIMAIN', ''))
+        self._scheduled_requestor = self.TradeAPI
+
     def two_factor_function(self):
         """Retrieves the two-factor auth code from the client."""
+        if not self._interactive:
+            raise Exception(
+                "A 2FA code is needed to log in, which can't be entered in "
+                "headless mode - log in once without --headless to save a "
+                "session")
         MFACode = ""
         while not MFACode:
             # Obtain user input and ensure it is not empty
             MFACode = click.prompt("Enter 2FA code")
         return MFACode
+
+    def _start_session(self, email, response):
+        """Use the access token from a login response for the API calls, and
+        save the refresh token if there is a session store.
+        """
+        self.session.headers.update(
+            {"Authorization": response.headers["X-Access-Token"]})
+        if (self._session_store is not None and
+                "X-Refresh-Token" in response.headers):
+            self._session_store.set(email, response.headers["X-Refresh-Token"])
+            self._session_store.save()
+
+    def _refresh_session(self, email, refresh_token):
+        """Refresh a saved session. Returns whether the session could be
+        refreshed.
+        """
+        response = self.TradeAPI.makeRequest(
+            "POST", "auth/refresh", [("refresh_token", refresh_token)])
+        if (response is None or response.status_code != 200 or
+                "X-Access-Token" not in response.headers):
+            self._session_store.delete(email)
+            self._session_store.save()
+            return False
+        self._start_session(email, response)
+        return True
+
+    def login(self, email=None, password=None, two_factor_callback=None):
+        """Login to the WealthSimple Trade account, reusing the saved session
+        if there is one.
+        """
+        self._schedule_requests()
+        if self._session_store is not None:
+            refresh_token = self._session_store.get(email)
+            if refresh_token and self._refresh_session(email, refresh_token):
+                return
+        if email and not password and self._interactive:
+            password = click.prompt("Password", hide_input=True)
+        if not email or not password:
+            raise Exception("Missing login credentials")
+        data = [
+            ("email", email),
+            ("password", password),
+        ]
+        response = self.TradeAPI.makeRequest("POST", "auth/login", data)
+        if response is None:
+            raise Exception("Unable to reach WealthSimple")
+        # Check if account requires 2FA
+        if "x-wealthsimple-otp" in response.headers:
+            if two_factor_callback is None:
+                raise Exception(
+                    "This account requires 2FA. A 2FA callback function must "
+                    "be provided")
+            # Make a second login request using the 2FA code
+            data.append(("otp", two_factor_callback()))
+            response = self.TradeAPI.makeRequest("POST", "auth/login", data)
+        if response.status_code == 401:
+            raise Exception("Invalid Login")
+        self._start_session(email, response)
@@ -1,36 +1,110 @@
 import click
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from ws_rebalancer.array_portfolio import ArrayPortfolio
 from ws_rebalancer.portfolio import Portfolio
 from ws_rebalancer.position import Position
+from ws_rebalancer.profiler import Profiler
 
 
 class WealthSimplePortfolioReader:
     """Reads in the selected WealthSimple account along with the buying power
     and positions in that account and generates a Portfolio object with this
-    information to be used for rebalancing.
+    information to be used for rebalancing. If a quote cache is given, the
+    prices of the positions are saved in it. If a profiler is given, the
+    time spent fetching the accounts is recorded in it.
     """
 
-    def __init__(self, ws):
+    # Maximum number of requests made to WealthSimple at the same time when
+    # reading in every account
+    MAX_WORKERS = 8
+
+    def __init__(self, ws, backend='objects', quote_cache=None,
+                 profiler=None):
         self._ws = ws
+        self._backend = backend
+        self._quote_cache = quote_cache
+        self._profiler = profiler or Profiler()
+
+    def _get_positions(self, account_id):
+        """Get the positions in the account along with the time they were
+        quoted at.
+        """
+        quote_time = time.time()
+        return self._ws.get_positions(account_id), quote_time
 
-    def _generate_portfolio(self, buying_power, positions):
-        portfolio = Portfolio(buying_power)
+    def _generate_portfolio(self, buying_power, positions, quote_time):
+        portfolio = BACKENDS[self._backend](buying_power)
         for position in positions:
             ticker = position['stock']['symbol']
             qty = position['quantity']
             price = float(position['quote']['amount'])
-            position = Position(ticker, qty, price)
+            if self._quote_cache is not None:
+                self._quote_cache.set(ticker, price, quote_time)
+            position = Position(ticker, qty, price, quote_time=quote_time)
             portfolio.add_position(position)
         return portfolio
 
-    def get_portfolio(self):
-        account_ids = self._ws.get_account_ids()
-        for account_num, account_id in enumerate(account_ids):
-            click.echo("{}. {}".format(account_num, account_id))
-        account_idx = click.prompt("Please input the account you want",
-                                   type=int)
-        account_id = account_ids[account_idx]
+    def _get_buying_power(self, account_id):
         account = self._ws.get_account(account_id)
-        buying_power = float(account['buying_power']['amount'])
-        positions = self._ws.get_positions(account_id)
-        return self._generate_portfolio(buying_power, positions)
+        return float(account['buying_power']['amount'])
+
+    def choose_account(self, account_id=None):
+        """Get the ID of the account to read in. You are prompted for the
+        account unless its ID is given, in which case it is checked that the
+        account exists.
+        """
+        account_ids = self._ws.get_account_ids()
+        if account_id is None:
+            for account_num, account_id in enumerate(account_ids):
+                click.echo("{}. {}".format(account_num, account_id))
+            account_idx = click.prompt("Please input the account you want",
+                                       type=int)
+            account_id = account_ids[account_idx]
+        elif account_id not in account_ids:
+            raise click.ClickException(
+                "Account '{}' cannot be found".format(account_id))
+        return account_id
+
+    def read_account(self, account_id):
+        """Reads in the account with the given ID."""
+        with self._profiler.phase('account fetch'):
+            buying_power = self._get_buying_power(account_id)
+            positions, quote_time = self._get_positions(account_id)
+            return self._generate_portfolio(buying_power, positions,
+                                            quote_time)
+
+    def get_portfolio(self, account_id=None):
+        """Reads in a single account. You are prompted for the account unless
+        its ID is given.
+        """
+        return self.read_account(self.choose_account(account_id))
+
+    def get_portfolios(self):
+        """Reads in every account without prompting for one. The buying power
+        and positions of all the accounts are fetched concurrently. Returns a
+        dict of account IDs to portfolios, in the order WealthSimple returns
+        the accounts.
+        """
+        account_ids = self._ws.get_account_ids()
+        with self._profiler.phase('account fetch'), \
+                ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            buying_powers = [executor.submit(self._get_buying_power,
+                                             account_id)
+                             for account_id in account_ids]
+            positions = [executor.submit(self._get_positions, account_id)
+                         for account_id in account_ids]
+            return {
+                account_id: self._generate_portfolio(
+                    buying_power.result(), *account_positions.result())
+                for account_id, buying_power, account_positions in zip(
+                    account_ids, buying_powers, positions)
+            }
+
+
+# The classes that can be used to store the positions of a portfolio
+BACKENDS = {
+    'objects': Portfolio,
+    'arrays': ArrayPortfolio,
+}